@@ -2,29 +2,1417 @@ import os
 import sys
 import time
 import logging
+import html
+import codecs
+import copy
+import io
+import itertools
+import multiprocessing
+import queue
+import uuid
+import weakref
+import zipfile
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from bs4 import BeautifulSoup
+from bs4.element import PreformattedString
+from bs4.builder import builder_registry
+from lxml import etree
 from docx import Document
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
 from docx.enum.style import WD_STYLE_TYPE
 from docx.oxml.shared import OxmlElement, qn
+from docx.oxml.table import CT_Tbl
+from docx.parts.styles import StylesPart
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.pkgwriter import _ContentTypesItem
 import win32serviceutil
 import win32service
 import win32event
 import servicemanager
 import socket
 import re
+import threading
+
+# Parser backends understood by BeautifulSoup, fastest first.
+# 'html.parser' is pure Python and always available; 'lxml' and 'html5lib'
+# are used only when the corresponding package is installed.
+PARSER_BACKENDS = ('lxml', 'html.parser', 'html5lib')
+
+# With parser='auto', inputs at or above this size (in bytes) are parsed
+# with lxml; smaller inputs keep the html.parser tree they always had.
+LXML_SIZE_THRESHOLD = 32 * 1024
+
+# Elements whose children are processed as if they sat directly in <body>.
+# Tags without a registered handler are treated the same way.
+CONTAINER_TAGS = frozenset([
+    'div', 'span', 'section', 'article', 'main', 'nav', 'header', 'footer',
+    'aside', 'blockquote', 'figure', 'figcaption', 'center', 'form', 'fieldset',
+    'details', 'summary', 'address', 'dl', 'dt', 'dd', 'li', 'a', 'font',
+])
+
+# Elements whose content never appears in the Word document.
+IGNORED_TAGS = frozenset([
+    'head', 'title', 'meta', 'link', 'script', 'noscript', 'template',
+    'svg', 'canvas', 'iframe', 'object', 'embed', 'select', 'button', 'input',
+    'textarea',
+])
+
+HEADING_LEVELS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+
+# Word paragraph styles of headings by level (0 is the document title), and
+# of list items by list style.
+HEADING_STYLES = {0: 'Title', 1: 'Heading 1', 2: 'Heading 2', 3: 'Heading 3',
+                  4: 'Heading 4', 5: 'Heading 5', 6: 'Heading 6'}
+LIST_STYLES = ('List Bullet', 'List Number')
+
+# Direct formatting used when a template leaves one of those styles
+# undefined, as Word-authored templates often do: the bold font size of a
+# heading, in points, and the marker prefixed to a list item.
+HEADING_FALLBACK_SIZES = {0: 26, 1: 16, 2: 14, 3: 13, 4: 12, 5: 11, 6: 11}
+LIST_FALLBACK_MARKERS = {'List Bullet': '\u2022 ', 'List Number': '{number}. '}
+
+# Elements grouping the rows of a table, and the cells of a row.
+TABLE_SECTION_TAGS = frozenset(['thead', 'tbody', 'tfoot'])
+TABLE_CELL_TAGS = ['td', 'th']
+
+# Word table style given to converted tables, when the template has it.
+TABLE_STYLE = 'Table Grid'
+
+# Largest colspan and rowspan values browsers honour.
+MAX_COLSPAN = 1000
+MAX_ROWSPAN = 65534
+
+# Elements that follow w:shd in a w:tcPr, in schema order.
+SHADING_SUCCESSORS = (
+    'w:noWrap', 'w:tcMar', 'w:textDirection', 'w:tcFitText', 'w:vAlign',
+    'w:hideMark', 'w:headers', 'w:cellIns', 'w:cellDel', 'w:cellMerge', 'w:tcPrChange',
+)
+
+# Tokens of a 'background' shorthand value that may be its color; url()
+# is matched whole so file names inside it are not taken for color names.
+BACKGROUND_COLOR_RE = re.compile(r'url\([^)]*\)|#[0-9a-fA-F]{3,6}\b|rgba?\([^)]*\)|\b[a-zA-Z]+\b')
+
+# Cell text python-docx must split into w:tab and w:br elements.
+CELL_TEXT_BREAK_RE = re.compile(r'[\t\n\r]')
+
+# Bytes read from disk per incremental parser feed in streaming mode.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Leading bytes inspected for a byte order mark or <meta charset>.
+ENCODING_SNIFF_SIZE = 4 * 1024
+
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16le'),
+    (codecs.BOM_UTF16_BE, 'utf-16be'),
+)
+
+# Elements that never have an end tag in serialised HTML.
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr',
+])
+
+# Elements whose content html.parser reads as raw text, so it must not be escaped.
+RAW_TEXT_TAGS = frozenset(['script', 'style'])
+
+META_CHARSET_RE = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([A-Za-z0-9_.:-]+)', re.IGNORECASE)
+
+# Labels browsers decode as windows-1252 regardless of what they say.
+WINDOWS_1252_ALIASES = frozenset(['iso-8859-1', 'iso8859-1', 'latin1', 'latin-1', 'us-ascii', 'ascii'])
+
+
+# Margin set on every section of the default template (0.5cm).
+PAGE_MARGIN = Inches(0.2)
+
+# Parsed .docx templates kept per process, keyed by path and modification time.
+TEMPLATE_CACHE_SIZE = 8
+
+# Output writers: 'docx' builds blocks through python-docx and saves the
+# document; 'stream' builds w:p and w:r elements directly and writes
+# word/document.xml into the zip while converting.
+WRITER_BACKENDS = ('docx', 'stream')
+
+# Blocks the stream writer lets accumulate in the body before writing them out.
+WRITER_FLUSH_BLOCKS = 256
+
+# Zip compression methods for the .docx package.
+ZIP_COMPRESSION = {'deflate': zipfile.ZIP_DEFLATED, 'store': zipfile.ZIP_STORED}
+
+# Entry timestamp of deterministic packages (the earliest a zip can record).
+DETERMINISTIC_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Suffix of the temporary file a .docx is written to before being renamed into place.
+STAGING_SUFFIX = '.tmp'
+
+# Seconds between polls of a file being written: the first poll, and the
+# ceiling the interval backs off to while the file keeps changing.
+STABILITY_INITIAL_INTERVAL = 0.05
+STABILITY_MAX_INTERVAL = 1.0
+
+# Seconds a polled file must stay unchanged before it counts as written;
+# writers routinely pause for longer than a polling interval.
+STABILITY_QUIET_PERIOD = 1.0
+
+# Seconds an empty new file is watched before it is given up on.
+EMPTY_FILE_TIMEOUT = 60.0
+
+# Conversion worker pool behind the folder handler; both can be set from
+# the environment, since the service takes no arguments.
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_QUEUE_DEPTH = 100
+WORKERS_ENV = 'HTML_CONVERTER_WORKERS'
+QUEUE_DEPTH_ENV = 'HTML_CONVERTER_QUEUE_DEPTH'
+
+# Number of worker processes to convert in; unset or 0 converts in threads.
+PROCESSES_ENV = 'HTML_CONVERTER_PROCESSES'
+
+# Executable names of a Python interpreter, as opposed to a host such as pythonservice.exe.
+PYTHON_EXECUTABLE_RE = re.compile(r'pythonw?(\d+(\.\d+)*)?(\.exe)?$', re.IGNORECASE)
+
+# Distinct style attribute strings kept by the shared declaration cache.
+DECLARATION_CACHE_SIZE = 4096
+
+
+class StyleDeclarations(Mapping):
+    """Immutable, hashable mapping of CSS property names to values.
+    
+    Instances with the same declarations are interned, so two elements
+    styled alike share one object and can be compared by identity.
+    """
+    
+    __slots__ = ('_declarations', '_hash', '__weakref__')
+    
+    _interned = weakref.WeakValueDictionary()
+    
+    def __new__(cls, declarations=()):
+        declarations = dict(declarations)
+        key = frozenset(declarations.items())
+        instance = cls._interned.get(key)
+        if instance is None:
+            instance = super().__new__(cls)
+            instance._declarations = declarations
+            instance._hash = hash(key)
+            cls._interned[key] = instance
+        return instance
+    
+    def __getitem__(self, name):
+        return self._declarations[name]
+    
+    def __iter__(self):
+        return iter(self._declarations)
+    
+    def __len__(self):
+        return len(self._declarations)
+    
+    def __hash__(self):
+        return self._hash
+    
+    def __eq__(self, other):
+        if isinstance(other, StyleDeclarations):
+            return self is other or self._declarations == other._declarations
+        return Mapping.__eq__(self, other)
+    
+    def __repr__(self):
+        return f"StyleDeclarations({self._declarations!r})"
+
+
+EMPTY_DECLARATIONS = StyleDeclarations()
+
+
+@lru_cache(maxsize=DECLARATION_CACHE_SIZE)
+def parse_declarations(style_string):
+    """Parse a CSS declaration block such as an inline style attribute.
+    
+    Results are cached by the raw string, so repeated style attributes
+    are split only once; see declaration_cache_info() for hit counts.
+    """
+    declarations = {}
+    for rule in style_string.split(';'):
+        if ':' in rule:
+            property_name, value = rule.split(':', 1)
+            declarations[property_name.strip()] = value.strip()
+    return StyleDeclarations(declarations)
+
+
+def declaration_cache_info():
+    """Return hits, misses, maxsize and currsize of the declaration cache."""
+    return parse_declarations.cache_info()
+
+
+@lru_cache(maxsize=DECLARATION_CACHE_SIZE)
+def merge_declarations(base, override):
+    """Return base updated with override, reusing base when nothing changes."""
+    if not override:
+        return base
+    if not base:
+        return override
+    merged = dict(base)
+    merged.update(override)
+    return StyleDeclarations(merged)
+
+
+# Properties a child takes from its parent's computed style. text-decoration
+# is not inherited in CSS, but it is drawn through descendants' text, which
+# in Word means setting it on their runs.
+INHERITED_PROPERTIES = frozenset([
+    'color', 'font-family', 'font-size', 'font-style', 'font-weight',
+    'line-height', 'text-align', 'text-decoration',
+])
+
+COMPUTED_STYLE_CACHE_SIZE = 8192
+
+# Formatting inline tags force on their run in a paragraph.
+INLINE_TAG_STYLES = {
+    'strong': StyleDeclarations({'font-weight': 'bold'}),
+    'b': StyleDeclarations({'font-weight': 'bold'}),
+    'em': StyleDeclarations({'font-style': 'italic'}),
+    'i': StyleDeclarations({'font-style': 'italic'}),
+    'u': StyleDeclarations({'text-decoration': 'underline'}),
+}
+
+# Absolute font-size keywords and the default ('medium') size, in pixels.
+FONT_SIZE_KEYWORDS = {
+    'xx-small': 9.0, 'x-small': 10.0, 'small': 13.0, 'medium': 16.0,
+    'large': 18.0, 'x-large': 24.0, 'xx-large': 32.0,
+}
+DEFAULT_FONT_SIZE = FONT_SIZE_KEYWORDS['medium']
+
+
+def resolve_font_size(value, parent_size=None):
+    """Resolve a relative CSS font-size against the parent's size.
+    
+    em, %, rem, keywords and 'smaller'/'larger' become a px value; other
+    values are returned unchanged.
+    """
+    keyword = value.strip().lower()
+    base = parse_css_pixels(parent_size) if parent_size else None
+    if base is None:
+        base = DEFAULT_FONT_SIZE
+    if keyword in FONT_SIZE_KEYWORDS:
+        size = FONT_SIZE_KEYWORDS[keyword]
+    elif keyword == 'smaller':
+        size = base / 1.2
+    elif keyword == 'larger':
+        size = base * 1.2
+    else:
+        for unit, scale, reference in (('rem', 1.0, DEFAULT_FONT_SIZE), ('em', 1.0, base), ('%', 0.01, base)):
+            if keyword.endswith(unit):
+                try:
+                    size = float(keyword[:-len(unit)]) * scale * reference
+                except ValueError:
+                    return value
+                break
+        else:
+            return value
+    return f"{size:g}px"
+
+
+@lru_cache(maxsize=COMPUTED_STYLE_CACHE_SIZE)
+def inherited_style(style):
+    """Return the part of a computed style that children inherit."""
+    if all(name in INHERITED_PROPERTIES for name in style):
+        return style
+    return StyleDeclarations((name, value) for name, value in style.items() if name in INHERITED_PROPERTIES)
+
+
+@lru_cache(maxsize=COMPUTED_STYLE_CACHE_SIZE)
+def compute_style(parent_style, declarations):
+    """Return an element's computed style from its parent's and its own declarations.
+    
+    Both arguments are interned, so each distinct pair is derived once. An
+    element that declares nothing shares its parent's inherited style
+    object instead of copying it.
+    """
+    inherited = inherited_style(parent_style)
+    if not declarations:
+        return inherited
+    computed = dict(inherited)
+    for name, value in declarations.items():
+        keyword = value.strip().lower()
+        if keyword == 'inherit':
+            if name in parent_style:
+                computed[name] = parent_style[name]
+            else:
+                computed.pop(name, None)
+        elif keyword in ('initial', 'unset'):
+            computed.pop(name, None)
+        elif name == 'font-size':
+            computed[name] = resolve_font_size(value, parent_style.get('font-size'))
+        else:
+            computed[name] = value
+    return StyleDeclarations(computed)
+
+
+def computed_style_cache_info():
+    """Return hits, misses, maxsize and currsize of the computed-style cache."""
+    return compute_style.cache_info()
+
+
+NAMED_COLORS = {
+    'black': '000000', 'white': 'FFFFFF', 'red': 'FF0000', 'green': '008000',
+    'blue': '0000FF', 'yellow': 'FFFF00', 'orange': 'FFA500', 'purple': '800080',
+    'gray': '808080', 'grey': '808080', 'silver': 'C0C0C0', 'maroon': '800000',
+    'navy': '000080', 'teal': '008080', 'olive': '808000', 'lime': '00FF00',
+    'aqua': '00FFFF', 'fuchsia': 'FF00FF',
+}
+
+RGB_FUNCTION_RE = re.compile(r'rgba?\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)')
+
+
+@lru_cache(maxsize=1024)
+def parse_css_color(value):
+    """Convert a CSS color (#rgb, #rrggbb, rgb() or a basic name) to RGBColor.
+    
+    Returns None for values Word cannot represent, such as 'inherit'.
+    """
+    value = value.strip().lower()
+    if value.startswith('#'):
+        hex_color = value[1:]
+        if len(hex_color) == 3:
+            hex_color = ''.join(digit * 2 for digit in hex_color)
+    elif value.startswith('rgb'):
+        match = RGB_FUNCTION_RE.match(value)
+        if not match:
+            return None
+        return RGBColor(*(min(int(channel), 255) for channel in match.groups()))
+    else:
+        hex_color = NAMED_COLORS.get(value, '')
+    if len(hex_color) != 6:
+        return None
+    try:
+        return RGBColor.from_string(hex_color.upper())
+    except ValueError:
+        return None
+
+
+def parse_css_pixels(value):
+    """Return the number of pixels in a CSS 'px' length, or None."""
+    value = value.strip().lower()
+    if not value.endswith('px'):
+        return None
+    try:
+        return float(value[:-2])
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=COMPUTED_STYLE_CACHE_SIZE)
+def background_color(style):
+    """Return the RGBColor of a style's background-color or background, or None."""
+    if 'background-color' in style:
+        return parse_css_color(style['background-color'])
+    if 'background' in style:
+        for candidate in BACKGROUND_COLOR_RE.findall(style['background']):
+            color = parse_css_color(candidate)
+            if color is not None:
+                return color
+    return None
+
+
+@lru_cache(maxsize=COMPUTED_STYLE_CACHE_SIZE)
+def background_declarations(style):
+    """Return just the background color of a style, as declarations."""
+    color = background_color(style)
+    if color is None:
+        return EMPTY_DECLARATIONS
+    return StyleDeclarations({'background-color': f'#{color}'})
+
+
+@lru_cache(maxsize=1024)
+def shading_element(fill):
+    """Return the w:shd element filling a table cell with a hex color.
+    
+    Built once per distinct color; cells get copies.
+    """
+    return OxmlElement('w:shd', {qn('w:val'): 'clear', qn('w:color'): 'auto', qn('w:fill'): fill})
+
+
+def _set_run_properties(run, style):
+    """Set a run's font from a computed style with python-docx's setters."""
+    # Font size
+    if 'font-size' in style:
+        size = parse_css_pixels(style['font-size'])
+        if size:
+            run.font.size = Pt(size)
+    
+    # Font weight (bold)
+    if 'font-weight' in style:
+        weight = style['font-weight']
+        if weight in ['bold', '700', '800', '900']:
+            run.font.bold = True
+    
+    # Font style (italic)
+    if 'font-style' in style:
+        if style['font-style'] == 'italic':
+            run.font.italic = True
+    
+    # Text color
+    if 'color' in style:
+        color = parse_css_color(style['color'])
+        if color is not None:
+            run.font.color.rgb = color
+    
+    # Text decoration (underline)
+    if 'text-decoration' in style:
+        if 'underline' in style['text-decoration']:
+            run.font.underline = True
+
+
+def _set_paragraph_properties(paragraph, style):
+    """Set a paragraph's alignment and line height from a computed style."""
+    # Text alignment
+    if 'text-align' in style:
+        align = style['text-align']
+        if align == 'center':
+            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        elif align == 'right':
+            paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        elif align == 'justify':
+            paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    
+    # Line height
+    if 'line-height' in style:
+        height = parse_css_pixels(style['line-height'])
+        if height:
+            paragraph.paragraph_format.line_spacing = Pt(height)
+
+
+@lru_cache(maxsize=COMPUTED_STYLE_CACHE_SIZE)
+def run_properties(style):
+    """Return the w:rPr element for a computed style, or None if it sets nothing.
+    
+    The element is built once per distinct style on a scratch run; attach
+    it with attach_properties(), which copies it.
+    """
+    run = Run(OxmlElement('w:r'), None)
+    _set_run_properties(run, style)
+    return run._r.rPr
+
+
+@lru_cache(maxsize=COMPUTED_STYLE_CACHE_SIZE)
+def paragraph_properties(style):
+    """Return the w:pPr element for a computed style, or None if it sets nothing."""
+    paragraph = Paragraph(OxmlElement('w:p'), None)
+    _set_paragraph_properties(paragraph, style)
+    return paragraph._p.pPr
+
+
+def attach_properties(element, properties):
+    """Give a w:r or w:p element a copy of cached w:rPr or w:pPr properties.
+    
+    An element without properties gets a copy of the whole fragment; one
+    that already has some (a paragraph style, say) has each cached child
+    copied in, replacing a child of the same kind.
+    """
+    name = etree.QName(properties).localname
+    existing = getattr(element, name)
+    if existing is None:
+        getattr(element, '_insert_' + name)(copy.deepcopy(properties))
+        return
+    for child in properties:
+        child_name = etree.QName(child).localname
+        getattr(existing, '_remove_' + child_name)()
+        getattr(existing, '_insert_' + child_name)(copy.deepcopy(child))
+
+
+# With named_styles=True, a formatting combination used at least this many
+# times becomes a named style in styles.xml instead of direct formatting.
+NAMED_STYLE_MIN_USES = 2
+
+# Approximate bytes a w:style definition adds to styles.xml besides its
+# formatting, and the namespace declarations lxml adds when serialising a
+# lone element, which do not appear inside document.xml.
+NAMED_STYLE_OVERHEAD = 160
+XMLNS_DECLARATION_RE = re.compile(rb' xmlns(?::\w+)?="[^"]*"')
+
+# Paragraph properties written from CSS, as opposed to those that come with
+# the paragraph's Word style (pStyle, numPr).
+PARAGRAPH_FORMATTING_TAGS = frozenset([qn('w:jc'), qn('w:spacing')])
+
+
+# Significant characters for the style sheet scanner; everything between
+# them is copied in one slice.
+CSS_SCAN_RE = re.compile(r'/\*|["\'(){};]')
+CSS_BLOCK_SCAN_RE = re.compile(r'/\*|["\'{}]')
+CSS_COMPLEX_BLOCK_RE = re.compile(r'/\*|["\'(){]')
+CSS_STRING_RES = {
+    '"': re.compile(r'"(?:\\.|[^"\\\n])*"?'),
+    "'": re.compile(r"'(?:\\.|[^'\\\n])*'?"),
+}
+
+# At-rules whose nested rules can apply to Word output; @media is further
+# limited to queries that match print. Blocks of any other at-rule
+# (@font-face, @keyframes, @page, ...) are skipped without being parsed.
+CSS_GROUP_AT_RULES = frozenset(['media', 'supports', 'layer', 'container'])
+
+
+def _css_skip_string(text, start):
+    return CSS_STRING_RES[text[start]].match(text, start).end()
+
+
+def _css_skip_block(text, pos):
+    """Return the position just after the } closing the block open at pos."""
+    depth = 1
+    while True:
+        match = CSS_BLOCK_SCAN_RE.search(text, pos)
+        if match is None:
+            return len(text)
+        token = match.group()
+        if token == '/*':
+            end = text.find('*/', match.end())
+            pos = len(text) if end < 0 else end + 2
+        elif token in '"\'':
+            pos = _css_skip_string(text, match.start())
+        elif token == '{':
+            depth += 1
+            pos = match.end()
+        else:
+            depth -= 1
+            pos = match.end()
+            if depth == 0:
+                return pos
+
+
+def _css_scan(text, pos, stops):
+    """Read from pos up to the first top-level character in stops.
+    
+    Comments are dropped, strings and parenthesised groups are copied
+    whole and a nested rule is skipped along with its selector. Returns
+    (content, stop character or '' at end of input, position after it).
+    """
+    parts = []
+    parens = 0
+    while True:
+        match = CSS_SCAN_RE.search(text, pos)
+        if match is None:
+            parts.append(text[pos:])
+            return ''.join(parts), '', len(text)
+        start = match.start()
+        token = match.group()
+        if token == '/*':
+            parts.append(text[pos:start])
+            end = text.find('*/', start + 2)
+            pos = len(text) if end < 0 else end + 2
+            continue
+        if token in '"\'':
+            end = _css_skip_string(text, start)
+            parts.append(text[pos:end])
+            pos = end
+            continue
+        if token == '(':
+            parens += 1
+        elif token == ')':
+            parens = max(parens - 1, 0)
+        elif not parens and token in stops:
+            parts.append(text[pos:start])
+            return ''.join(parts), token, start + 1
+        elif token == '{':
+            # A nested rule: drop it together with its selector
+            parts = []
+            pos = _css_skip_block(text, start + 1)
+            continue
+        parts.append(text[pos:match.end()])
+        pos = match.end()
+
+
+def _media_applies(query_list):
+    """Return True if a media query list can match printed output."""
+    for query in query_list.lower().split(','):
+        words = query.replace('(', ' (').split()
+        if words and words[0] == 'only':
+            words = words[1:]
+        negated = bool(words) and words[0] == 'not'
+        if negated:
+            words = words[1:]
+        media_type = words[0] if words and not words[0].startswith('(') else 'all'
+        if (media_type in ('all', 'print')) != negated:
+            return True
+    return False
+
+
+def iter_css_rules(css_text):
+    """Yield (selector, declarations) for each style rule that can affect Word output.
+    
+    A single left-to-right pass over the text: comments, strings and
+    nested braces are handled, group at-rules that apply to print are
+    descended into and every other at-rule block is skipped unparsed.
+    Malformed rules are dropped as a browser would.
+    """
+    pos = 0
+    length = len(css_text)
+    while pos < length:
+        prelude, stop, pos = _css_scan(css_text, pos, '{};')
+        prelude = prelude.strip()
+        if stop != '{':
+            # '}' closes a group at-rule; ';' ends a statement at-rule
+            # such as @import; '' is the end of the input.
+            continue
+        if prelude.startswith('@'):
+            name, _, condition = prelude[1:].partition(' ')
+            name = name.lower()
+            if name in CSS_GROUP_AT_RULES and (name != 'media' or _media_applies(condition)):
+                continue
+            pos = _css_skip_block(css_text, pos)
+            continue
+        
+        end = css_text.find('}', pos)
+        if end >= 0 and CSS_COMPLEX_BLOCK_RE.search(css_text, pos, end) is None:
+            # Fast path: no comments, strings, functions or nesting
+            block = css_text[pos:end].split(';')
+            pos = end + 1
+        else:
+            block = []
+            stop = ';'
+            while stop == ';':
+                declaration, stop, pos = _css_scan(css_text, pos, ';}')
+                block.append(declaration)
+        
+        declarations = {}
+        for declaration in block:
+            name, colon, value = declaration.partition(':')
+            name = name.strip()
+            value = value.strip()
+            if colon and name and value:
+                declarations[name] = value
+        if prelude and declarations:
+            yield prelude, declarations
+
+
+# Distinct (tag, id, classes) keys remembered by a stylesheet's match cache.
+MATCH_CACHE_SIZE = 8192
+
+SELECTOR_SPLIT_RE = re.compile(r'\s*([>+~])\s*|\s+')
+COMPOUND_RE = re.compile(r'(\*|[a-zA-Z][\w-]*)?((?:[#.][\w-]+|\[[\w-]+(?:=(?:"[^"]*"|\'[^\']*\'|[\w-]+))?\])*)$')
+COMPOUND_PART_RE = re.compile(r'([#.])([\w-]+)|\[([\w-]+)(?:=(?:"([^"]*)"|\'([^\']*)\'|([\w-]+)))?\]')
+IMPORTANT_RE = re.compile(r'\s*!\s*important\s*$', re.IGNORECASE)
+
+
+def parse_compound_selector(text):
+    """Parse a compound selector such as 'p.note#intro'.
+    
+    Returns (tag, id, classes, attributes), or None for selectors that
+    cannot match a static document (pseudo-classes, pseudo-elements and
+    attribute operators other than '=').
+    """
+    match = COMPOUND_RE.match(text)
+    if not match or not text:
+        return None
+    tag = match.group(1)
+    element_id = None
+    classes = []
+    attributes = []
+    for marker, name, attribute, double, single, bare in COMPOUND_PART_RE.findall(match.group(2)):
+        if marker == '#':
+            element_id = name
+        elif marker == '.':
+            classes.append(name)
+        else:
+            value = double or single or bare
+            attributes.append((attribute.lower(), value if value else None))
+    return (tag.lower() if tag and tag != '*' else None, element_id, frozenset(classes), tuple(attributes))
+
+
+class CSSRule:
+    """One complex selector of a style rule with its declarations.
+    
+    compounds holds (compound, combinator) pairs from the rightmost
+    compound leftwards; combinator relates a compound to the next one.
+    """
+    
+    __slots__ = ('selector', 'compounds', 'specificity', 'order', 'declarations', 'important',
+                 'ancestor_features')
+    
+    def __init__(self, selector, compounds, order, declarations, important):
+        self.selector = selector
+        self.compounds = compounds
+        self.order = order
+        self.declarations = declarations
+        self.important = important
+        ids = sum(1 for compound, _ in compounds if compound[1])
+        classes = sum(len(compound[2]) + len(compound[3]) for compound, _ in compounds)
+        tags = sum(1 for compound, _ in compounds if compound[0])
+        self.specificity = (ids, classes, tags)
+        # Tags, ids and classes some ancestor must have for the rule to match
+        features = set()
+        for index in range(1, len(compounds)):
+            if compounds[index - 1][1] not in (' ', '>'):
+                break
+            features.update(_compound_features(compounds[index][0]))
+        self.ancestor_features = frozenset(features)
+    
+    @property
+    def is_simple(self):
+        """True if matching depends only on an element's tag, id and classes."""
+        compound = self.compounds[0][0]
+        return len(self.compounds) == 1 and not compound[3]
+    
+    @classmethod
+    def parse(cls, selector, order, declarations, important=EMPTY_DECLARATIONS):
+        """Build a rule from one complex selector, or return None if unsupported."""
+        parts = SELECTOR_SPLIT_RE.split(selector.strip())
+        compounds = []
+        combinator = None
+        # re.split yields compound, combinator, compound, ... with None for whitespace
+        for index in range(len(parts) - 1, -1, -1):
+            if index % 2:
+                combinator = parts[index] or ' '
+                continue
+            compound = parse_compound_selector(parts[index])
+            if compound is None:
+                return None
+            compounds.append((compound, combinator))
+        # Shift combinators so each pair holds the link to its left neighbour
+        compounds = tuple(
+            (compound, compounds[i + 1][1] if i + 1 < len(compounds) else None)
+            for i, (compound, _) in enumerate(compounds)
+        )
+        return cls(selector.strip(), compounds, order, declarations, important)
+
+
+def _compound_features(compound):
+    tag, element_id, classes, _ = compound
+    features = ['.' + name for name in classes]
+    if tag is not None:
+        features.append(tag)
+    if element_id is not None:
+        features.append('#' + element_id)
+    return features
+
+
+def _element_features(element):
+    features = ['.' + name for name in element.get('class') or ()]
+    features.append(element.name)
+    element_id = element.get('id')
+    if element_id is not None:
+        features.append('#' + element_id)
+    return features
+
+
+def _element_parent(element):
+    """Return the parent element, or None at the top of the document."""
+    parent = element.parent
+    if parent is None or isinstance(parent, BeautifulSoup):
+        return None
+    return parent
+
+
+def _table_rows(table_element):
+    """Yield the tr elements of a table, but not those of tables nested in it."""
+    for child in table_element.children:
+        if child.name == 'tr':
+            yield child
+        elif child.name in TABLE_SECTION_TAGS:
+            for row in child.children:
+                if row.name == 'tr':
+                    yield row
+
+
+def _span_attribute(cell, name, maximum):
+    """Return a cell's colspan or rowspan as an int clamped to 0..maximum, default 1."""
+    try:
+        return max(0, min(int(cell.get(name, 1)), maximum))
+    except (TypeError, ValueError):
+        return 1
+
+
+def layout_table(rows):
+    """Place HTML cells on a grid, honouring colspan and rowspan, in one pass.
+    
+    rows is a list of rows, each a list of (cell, style) pairs. Returns
+    (grid, columns): for every row, a list of (cell, style, colspan, merge)
+    slots in column order, and the grid width. merge is 'restart' for a
+    cell spanning several rows and 'continue' for the slots it covers in
+    the rows below, which have cell None. Gaps are filled with empty
+    slots so every row covers all columns.
+    """
+    grid = []
+    widths = []
+    carried = {}  # start column -> [rows still covered, colspan, style]
+    row_count = len(rows)
+    for index, cells in enumerate(rows):
+        slots = []
+        started = {}
+        column = 0
+        for cell, style in cells:
+            while column in carried:
+                _, colspan, origin_style = carried[column]
+                slots.append((None, origin_style, colspan, 'continue'))
+                column += colspan
+            colspan = _span_attribute(cell, 'colspan', MAX_COLSPAN) or 1
+            rowspan = _span_attribute(cell, 'rowspan', MAX_ROWSPAN)
+            if rowspan == 0:  # spans the rest of the table
+                rowspan = row_count - index
+            # A cell carried down from above wins over one spanning into it
+            for covered in range(column + 1, column + colspan):
+                if covered in carried:
+                    colspan = covered - column
+                    break
+            if rowspan > 1:
+                slots.append((cell, style, colspan, 'restart'))
+                started[column] = [rowspan - 1, colspan, style]
+            else:
+                slots.append((cell, style, colspan, None))
+            column += colspan
+        for start in sorted(start for start in carried if start >= column):
+            slots.extend((None, EMPTY_DECLARATIONS, 1, None) for _ in range(start - column))
+            _, colspan, origin_style = carried[start]
+            slots.append((None, origin_style, colspan, 'continue'))
+            column = start + colspan
+        grid.append(slots)
+        widths.append(column)
+        for start in list(carried):
+            carried[start][0] -= 1
+            if not carried[start][0]:
+                del carried[start]
+        carried.update(started)
+    
+    columns = max(widths, default=0)
+    for slots, width in zip(grid, widths):
+        slots.extend((None, EMPTY_DECLARATIONS, 1, None) for _ in range(columns - width))
+    return grid, columns
+
+
+def _previous_elements(element):
+    """Yield the preceding sibling elements, nearest first."""
+    for sibling in element.previous_siblings:
+        if sibling.name is not None:
+            yield sibling
+
+
+def _compound_matches(compound, element):
+    tag, element_id, classes, attributes = compound
+    if tag is not None and element.name != tag:
+        return False
+    if element_id is not None and element.get('id') != element_id:
+        return False
+    if classes and not classes.issubset(element.get('class') or ()):
+        return False
+    for name, value in attributes:
+        actual = element.get(name)
+        if actual is None:
+            return False
+        if value is not None:
+            if isinstance(actual, list):
+                actual = ' '.join(actual)
+            if actual != value:
+                return False
+    return True
+
+
+def _selector_matches(compounds, index, element):
+    """Match compounds[index:] against element, walking right to left."""
+    compound, combinator = compounds[index]
+    if not _compound_matches(compound, element):
+        return False
+    if combinator is None:
+        return True
+    if combinator == ' ':
+        ancestor = _element_parent(element)
+        while ancestor is not None:
+            if _selector_matches(compounds, index + 1, ancestor):
+                return True
+            ancestor = _element_parent(ancestor)
+        return False
+    if combinator == '>':
+        parent = _element_parent(element)
+        return parent is not None and _selector_matches(compounds, index + 1, parent)
+    if combinator == '+':
+        previous = next(_previous_elements(element), None)
+        return previous is not None and _selector_matches(compounds, index + 1, previous)
+    return any(_selector_matches(compounds, index + 1, sibling) for sibling in _previous_elements(element))
+
+
+class Stylesheet:
+    """Style rules indexed by the rightmost compound of their selector.
+    
+    Each rule sits in exactly one bucket: by id if its rightmost compound
+    has one, else by one of its classes, else by tag, else universal. An
+    element is only tested against the buckets for its own id, classes
+    and tag, so matching cost follows the number of candidate rules
+    rather than the size of the stylesheet. Candidates are matched right
+    to left and cascaded by specificity, then source order, with
+    !important declarations applied last.
+    
+    Rules with combinators are first checked against the set of tags,
+    ids and classes of the element's ancestors, so rules that cannot
+    match never walk the tree.
+    """
+    
+    def __init__(self):
+        self.rules = []
+        self._by_id = {}
+        self._by_class = {}
+        self._by_tag = {}
+        self._universal = []
+        self._match_cache = {}
+        self._feature_cache = {}
+    
+    def __len__(self):
+        return len(self.rules)
+    
+    def add_rule(self, selector_text, declarations):
+        """Add a rule; selector_text may be a comma-separated selector list."""
+        normal = {}
+        important = {}
+        for name, value in declarations.items():
+            if IMPORTANT_RE.search(value):
+                important[name] = IMPORTANT_RE.sub('', value)
+            else:
+                normal[name] = value
+        normal = StyleDeclarations(normal)
+        important = StyleDeclarations(important)
+        
+        for selector in selector_text.split(','):
+            rule = CSSRule.parse(selector, len(self.rules), normal, important)
+            if rule is not None:
+                self.add(rule)
+    
+    def add(self, rule):
+        """Index a parsed CSSRule."""
+        self.rules.append(rule)
+        tag, element_id, classes, _ = rule.compounds[0][0]
+        if element_id is not None:
+            self._by_id.setdefault(element_id, []).append(rule)
+        elif classes:
+            self._by_class.setdefault(min(classes), []).append(rule)
+        elif tag is not None:
+            self._by_tag.setdefault(tag, []).append(rule)
+        else:
+            self._universal.append(rule)
+        self._match_cache.clear()
+    
+    def _candidates(self, key):
+        tag, element_id, classes = key
+        candidates = list(self._universal)
+        candidates.extend(self._by_tag.get(tag, ()))
+        for name in classes:
+            candidates.extend(self._by_class.get(name, ()))
+        if element_id is not None:
+            candidates.extend(self._by_id.get(element_id, ()))
+        return candidates
+    
+    def match(self, element):
+        """Return the cascaded declarations of all rules matching element."""
+        if not self.rules:
+            return EMPTY_DECLARATIONS
+        
+        key = (element.name, element.get('id'), tuple(element.get('class') or ()))
+        entry = self._match_cache.get(key)
+        if entry is None:
+            simple = []
+            complex_rules = []
+            for rule in self._candidates(key):
+                if not rule.is_simple:
+                    complex_rules.append(rule)
+                elif _compound_matches(rule.compounds[0][0], element):
+                    simple.append(rule)
+            entry = (simple, complex_rules, self._cascade(simple))
+            if len(self._match_cache) >= MATCH_CACHE_SIZE:
+                self._match_cache.clear()
+            self._match_cache[key] = entry
+        
+        simple, complex_rules, simple_result = entry
+        if not complex_rules:
+            return simple_result
+        features = self._ancestor_features(element)
+        matched = [rule for rule in complex_rules
+                   if rule.ancestor_features <= features and _selector_matches(rule.compounds, 0, element)]
+        if not matched:
+            return simple_result
+        return self._cascade(simple + matched)
+    
+    def _ancestor_features(self, element):
+        """Return the tags, ids and classes of all ancestors of element.
+        
+        Results are cached per ancestor, so siblings and descendants of an
+        element already seen cost one set union each.
+        """
+        cache = self._feature_cache
+        pending = []
+        features = frozenset()
+        node = _element_parent(element)
+        while node is not None:
+            entry = cache.get(id(node))
+            if entry is not None and entry[0] is node:
+                features = entry[1]
+                break
+            pending.append(node)
+            node = _element_parent(node)
+        if len(cache) + len(pending) > MATCH_CACHE_SIZE:
+            cache.clear()
+        for node in reversed(pending):
+            features = features.union(_element_features(node))
+            cache[id(node)] = (node, features)
+        return features
+    
+    def _cascade(self, rules):
+        rules = sorted(rules, key=lambda rule: (rule.specificity, rule.order))
+        declarations = {}
+        for rule in rules:
+            declarations.update(rule.declarations)
+        for rule in rules:
+            declarations.update(rule.important)
+        return StyleDeclarations(declarations)
+
+
+class DocumentDefaults:
+    """What the converter needs to know about a document's styles, resolved once.
+    
+    missing_styles holds the heading and list styles (HEADING_STYLES,
+    LIST_STYLES) the document does not define as paragraph styles, which
+    are replaced by direct formatting; paragraph_style_ids maps the others
+    to the w:pStyle value python-docx would write for them (None for the
+    default paragraph style). content_width is the width between the
+    margins of the last section, which tables span, and table_style_id the
+    id of TABLE_STYLE, or None without it.
+    """
+    
+    def __init__(self, document):
+        styles = document.styles
+        default_style = styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        self.paragraph_style_ids = {}
+        for name in itertools.chain(HEADING_STYLES.values(), LIST_STYLES):
+            if name in styles and styles[name].type == WD_STYLE_TYPE.PARAGRAPH:
+                style = styles[name]
+                self.paragraph_style_ids[name] = None if style == default_style else style.style_id
+        self.missing_styles = frozenset(name for name in itertools.chain(HEADING_STYLES.values(), LIST_STYLES)
+                                        if name not in self.paragraph_style_ids)
+        section = document.sections[-1]
+        self.content_width = section.page_width - section.left_margin - section.right_margin
+        self.table_style_id = styles[TABLE_STYLE].style_id if TABLE_STYLE in styles else None
+
+
+def document_defaults(doc):
+    """Return the DocumentDefaults of doc.
+    
+    Documents from DocumentTemplate.new_document() carry their template's;
+    for any other document they are resolved on first use and kept on it.
+    """
+    defaults = getattr(doc, '_converter_defaults', None)
+    if defaults is None:
+        defaults = doc._converter_defaults = DocumentDefaults(doc)
+    return defaults
+
+
+class DocumentTemplate:
+    """A .docx template parsed once, from which each conversion gets a copy.
+    
+    The bundled default template gets PAGE_MARGIN on every section; a
+    custom template keeps its own page setup. new_document() deep-copies
+    only the main document part: parts a conversion never changes (theme,
+    fonts, settings, numbering, and styles unless asked) are shared with
+    the template instead of being unzipped and parsed again.
+    """
+    
+    def __init__(self, path=None):
+        document = Document(str(path) if path is not None else None)
+        if path is None:
+            for section in document.sections:
+                section.top_margin = PAGE_MARGIN
+                section.bottom_margin = PAGE_MARGIN
+                section.left_margin = PAGE_MARGIN
+                section.right_margin = PAGE_MARGIN
+        self.path = path
+        self._document = document
+        self.defaults = DocumentDefaults(document)
+        if self.defaults.missing_styles:
+            logging.getLogger(__name__).warning(
+                f"Template {path} does not define {', '.join(sorted(self.defaults.missing_styles))}; "
+                "using direct formatting instead")
+        if self.defaults.table_style_id is None:
+            logging.getLogger(__name__).debug(f"Template {path} has no '{TABLE_STYLE}' style")
+        parts = [part for part in document.part.package.iter_parts() if part is not document.part]
+        # deepcopy() hands back memo entries as they are, so seeding the
+        # memo with a part shares it between the template and its copies.
+        self._shared = {id(part): part for part in parts}
+        self._shared_without_styles = {id(part): part for part in parts if not isinstance(part, StylesPart)}
+    
+    def new_document(self, copy_styles=False):
+        """Return a new Document with the template's content and setup.
+        
+        Pass copy_styles=True when the conversion adds styles, so the
+        copy gets its own styles part.
+        """
+        shared = self._shared_without_styles if copy_styles else self._shared
+        document = copy.deepcopy(self._document, dict(shared))
+        document._converter_defaults = self.defaults
+        return document
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _load_template(path, modified):
+    """Parse a template; cached per path and modification time."""
+    return DocumentTemplate(path)
+
+
+def get_document_template(path=None):
+    """Return the cached DocumentTemplate for a .docx file, or for the default template.
+    
+    A custom template is parsed again when its file changes.
+    """
+    if path is None:
+        return _load_template(None, None)
+    path = Path(path).resolve()
+    return _load_template(path, path.stat().st_mtime_ns)
+
+
+class PackageOptions:
+    """How the parts of a .docx package are stored in its zip file.
+    
+    compression is 'deflate' (at compress_level 0-9, or zlib's default
+    when None) or 'store'. Deterministic packages stamp every entry with
+    DETERMINISTIC_DATE_TIME; since parts are always written in the same
+    order, identical input then gives byte-identical files.
+    """
+    
+    def __init__(self, compression='deflate', compress_level=None, deterministic=False):
+        if compression not in ZIP_COMPRESSION:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compress_level is not None and (compression != 'deflate' or not 0 <= compress_level <= 9):
+            raise ValueError(f"Invalid compression level for {compression}: {compress_level}")
+        self.compression = compression
+        self.compress_level = compress_level
+        self.deterministic = deterministic
+    
+    def open(self, output):
+        """Create the zip file of a package; output is a path or binary file object."""
+        return zipfile.ZipFile(output, 'w', ZIP_COMPRESSION[self.compression], compresslevel=self.compress_level)
+    
+    def entry(self, name):
+        """Return the ZipInfo of a new entry, stamped like ZipFile.writestr() would."""
+        date_time = DETERMINISTIC_DATE_TIME if self.deterministic else time.localtime(time.time())[:6]
+        info = zipfile.ZipInfo(name, date_time)
+        info.compress_type = ZIP_COMPRESSION[self.compression]
+        info._compresslevel = self.compress_level  # No public setter before Python 3.13
+        info.external_attr = 0o600 << 16
+        return info
+    
+    def write(self, archive, name, blob):
+        archive.writestr(self.entry(name), blob)
+    
+    def write_header(self, archive, package, parts):
+        """Write the content types and package relationships, as python-docx does first."""
+        self.write(archive, CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+        self.write(archive, PACKAGE_URI.rels_uri.membername, package.rels.xml)
+    
+    def write_parts(self, archive, parts):
+        """Write each part, followed by its relationships if it has any."""
+        for part in parts:
+            self.write(archive, part.partname.membername, part.blob)
+            if len(part.rels):
+                self.write(archive, part.partname.rels_uri.membername, part.rels.xml)
+
+
+DEFAULT_PACKAGING = PackageOptions()
+
+
+def save_package(doc, output, packaging=DEFAULT_PACKAGING):
+    """Save doc to a path or binary file object like Document.save(), storing its parts as packaging says."""
+    package = doc.part.package
+    parts = list(package.iter_parts())
+    for part in parts:
+        part.before_marshal()
+    with packaging.open(output) as archive:
+        packaging.write_header(archive, package, parts)
+        packaging.write_parts(archive, parts)
+
+
+def _fsync_directory(path):
+    """Flush a rename in directory path to disk, where the OS allows it."""
+    if os.name == 'nt':
+        return  # Directories cannot be opened on Windows; NTFS journals renames
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _document_shell(document_element):
+    """Return the bytes of document.xml before and after the body content."""
+    marker = 'body content'
+    shell = etree.Element(document_element.tag, attrib=dict(document_element.attrib), nsmap=document_element.nsmap)
+    for child in document_element:
+        if child.tag == qn('w:body'):
+            body = etree.SubElement(shell, child.tag, attrib=dict(child.attrib))
+            body.append(etree.Comment(marker))
+        else:
+            shell.append(copy.deepcopy(child))
+    head, tail = serialize_part_xml(shell).split(f'<!--{marker}-->'.encode())
+    return head, tail
+
+
+class StreamingDocxWriter:
+    """Writes a .docx package whose word/document.xml is streamed into the zip.
+    
+    With writer='stream' the converter appends w:p and w:r elements to
+    the body directly (_new_paragraph, _add_run) rather than through
+    python-docx's proxy objects. flush() serialises the finished blocks
+    straight into the open document.xml entry and removes them from the
+    tree, so neither the whole body nor its serialised form is ever held
+    in memory. The other
+    parts are written unchanged from the document's template package.
+    output is a path or a binary file object. Use it as a context manager:
+    on an exception a partially written file is removed.
+    """
+    
+    def __init__(self, doc, output, flush_blocks=WRITER_FLUSH_BLOCKS, packaging=DEFAULT_PACKAGING):
+        self.doc = doc
+        self.body = doc.element.body
+        self.flush_blocks = flush_blocks
+        self.output = output
+        self.packaging = packaging
+        self._parts = list(doc.part.package.iter_parts())
+        self._declared = set(
+            (f' xmlns:{prefix}="{uri}"' if prefix else f' xmlns="{uri}"').encode()
+            for prefix, uri in doc.element.nsmap.items())
+        head, self._tail = _document_shell(doc.element)
+        self._zip = packaging.open(output)
+        try:
+            # The entries python-docx writes, in its order, up to document.xml
+            packaging.write_header(self._zip, doc.part.package, self._parts)
+            position = self._parts.index(doc.part)
+            packaging.write_parts(self._zip, self._parts[:position])
+            self._stream = self._zip.open(packaging.entry(doc.part.partname.membername), 'w')
+            self._stream.write(head)
+        except Exception:
+            self._zip.close()
+            raise
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+    
+    def maybe_flush(self):
+        """Flush once more than flush_blocks blocks are waiting in the body."""
+        if len(self.body) > self.flush_blocks:
+            self.flush()
+    
+    def flush(self):
+        """Write every finished block to document.xml and drop it from the tree."""
+        section_tag = qn('w:sectPr')
+        for child in list(self.body):
+            if child.tag != section_tag:
+                self._write(child)
+                self.body.remove(child)
+    
+    def _write(self, element):
+        xml = etree.tostring(element)
+        # lxml repeats every in-scope namespace on a lone element; drop the
+        # ones the document element already declares.
+        end = xml.index(b'>')
+        start = XMLNS_DECLARATION_RE.sub(
+            lambda match: b'' if match.group(0) in self._declared else match.group(0), xml[:end])
+        self._stream.write(start + xml[end:])
+    
+    def close(self):
+        """Write the remaining blocks, the section properties and the other parts."""
+        self.flush()
+        for child in self.body:
+            self._write(child)
+        self._stream.write(self._tail)
+        self._stream.close()
+        document_part = self.doc.part
+        position = self._parts.index(document_part)
+        self.packaging.write(self._zip, document_part.partname.rels_uri.membername, document_part.rels.xml)
+        self.packaging.write_parts(self._zip, self._parts[position + 1:])
+        self._zip.close()
+    
+    def abort(self):
+        """Close the zip and remove the partially written file.
+        
+        A file object passed as output is left to the caller to discard.
+        """
+        try:
+            self._stream.close()
+        except Exception:
+            pass
+        self._zip.close()
+        if isinstance(self.output, (str, os.PathLike)):
+            Path(self.output).unlink(missing_ok=True)
+
 
 class HTMLToDOCXConverter:
     """Converts HTML files to DOCX format while preserving formatting."""
     
-    def __init__(self):
+    # Handler method for each tag, resolved with one dict lookup per node
+    ELEMENT_HANDLERS = dict(
+        [(tag, '_handle_heading') for tag in HEADING_LEVELS]
+        + [(tag, '_handle_container') for tag in CONTAINER_TAGS]
+        + [(tag, '_handle_ignored') for tag in IGNORED_TAGS]
+        + [
+            ('p', '_handle_paragraph'),
+            ('br', '_handle_break'),
+            ('ul', '_handle_bullet_list'),
+            ('ol', '_handle_numbered_list'),
+            ('table', '_process_table'),
+            ('style', '_handle_style'),
+        ]
+    )
+    
+    def __init__(self, parser='auto', lxml_threshold=LXML_SIZE_THRESHOLD, streaming=False, named_styles=False,
+                 template=None, writer='docx', compression='deflate', compress_level=None, deterministic=False,
+                 fsync=False):
+        if parser != 'auto' and parser not in PARSER_BACKENDS:
+            raise ValueError(f"Unknown parser backend: {parser}")
+        # Check the backend is installed now, so a missing package fails here rather than per file
+        if parser != 'auto' and not self.parser_available(parser):
+            raise ValueError(f"Parser backend not installed: {parser}")
+        if writer not in WRITER_BACKENDS:
+            raise ValueError(f"Unknown writer backend: {writer}")
+        if writer == 'stream' and named_styles:
+            raise ValueError("named_styles needs the whole document and cannot be used with writer='stream'")
+        self.parser = parser
+        self.lxml_threshold = lxml_threshold
+        self.streaming = streaming
+        self.named_styles = named_styles
+        self.template = template
+        self.writer = writer
+        self.packaging = PackageOptions(compression, compress_level, deterministic)
+        self.fsync = fsync
+        # Keyword arguments that rebuild this converter in a worker process
+        self._options = dict(parser=parser, lxml_threshold=lxml_threshold, streaming=streaming,
+                             named_styles=named_styles, template=template, writer=writer, compression=compression,
+                             compress_level=compress_level, deterministic=deterministic, fsync=fsync)
+        # Parse the template now, so a bad path fails here rather than per file
+        get_document_template(template)
+        bound = {name: getattr(self, name) for name in set(self.ELEMENT_HANDLERS.values())}
+        self._element_handlers = {tag: bound[name] for tag, name in self.ELEMENT_HANDLERS.items()}
+        self._container_handler = bound['_handle_container']
         self.downloads_path = self._get_downloads_path()
         self.setup_logging()
         
+    def register_element_handler(self, tag, handler):
+        """Register handler(element, doc, css_styles, style) for an HTML tag.
+        
+        style holds the element's parsed style declarations. The handler
+        replaces any built-in handling of the tag and is responsible for
+        adding the element's content to doc.
+        """
+        self._element_handlers[tag.lower()] = handler
+    
+    def _is_container(self, tag):
+        """Return True if children of the tag are processed like body content."""
+        return self._element_handlers.get(tag, self._container_handler) is self._container_handler
+    
     def _get_downloads_path(self):
         """Get the Downloads folder path."""
         return str(Path.home() / "Downloads")
@@ -44,282 +1432,1174 @@ class HTMLToDOCXConverter:
         )
         self.logger = logging.getLogger(__name__)
     
+    @staticmethod
+    def parser_available(name):
+        """Return True if the given parser backend is installed."""
+        return builder_registry.lookup(name) is not None
+    
+    def _select_parser(self, content_length):
+        """Pick the parser backend for an input of the given size."""
+        if self.parser != 'auto':
+            return self.parser
+        if content_length >= self.lxml_threshold and self.parser_available('lxml'):
+            return 'lxml'
+        return 'html.parser'
+    
+    def _parse_html(self, html_content, encoding=None):
+        """Parse HTML content with the configured parser backend.
+        
+        html_content may be text or bytes; bytes are decoded by the parser
+        itself, using encoding when one was sniffed.
+        """
+        return BeautifulSoup(html_content, self._select_parser(len(html_content)),
+                             from_encoding=encoding)
+    
+    def _sniff_encoding(self, head):
+        """Detect the encoding declared by a BOM or <meta charset> in the leading bytes.
+        
+        Returns None when the document does not declare an encoding.
+        """
+        for bom, encoding in BYTE_ORDER_MARKS:
+            if head.startswith(bom):
+                return encoding
+        
+        match = META_CHARSET_RE.search(head)
+        if match:
+            label = match.group(1).decode('ascii').lower()
+            if label in WINDOWS_1252_ALIASES:
+                return 'windows-1252'
+            if label.startswith('utf-16'):
+                # A <meta> that could be read as ASCII cannot really be UTF-16
+                return 'utf-8'
+            try:
+                codecs.lookup(label)
+                return label
+            except LookupError:
+                self.logger.warning(f"Ignoring unknown charset declaration: {label}")
+        return None
+    
+    def _guess_encoding(self, head):
+        """Guess the encoding of undeclared input from its leading bytes."""
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            return 'windows-1252'
+    
     def convert_html_to_docx(self, html_file_path):
-        """Convert HTML file to DOCX format."""
+        """Convert HTML file to DOCX format.
+        
+        The .docx is staged in a temporary file beside it and renamed into
+        place, so it never appears half written; the HTML file is only
+        deleted once the rename has succeeded.
+        """
         try:
-            html_path = Path(html_file_path)
-            docx_path = html_path.with_suffix('.docx')
-            
-            # Read HTML file
-            with open(html_path, 'r', encoding='utf-8') as file:
-                html_content = file.read()
-            
-            # Parse HTML
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Create Word document
-            doc = Document()
-            
-            # Set minimal margins (0.5cm = 0.2 inches)
-            sections = doc.sections
-            for section in sections:
-                section.top_margin = Inches(0.2)
-                section.bottom_margin = Inches(0.2)
-                section.left_margin = Inches(0.2)
-                section.right_margin = Inches(0.2)
-            
-            # Extract and apply CSS styles
-            css_styles = self._extract_css_styles(soup)
-            
-            # Extract title
-            title = soup.find('title')
-            if title:
-                doc.add_heading(title.get_text(), 0)
-            
-            # Process body content
-            body = soup.find('body')
-            if body:
-                self._process_html_elements(body, doc, css_styles)
-            else:
-                # If no body tag, process the entire HTML
-                self._process_html_elements(soup, doc, css_styles)
-            
-            # Save DOCX file
-            doc.save(docx_path)
-            self.logger.info(f"Successfully converted {html_path.name} to {docx_path.name}")
-            
-            # Remove original HTML file
-            html_path.unlink()
-            self.logger.info(f"Removed original HTML file: {html_path.name}")
-            
+            self._convert_file(Path(html_file_path))
             return True
             
         except Exception as e:
             self.logger.error(f"Error converting {html_file_path}: {str(e)}")
             return False
     
-    def _extract_css_styles(self, soup):
-        """Extract CSS styles from HTML."""
-        css_styles = {}
+    def _convert_file(self, html_path):
+        """Convert html_path to a .docx beside it, remove the HTML and return the .docx path."""
+        docx_path = html_path.with_suffix('.docx')
+        
+        self._stage_docx(lambda doc, writer: self._convert_to_doc(html_path, doc, writer), docx_path)
+        self.logger.info(f"Successfully converted {html_path.name} to {docx_path.name}")
+        
+        # Remove original HTML file
+        html_path.unlink()
+        self.logger.info(f"Removed original HTML file: {html_path.name}")
+        
+        return docx_path
+    
+    def process_pool(self, workers=None):
+        """Return a ProcessConversionPool whose workers convert files like this converter.
+        
+        Workers are rebuilt from the constructor arguments, so a converter
+        with handlers added by register_element_handler() is refused rather
+        than converting differently in the workers.
+        """
+        defaults = {tag: getattr(self, name) for tag, name in self.ELEMENT_HANDLERS.items()}
+        if self._element_handlers != defaults:
+            raise ValueError("Converters with registered element handlers cannot convert in worker processes")
+        return ProcessConversionPool(workers, **self._options)
+    
+    def convert_bytes(self, html_bytes, sink=None):
+        """Convert HTML bytes to DOCX without touching the filesystem.
+        
+        The encoding is detected as it is for files. The package is written
+        to sink, a binary file object, or to a new BytesIO rewound for
+        reading when sink is None; the object written to is returned.
+        Unlike convert_html_to_docx(), errors are raised, not logged.
+        """
+        if self.streaming:
+            return self.convert_stream(io.BytesIO(html_bytes), sink)
+        return self._convert_to_sink(
+            lambda doc, writer: self._add_soup_to_doc(self._parse_html_bytes(html_bytes), doc, writer), sink)
+    
+    def convert_string(self, html_text, sink=None):
+        """Convert an HTML string to DOCX; output as for convert_bytes()."""
+        if self.streaming:
+            return self.convert_stream(io.StringIO(html_text), sink)
+        return self._convert_to_sink(
+            lambda doc, writer: self._add_soup_to_doc(self._parse_html(html_text), doc, writer), sink)
+    
+    def convert_stream(self, source, sink=None):
+        """Convert HTML read from a binary or text file object to DOCX.
+        
+        In streaming mode the source is converted as it is read, chunk by
+        chunk; otherwise it is read whole. Output as for convert_bytes().
+        """
+        if not self.streaming:
+            content = source.read()
+            if isinstance(content, str):
+                return self.convert_string(content, sink)
+            return self.convert_bytes(content, sink)
+        
+        head = source.read(STREAM_CHUNK_SIZE)
+        chunks = itertools.chain([head], iter(lambda: source.read(STREAM_CHUNK_SIZE), head[:0]))
+        encoding = None
+        if isinstance(head, str):
+            chunks = (chunk.encode('utf-8') for chunk in chunks)
+            encoding = 'utf-8'
+        return self._convert_to_sink(
+            lambda doc, writer: self._stream_chunks_to_doc(chunks, doc, writer, encoding), sink)
+    
+    def _stage_docx(self, add_content, docx_path):
+        """Write the package to a temporary file in docx_path's directory, then rename it into place.
+        
+        With fsync enabled the file is flushed to disk before the rename
+        and the directory after it.
+        """
+        staging_path = docx_path.with_name(f'.{docx_path.stem}.{uuid.uuid4().hex[:8]}{STAGING_SUFFIX}')
+        try:
+            with open(staging_path, 'xb') as staging:
+                self._write_docx(add_content, staging)
+                if self.fsync:
+                    staging.flush()
+                    os.fsync(staging.fileno())
+            os.replace(staging_path, docx_path)
+        except BaseException:
+            staging_path.unlink(missing_ok=True)
+            raise
+        if self.fsync:
+            _fsync_directory(docx_path.parent)
+    
+    def _convert_to_sink(self, add_content, sink):
+        output = io.BytesIO() if sink is None else sink
+        self._write_docx(add_content, output)
+        if sink is None:
+            output.seek(0)
+        return output
+    
+    def _write_docx(self, add_content, output):
+        """Build a document with add_content(doc, writer) and save it to output.
+        
+        output is a path or a binary file object.
+        """
+        # Copy the cached template (minimal 0.5cm margins by default)
+        doc = get_document_template(self.template).new_document(copy_styles=self.named_styles)
+        
+        if self.writer == 'stream':
+            with StreamingDocxWriter(doc, output, packaging=self.packaging) as writer:
+                add_content(doc, writer)
+        else:
+            add_content(doc, None)
+            
+            if self.named_styles:
+                self._register_named_styles(doc)
+            
+            # Save DOCX file
+            save_package(doc, output, self.packaging)
+    
+    def _convert_to_doc(self, html_path, doc, writer=None):
+        """Add the content of an HTML file to doc, by full parse or streaming."""
+        if self.streaming:
+            self._stream_html_to_doc(html_path, doc, writer)
+        else:
+            self._parse_html_to_doc(html_path, doc, writer)
+    
+    def _register_named_styles(self, doc):
+        """Replace recurring direct formatting with named styles in styles.xml.
+        
+        Runs with identical w:rPr share a character style, and paragraphs
+        with the same Word style and CSS paragraph formatting share a
+        paragraph style based on it. A combination becomes a style only if
+        it is used at least NAMED_STYLE_MIN_USES times and the references
+        plus the style definition are smaller than the formatting they
+        replace. Returns the number of styles added.
+        """
+        body = doc.element.body
+        run_tag, run_style_tag = qn('w:r'), qn('w:rStyle')
+        run_groups = {}
+        for rPr in body.iter(qn('w:rPr')):
+            # rStyle, when present, is always the first child
+            if len(rPr) and rPr[0].tag != run_style_tag and rPr.getparent().tag == run_tag:
+                run_groups.setdefault(etree.tostring(rPr), []).append(rPr)
+        paragraph_groups = {}
+        for pPr in body.iter(qn('w:pPr')):
+            formatting = [child for child in pPr if child.tag in PARAGRAPH_FORMATTING_TAGS]
+            if formatting:
+                key = (pPr.style, b''.join(etree.tostring(child) for child in formatting))
+                paragraph_groups.setdefault(key, []).append((pPr, formatting))
+        
+        default_paragraph_style = doc.styles.default(WD_STYLE_TYPE.PARAGRAPH).style_id
+        numbers = {}
+        added = 0
+        for group in run_groups.values():
+            formatting = list(group[0])
+            name = self._next_style_name(doc, 'HTML Text', numbers)
+            reference = len(f'<w:rStyle w:val="{name.replace(" ", "")}"/>')
+            if not self._named_style_saves(formatting, reference, len(group)):
+                continue
+            added += 1
+            style = doc.styles.add_style(name, WD_STYLE_TYPE.CHARACTER)
+            numbers['HTML Text'] += 1
+            style.element._insert_rPr(copy.deepcopy(group[0]))
+            replacement = OxmlElement('w:rPr')
+            replacement.style = style.style_id
+            for rPr in group:
+                rPr.getparent().replace(rPr, replacement.__copy__())
+        for (base_style, _), group in paragraph_groups.items():
+            formatting = group[0][1]
+            name = self._next_style_name(doc, 'HTML Paragraph', numbers)
+            if base_style:
+                reference = len(name.replace(' ', '')) - len(base_style)
+            else:
+                reference = len(f'<w:pStyle w:val="{name.replace(" ", "")}"/>')
+            if not self._named_style_saves(formatting, reference, len(group)):
+                continue
+            added += 1
+            style = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+            numbers['HTML Paragraph'] += 1
+            style.element.basedOn_val = base_style or default_paragraph_style
+            style_pPr = style.element.get_or_add_pPr()
+            for child in formatting:
+                getattr(style_pPr, '_insert_' + etree.QName(child).localname)(copy.deepcopy(child))
+            reference = OxmlElement('w:pStyle', {qn('w:val'): style.style_id})
+            for pPr, children in group:
+                for child in children:
+                    pPr.remove(child)
+                if base_style:
+                    pPr.pStyle.set(qn('w:val'), style.style_id)
+                else:
+                    pPr.insert(0, copy.deepcopy(reference))
+        self.logger.debug(f"Registered {added} named styles")
+        return added
+    
+    @staticmethod
+    def _next_style_name(doc, prefix, numbers):
+        """Return '<prefix> <n>' for the next number not yet taken in the document."""
+        number = numbers.setdefault(prefix, 0) + 1
+        while f"{prefix} {number}" in doc.styles:
+            number += 1
+        numbers[prefix] = number - 1
+        return f"{prefix} {number}"
+    
+    @staticmethod
+    def _named_style_saves(formatting, reference, uses):
+        """True if a named style would make the document smaller than direct formatting."""
+        if uses < NAMED_STYLE_MIN_USES:
+            return False
+        size = sum(len(XMLNS_DECLARATION_RE.sub(b'', etree.tostring(child))) for child in formatting)
+        return (size - reference) * uses > size + NAMED_STYLE_OVERHEAD
+    
+    def _parse_html_to_doc(self, html_path, doc, writer=None):
+        """Parse the whole HTML file and add its content to the document."""
+        # Large inputs that must not be held in memory whole go through _stream_html_to_doc
+        soup = self._parse_html_bytes(Path(html_path).read_bytes())
+        self._add_soup_to_doc(soup, doc, writer)
+    
+    def _parse_html_bytes(self, html_content):
+        """Parse raw HTML bytes, letting the parser decode them."""
+        encoding = self._sniff_encoding(html_content[:ENCODING_SNIFF_SIZE])
+        return self._parse_html(html_content, encoding)
+    
+    def _add_soup_to_doc(self, soup, doc, writer=None):
+        """Add the title and body of a parsed HTML document to doc."""
+        # Extract and apply CSS styles
+        css_styles = self._extract_css_styles(soup)
+        
+        # Extract title
+        title = soup.find('title')
+        if title:
+            self._add_heading(doc, title.get_text(), 0)
         
-        # Extract inline styles
-        for tag in soup.find_all(style=True):
-            if tag.get('style'):
-                css_styles[tag] = self._parse_inline_css(tag.get('style'))
+        # Process body content
+        body = soup.find('body')
+        if body:
+            self._process_html_elements(body, doc, css_styles, writer)
+        else:
+            # If no body tag, process the entire HTML
+            self._process_html_elements(soup, doc, css_styles, writer)
+    
+    def _stream_html_to_doc(self, html_path, doc, writer=None):
+        """Convert an HTML file block by block with an incremental parser."""
+        with open(html_path, 'rb') as file:
+            self._stream_chunks_to_doc(iter(lambda: file.read(STREAM_CHUNK_SIZE), b''), doc, writer)
+    
+    def _stream_chunks_to_doc(self, chunks, doc, writer=None, encoding=None):
+        """Convert HTML arriving as chunks of bytes block by block.
+        
+        The chunks are fed to lxml as they arrive and StreamingBlockTarget
+        hands every completed block to _emit_stream_fragment, so no tree
+        of the source document is ever built and peak memory does not grow
+        with the size of the input. Without an explicit encoding it is
+        sniffed from the first ENCODING_SNIFF_SIZE bytes, however they are
+        split into chunks.
+        """
+        target = StreamingBlockTarget(self, doc, writer)
+        chunks = iter(chunks)
+        head = []
+        head_size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            head_size += len(chunk)
+            if head_size >= ENCODING_SNIFF_SIZE:
+                break
+        head = b''.join(head)
+        encoding = encoding or self._sniff_encoding(head[:ENCODING_SNIFF_SIZE]) or self._guess_encoding(head)
+        # lxml is told the encoding, so a byte order mark would be read as text
+        for bom, _ in BYTE_ORDER_MARKS:
+            if head.startswith(bom):
+                head = head[len(bom):]
+                break
+        parser = etree.HTMLParser(target=target, encoding=encoding)
+        parser.feed(head)
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+    
+    def _emit_stream_fragment(self, markup, chain, doc, css_styles, writer=None):
+        """Process one block of markup inside the opening tags of its containers."""
+        closing = ''.join(f'</{tag}>' for _, tag in reversed(chain))
+        fragment = BeautifulSoup(''.join(opening for opening, _ in chain) + markup + closing, 'html.parser')
+        self._process_html_elements(fragment.body, doc, css_styles, writer)
+    
+    def _extract_css_styles(self, soup):
+        """Build a Stylesheet from the <style> tags outside <body>.
         
-        # Extract style tags
-        for style_tag in soup.find_all('style'):
-            if style_tag.string:
-                css_styles.update(self._parse_css_rules(style_tag.string))
+        Inline styles are parsed as the element walk reaches each element
+        and <style> tags inside <body> are handled by _handle_style, so the
+        body is not scanned here.
+        """
+        css_styles = Stylesheet()
+        body = soup.find('body')
+        stack = [soup]
+        while stack:
+            for child in stack.pop().children:
+                if child.name == 'style':
+                    if child.string:
+                        self._add_css_rules(css_styles, child.string)
+                elif child.name is not None and child is not body:
+                    stack.append(child)
         
         return css_styles
     
     def _parse_inline_css(self, style_string):
-        """Parse inline CSS styles."""
-        styles = {}
-        if style_string:
-            for rule in style_string.split(';'):
-                if ':' in rule:
-                    property_name, value = rule.split(':', 1)
-                    styles[property_name.strip()] = value.strip()
-        return styles
+        """Parse inline CSS styles into shared, immutable declarations."""
+        if not style_string:
+            return EMPTY_DECLARATIONS
+        return parse_declarations(style_string)
+    
+    def _iter_css_rules(self, css_text):
+        """Yield (selector, declarations) for each rule of a style sheet, in order."""
+        return iter_css_rules(css_text)
     
     def _parse_css_rules(self, css_text):
-        """Parse CSS rules from style tags."""
+        """Parse CSS rules from style tags into a dict keyed by selector."""
         styles = {}
-        # Simple CSS parser for basic rules
-        rules = re.findall(r'([^{]+)\{([^}]+)\}', css_text)
-        for selector, declarations in rules:
-            selector = selector.strip()
-            style_dict = {}
-            for decl in declarations.split(';'):
-                if ':' in decl:
-                    prop, value = decl.split(':', 1)
-                    style_dict[prop.strip()] = value.strip()
-            styles[selector] = style_dict
+        for selector, declarations in self._iter_css_rules(css_text):
+            styles.setdefault(selector, {}).update(declarations)
         return styles
     
-    def _apply_css_styles(self, element, paragraph, css_styles):
-        """Apply CSS styles to Word document elements."""
+    def _add_css_rules(self, css_styles, css_text):
+        """Add the rules of a style sheet to a Stylesheet."""
+        for selector, declarations in self._iter_css_rules(css_text):
+            css_styles.add_rule(selector, declarations)
+    
+    def _element_style(self, element, css_styles, parent_style=EMPTY_DECLARATIONS):
+        """Return the element's computed style.
+        
+        The element's own declarations, from the style sheet and its style
+        attribute, are applied over what it inherits from parent_style, the
+        parent's computed style.
+        """
+        declarations = merge_declarations(css_styles.match(element), self._parse_inline_css(element.get('style')))
+        return compute_style(parent_style, declarations)
+    
+    def _ancestor_style(self, element, css_styles):
+        """Return the computed style of an element by walking down from the document root."""
+        ancestors = []
+        node = _element_parent(element)
+        while node is not None:
+            ancestors.append(node)
+            node = _element_parent(node)
+        style = EMPTY_DECLARATIONS
+        for ancestor in reversed(ancestors):
+            style = self._element_style(ancestor, css_styles, style)
+        return self._element_style(element, css_styles, style)
+    
+    def _apply_css_styles(self, paragraph, inline_styles):
+        """Apply a computed style to a Word paragraph and all of its runs."""
         try:
-            # Get inline styles
-            inline_styles = {}
-            if element.get('style'):
-                inline_styles = self._parse_inline_css(element.get('style'))
-            
-            # Apply text formatting
             for run in paragraph.runs:
-                # Font size
-                if 'font-size' in inline_styles:
-                    size_str = inline_styles['font-size']
-                    if 'px' in size_str:
-                        size = int(size_str.replace('px', ''))
-                        run.font.size = Pt(size)
-                
-                # Font weight (bold)
-                if 'font-weight' in inline_styles:
-                    weight = inline_styles['font-weight']
-                    if weight in ['bold', '700', '800', '900']:
-                        run.font.bold = True
-                
-                # Font style (italic)
-                if 'font-style' in inline_styles:
-                    style = inline_styles['font-style']
-                    if style == 'italic':
-                        run.font.italic = True
-                
-                # Text color
-                if 'color' in inline_styles:
-                    color = inline_styles['color']
-                    if color.startswith('#'):
-                        # Convert hex to RGB
-                        hex_color = color.lstrip('#')
-                        rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-                        run.font.color.rgb = RGBColor(*rgb)
-                
-                # Text decoration (underline)
-                if 'text-decoration' in inline_styles:
-                    decoration = inline_styles['text-decoration']
-                    if 'underline' in decoration:
-                        run.font.underline = True
-            
-            # Apply paragraph formatting
-            # Text alignment
-            if 'text-align' in inline_styles:
-                align = inline_styles['text-align']
-                if align == 'center':
-                    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                elif align == 'right':
-                    paragraph.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                elif align == 'justify':
-                    paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-            
-            # Line height
-            if 'line-height' in inline_styles:
-                line_height = inline_styles['line-height']
-                if line_height.endswith('px'):
-                    height = int(line_height.replace('px', ''))
-                    paragraph.paragraph_format.line_spacing = Pt(height)
-            
+                self._format_run(run, inline_styles)
+            self._format_paragraph(paragraph, inline_styles)
+        except Exception as e:
+            self.logger.warning(f"Error applying CSS styles: {str(e)}")
+    
+    def _new_paragraph(self, doc, style_name=None):
+        """Append an empty paragraph in a Word paragraph style to the document body.
+        
+        With writer='stream' the w:p is built directly, taking the style id
+        from the document's DocumentDefaults, instead of through
+        doc.add_paragraph(), which resolves the style by name for every
+        paragraph. Both give the same XML.
+        """
+        if self.writer != 'stream':
+            return doc.add_paragraph(style=style_name)
+        p = OxmlElement('w:p')
+        if style_name is not None:
+            style_id = document_defaults(doc).paragraph_style_ids[style_name]
+            if style_id is not None:
+                p.style = style_id
+        doc.element.body._insert_p(p)
+        return Paragraph(p, doc._body)
+    
+    def _add_run(self, paragraph, text):
+        """Append a run of text to a paragraph.
+        
+        With writer='stream' plain text goes straight into a new w:r/w:t;
+        text with tabs or line breaks is left to python-docx, which splits
+        it into w:tab and w:br elements.
+        """
+        if self.writer != 'stream' or CELL_TEXT_BREAK_RE.search(text):
+            return paragraph.add_run(text)
+        r = OxmlElement('w:r')
+        if text:
+            r.add_t(text)
+        paragraph._p.append(r)
+        return Run(r, paragraph)
+    
+    def _add_text_paragraph(self, doc, text, inline_styles, style_name=None):
+        """Add a paragraph holding text as one run, both formatted from a computed style."""
+        paragraph = self._new_paragraph(doc, style_name)
+        if text:
+            self._add_styled_run(paragraph, text, inline_styles)
+        try:
+            self._format_paragraph(paragraph, inline_styles)
+        except Exception as e:
+            self.logger.warning(f"Error applying CSS styles: {str(e)}")
+        return paragraph
+    
+    def _add_styled_run(self, paragraph, text, inline_styles):
+        """Add a run to a paragraph and format it once from a computed style."""
+        run = self._add_run(paragraph, text)
+        try:
+            self._format_run(run, inline_styles)
         except Exception as e:
             self.logger.warning(f"Error applying CSS styles: {str(e)}")
+        return run
     
-    def _process_html_elements(self, element, doc, css_styles):
-        """Recursively process HTML elements and add them to the Word document."""
-        for child in element.children:
-            if child.name is None:  # Text node
-                if child.strip():
-                    paragraph = doc.add_paragraph(child.strip())
-                    self._apply_css_styles(element, paragraph, css_styles)
-            elif child.name == 'h1':
-                heading = doc.add_heading(child.get_text(), level=1)
-                self._apply_css_styles(child, heading, css_styles)
-            elif child.name == 'h2':
-                heading = doc.add_heading(child.get_text(), level=2)
-                self._apply_css_styles(child, heading, css_styles)
-            elif child.name == 'h3':
-                heading = doc.add_heading(child.get_text(), level=3)
-                self._apply_css_styles(child, heading, css_styles)
-            elif child.name == 'h4':
-                heading = doc.add_heading(child.get_text(), level=4)
-                self._apply_css_styles(child, heading, css_styles)
-            elif child.name == 'h5':
-                heading = doc.add_heading(child.get_text(), level=5)
-                self._apply_css_styles(child, heading, css_styles)
-            elif child.name == 'h6':
-                heading = doc.add_heading(child.get_text(), level=6)
-                self._apply_css_styles(child, heading, css_styles)
-            elif child.name == 'p':
-                paragraph = doc.add_paragraph()
-                # Handle mixed content (text and inline elements)
-                self._process_mixed_content(child, paragraph, css_styles)
-                self._apply_css_styles(child, paragraph, css_styles)
-            elif child.name == 'br':
-                doc.add_paragraph()
-            elif child.name == 'ul':
-                for li in child.find_all('li', recursive=False):
-                    paragraph = doc.add_paragraph(li.get_text(), style='List Bullet')
-                    self._apply_css_styles(li, paragraph, css_styles)
-            elif child.name == 'ol':
-                for li in child.find_all('li', recursive=False):
-                    paragraph = doc.add_paragraph(li.get_text(), style='List Number')
-                    self._apply_css_styles(li, paragraph, css_styles)
-            elif child.name == 'table':
-                self._process_table(child, doc, css_styles)
-            elif child.name in ['div', 'span', 'section', 'article']:
-                # Recursively process nested elements
-                self._process_html_elements(child, doc, css_styles)
-    
-    def _process_mixed_content(self, element, paragraph, css_styles):
-        """Process elements with mixed content (text and inline elements)."""
+    def _format_run(self, run, inline_styles):
+        """Set the character formatting of a single run from a computed style.
+        
+        The run gets a copy of the w:rPr element cached for the style, so
+        each distinct style goes through python-docx's setters only once.
+        """
+        properties = run_properties(inline_styles)
+        if properties is not None:
+            attach_properties(run._r, properties)
+    
+    def _format_paragraph(self, paragraph, inline_styles):
+        """Set the paragraph formatting (alignment, line height) from a computed style."""
+        properties = paragraph_properties(inline_styles)
+        if properties is not None:
+            attach_properties(paragraph._p, properties)
+    
+    def _process_html_elements(self, element, doc, css_styles, writer=None):
+        """Process the children of an HTML element and add them to the Word document.
+        
+        Containers are walked with an explicit stack instead of recursion,
+        so arbitrarily deep nesting neither hits the recursion limit nor
+        pays a function call per level.
+        
+        Each element's style is computed once, when the walk reaches it, from
+        its parent's computed style, and handed to its handler; container
+        styles stay on the stack for the text nodes and children they contain.
+        
+        With a streaming writer, finished blocks are handed to it as the
+        walk goes, so the body never grows past its flush threshold.
+        """
+        handlers = self._element_handlers
+        container = self._container_handler
+        stack = [(iter(element.children), self._ancestor_style(element, css_styles))]
+        while stack:
+            children, parent_style = stack[-1]
+            for child in children:
+                if child.name is None:  # Text node
+                    if child.strip() and not isinstance(child, PreformattedString):
+                        self._add_text_paragraph(doc, child.strip(), parent_style)
+                    continue
+                style = self._element_style(child, css_styles, parent_style)
+                handler = handlers.get(child.name, container)
+                if handler is container:
+                    stack.append((iter(child.children), style))
+                    break
+                handler(child, doc, css_styles, style)
+                if writer is not None:
+                    writer.maybe_flush()
+            else:
+                stack.pop()
+    
+    def _handle_heading(self, element, doc, css_styles, style):
+        """Add an h1-h6 element as a Word heading."""
+        self._add_heading(doc, element.get_text(), HEADING_LEVELS[element.name], style)
+    
+    def _add_heading(self, doc, text, level, inline_styles=EMPTY_DECLARATIONS):
+        """Add a heading paragraph, bold and sized directly if the document lacks its style."""
+        style_name = HEADING_STYLES[level]
+        if style_name not in document_defaults(doc).missing_styles:
+            return self._add_text_paragraph(doc, text, inline_styles, style_name)
+        paragraph = self._new_paragraph(doc)
+        if text:
+            run = self._add_run(paragraph, text)
+            run.bold = True
+            run.font.size = Pt(HEADING_FALLBACK_SIZES[level])
+        self._apply_css_styles(paragraph, inline_styles)
+        return paragraph
+    
+    def _handle_paragraph(self, element, doc, css_styles, style):
+        """Add a p element, keeping its inline formatting."""
+        paragraph = self._new_paragraph(doc)
+        # Handle mixed content (text and inline elements); runs are
+        # formatted as they are added, so only the paragraph is left.
+        self._process_mixed_content(element, paragraph, css_styles, style)
+        try:
+            self._format_paragraph(paragraph, style)
+        except Exception as e:
+            self.logger.warning(f"Error applying CSS styles: {str(e)}")
+    
+    def _handle_break(self, element, doc, css_styles, style):
+        """Add a br element as an empty paragraph."""
+        self._new_paragraph(doc)
+    
+    def _handle_bullet_list(self, element, doc, css_styles, style):
+        """Add the items of a ul element as bulleted paragraphs."""
+        self._add_list_items(element, doc, css_styles, 'List Bullet', style)
+    
+    def _handle_numbered_list(self, element, doc, css_styles, style):
+        """Add the items of an ol element as numbered paragraphs."""
+        self._add_list_items(element, doc, css_styles, 'List Number', style)
+    
+    def _add_list_items(self, element, doc, css_styles, list_style, style=EMPTY_DECLARATIONS):
+        """Add each direct li child of a list as a paragraph in the given Word style.
+        
+        style is the list element's computed style, which the items inherit.
+        Without list_style in the document, items get a text marker instead.
+        """
+        marker = None
+        if list_style in document_defaults(doc).missing_styles:
+            marker = LIST_FALLBACK_MARKERS[list_style]
+            list_style = None
+        for number, li in enumerate(element.find_all('li', recursive=False), 1):
+            text = li.get_text()
+            if marker is not None:
+                text = marker.format(number=number) + text
+            self._add_text_paragraph(doc, text, self._element_style(li, css_styles, style), list_style)
+    
+    def _handle_container(self, element, doc, css_styles, style):
+        """Process the children of a container element like body content."""
+        self._process_html_elements(element, doc, css_styles)
+    
+    def _handle_style(self, element, doc, css_styles, style):
+        """Add the rules of a <style> tag met inside the body."""
+        if element.string:
+            self._add_css_rules(css_styles, element.string)
+    
+    def _handle_ignored(self, element, doc, css_styles, style):
+        """Skip elements whose content does not belong in the document."""
+    
+    def _process_mixed_content(self, element, paragraph, css_styles, style):
+        """Process elements with mixed content (text and inline elements).
+        
+        Every run is formatted exactly once, when it is created, from the
+        computed style of the element its text came from.
+        """
         for content in element.contents:
             if content.name is None:  # Text node
                 if content.strip():
-                    run = paragraph.add_run(content.strip())
-                    self._apply_css_styles(element, paragraph, css_styles)
-            elif content.name in ['strong', 'b']:
-                run = paragraph.add_run(content.get_text())
-                run.font.bold = True
-            elif content.name in ['em', 'i']:
-                run = paragraph.add_run(content.get_text())
-                run.font.italic = True
-            elif content.name == 'u':
-                run = paragraph.add_run(content.get_text())
-                run.font.underline = True
-            elif content.name == 'span':
-                run = paragraph.add_run(content.get_text())
-                # Apply span-specific styles
-                if content.get('style'):
-                    span_styles = self._parse_inline_css(content.get('style'))
-                    if 'color' in span_styles:
-                        color = span_styles['color']
-                        if color.startswith('#'):
-                            hex_color = color.lstrip('#')
-                            rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-                            run.font.color.rgb = RGBColor(*rgb)
-            else:
-                # For other elements, just add the text
-                run = paragraph.add_run(content.get_text())
+                    self._add_styled_run(paragraph, content.strip(), style)
+                continue
+            run_style = self._element_style(content, css_styles, style)
+            if content.name in INLINE_TAG_STYLES:
+                run_style = merge_declarations(run_style, INLINE_TAG_STYLES[content.name])
+            self._add_styled_run(paragraph, content.get_text(), run_style)
     
-    def _process_table(self, table_element, doc, css_styles):
-        """Process HTML table and add it to the Word document."""
-        rows = table_element.find_all('tr')
-        if not rows:
+    def _process_table(self, table_element, doc, css_styles, style):
+        """Process HTML table and add it to the Word document.
+        
+        Cells are placed on a grid by layout_table(), which resolves
+        colspan and rowspan. The whole w:tbl is then built in one pass
+        and inserted into the body at once, rather than reaching each
+        cell through python-docx's table proxies, which rebuild a row's
+        cell list on every access.
+        """
+        table_background = background_declarations(self._with_table_background(table_element, style))
+        rows = []
+        for row in _table_rows(table_element):
+            row_style = self._with_table_background(
+                row, self._element_style(row, css_styles, style), table_background)
+            row_background = background_declarations(row_style)
+            rows.append([(cell, self._with_table_background(
+                              cell, self._element_style(cell, css_styles, row_style), row_background))
+                         for cell in row.find_all(TABLE_CELL_TAGS, recursive=False)])
+        grid, columns = layout_table(rows)
+        if not columns:
             return
         
-        # Create table
-        table = doc.add_table(rows=len(rows), cols=0)
-        table.style = 'Table Grid'
+        defaults = document_defaults(doc)
+        width = defaults.content_width
+        tbl = CT_Tbl.new_tbl(0, columns, width)
+        if defaults.table_style_id is not None:
+            tbl.tblPr.style = defaults.table_style_id
         
-        for i, row in enumerate(rows):
-            cells = row.find_all(['td', 'th'])
-            if i == 0:  # First row determines column count
-                table.columns = len(cells)
-            
-            for j, cell in enumerate(cells):
-                if j < len(table.rows[i].cells):
-                    table_cell = table.rows[i].cells[j]
-                    table_cell.text = cell.get_text().strip()
-                    
-                    # Apply cell-specific styles
-                    if cell.get('style'):
-                        cell_styles = self._parse_inline_css(cell.get('style'))
-                        # Apply background color if specified
-                        if 'background-color' in cell_styles:
-                            bg_color = cell_styles['background-color']
-                            if bg_color.startswith('#'):
-                                hex_color = bg_color.lstrip('#')
-                                rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-                                # Note: Background color for table cells requires more complex handling
-                                # This is a basic implementation
+        column_width = width // columns
+        cell_templates = {}
+        for slots in grid:
+            tr = OxmlElement('w:tr')
+            for cell, cell_style, colspan, merge in slots:
+                text = cell.get_text().strip() if cell is not None else ''
+                tr.append(self._build_table_cell(cell_templates, column_width, text, cell_style, colspan, merge))
+            tbl.append(tr)
+        
+        body = doc.element.body
+        if body.sectPr is not None:
+            body.sectPr.addprevious(tbl)
+        else:
+            body.append(tbl)
+    
+    def _with_table_background(self, element, style, fallback=EMPTY_DECLARATIONS):
+        """Return a table, row or cell style with the background it is painted with.
+        
+        A CSS background wins over the legacy bgcolor attribute; without
+        either, the element shows fallback, the background of the row or
+        table behind it.
+        """
+        if background_color(style) is not None:
+            return style
+        bgcolor = element.get('bgcolor')
+        if bgcolor:
+            return merge_declarations(style, parse_declarations(f'background-color: {bgcolor}'))
+        return merge_declarations(style, fallback)
+    
+    def _build_table_cell(self, cell_templates, column_width, text, cell_style, colspan=1, merge=None):
+        """Return a w:tc holding one paragraph with the cell's text and formatting.
+        
+        Spanning cells get w:gridSpan and w:vMerge markup directly instead
+        of going through python-docx's cell.merge(), and a background
+        becomes a copy of the cached w:shd for its color. Each distinct
+        cell shape is built once and kept in cell_templates; every cell
+        is a copy with its text filled in.
+        """
+        key = (cell_style, bool(text), colspan, merge)
+        template = cell_templates.get(key)
+        if template is None:
+            template = OxmlElement('w:tc')
+            tcPr = template.get_or_add_tcPr()
+            tcPr.get_or_add_tcW().width = column_width * colspan
+            if colspan > 1:
+                tcPr.grid_span = colspan
+            if merge is not None:
+                tcPr.vMerge_val = merge
+            fill = background_color(cell_style)
+            if fill is not None:
+                tcPr.insert_element_before(shading_element(str(fill)).__copy__(), *SHADING_SUCCESSORS)
+            p = template._add_p()
+            properties = paragraph_properties(cell_style)
+            if properties is not None:
+                attach_properties(p, properties)
+            if text:
+                r = p.add_r()
+                properties = run_properties(cell_style)
+                if properties is not None:
+                    attach_properties(r, properties)
+                r.add_t('')
+            cell_templates[key] = template
+        tc = template.__copy__()
+        if text:
+            if CELL_TEXT_BREAK_RE.search(text):
+                # Let python-docx turn tabs and line breaks into w:tab and w:br
+                r = next(tc.iter(qn('w:r')))
+                r.text = text
+            else:
+                next(tc.iter(qn('w:t'))).text = text
+        return tc
+
+
+class StreamingBlockTarget:
+    """lxml parser target that turns parser callbacks into document blocks.
+    
+    <html> and the containers from <body> down are tracked as a chain of
+    opening tags, so every emitted block can be re-parsed inside its real
+    ancestors for selector matching.
+    Any other element starting directly inside the chain is collected as
+    markup until it closes and is then emitted as one block; text sitting
+    directly inside a container is emitted when the next block starts or
+    the container closes. <title> and head <style> tags are captured
+    directly; <style> tags in the body are handled with the block they
+    belong to, their text copied into its markup unescaped.
+    """
+    
+    def __init__(self, converter, doc, writer=None):
+        self.converter = converter
+        self.doc = doc
+        self.writer = writer
+        self.css_styles = Stylesheet()
+        self.chain = []
+        self.in_body = False
+        self.block = None
+        self.block_depth = 0
+        self.text = []
+        self.capture = None
+        self.capture_tag = None
+        self.raw_text_tag = None
+        self.title_added = False
+    
+    def _opening_tag(self, tag, attrib):
+        attrs = ''.join(f' {name}="{html.escape(value)}"' for name, value in attrib.items())
+        return f'<{tag}{attrs}>'
+    
+    def _flush_text(self):
+        text = ''.join(self.text)
+        self.text = []
+        if text.strip():
+            self.converter._emit_stream_fragment(html.escape(text, quote=False), self.chain,
+                                                 self.doc, self.css_styles, self.writer)
+    
+    def start(self, tag, attrib):
+        # <style> inside the body reaches _handle_style with its block
+        if self.capture is None and (tag == 'title' or (tag == 'style' and not self.in_body)):
+            self.capture = []
+            self.capture_tag = tag
+        
+        if tag in RAW_TEXT_TAGS:
+            self.raw_text_tag = tag
+        
+        if self.block is not None:
+            self.block.append(self._opening_tag(tag, attrib))
+            self.block_depth += 1
+        elif tag == 'html' and not self.chain:
+            self.chain.append((self._opening_tag(tag, attrib), tag))
+        elif tag == 'body' and not self.in_body:
+            self.in_body = True
+            self.chain.append((self._opening_tag(tag, attrib), tag))
+        elif self.in_body:
+            self._flush_text()
+            if self.converter._is_container(tag):
+                self.chain.append((self._opening_tag(tag, attrib), tag))
+            else:
+                self.block = [self._opening_tag(tag, attrib)]
+                self.block_depth = 1
+    
+    def end(self, tag):
+        if self.capture is not None and tag == self.capture_tag:
+            text = ''.join(self.capture)
+            self.capture = None
+            if tag == 'title' and not self.title_added:
+                self.title_added = True
+                self.converter._add_heading(self.doc, text, 0)
+            elif tag == 'style' and text:
+                self.converter._add_css_rules(self.css_styles, text)
+        if tag == self.raw_text_tag:
+            self.raw_text_tag = None
+        
+        if self.block is not None:
+            if tag not in VOID_TAGS:
+                self.block.append(f'</{tag}>')
+            self.block_depth -= 1
+            if self.block_depth == 0:
+                markup = ''.join(self.block)
+                self.block = None
+                self.converter._emit_stream_fragment(markup, self.chain, self.doc, self.css_styles, self.writer)
+        elif self.chain and self.chain[-1][1] == tag:
+            if self.in_body:
+                self._flush_text()
+            self.chain.pop()
+            if tag == 'body':
+                self.in_body = False
+    
+    def data(self, text):
+        if self.capture is not None:
+            self.capture.append(text)
+        if self.block is not None:
+            self.block.append(text if self.raw_text_tag else html.escape(text, quote=False))
+        elif self.in_body:
+            self.text.append(text)
+    
+    def close(self):
+        self._flush_text()
+
+
+class PendingWrite:
+    """Polling state of a file that is still being written."""
+    
+    __slots__ = ('signature', 'changed', 'interval', 'due', 'closed')
+    
+    def __init__(self, signature, now, interval):
+        self.signature = signature
+        self.changed = now
+        self.interval = interval
+        self.due = now + interval
+        self.closed = False
+
+
+class WriteCompletionDetector:
+    """Calls callback(path) once a new file has been completely written.
+    
+    Pending files are polled on a background thread, so the observer
+    thread never waits. A polled file is complete once its size and mtime
+    have not changed for quiet_period seconds; an unchanged first poll is
+    never enough, since a writer may simply be pausing. While the file
+    keeps changing the interval starts at initial_interval and doubles
+    up to max_interval, so long downloads are not polled needlessly
+    often. Where the observer reports close-after-write (inotify's
+    IN_CLOSE_WRITE), completed() skips the wait altogether, as does
+    watch(complete=True).
+    
+    Empty files are never complete, since browsers create the file before
+    writing to it; they are dropped after empty_timeout seconds.
+    """
+    
+    def __init__(self, callback, initial_interval=STABILITY_INITIAL_INTERVAL, max_interval=STABILITY_MAX_INTERVAL,
+                 empty_timeout=EMPTY_FILE_TIMEOUT, quiet_period=STABILITY_QUIET_PERIOD):
+        self.callback = callback
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.quiet_period = quiet_period
+        self.empty_timeout = empty_timeout
+        self.logger = logging.getLogger(__name__)
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+    
+    def watch(self, path, complete=False):
+        """Start tracking a newly created file.
+        
+        With complete=True the file is known to be written already (a
+        finished download renamed into place) and is handed over at once.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._condition:
+            entry = PendingWrite((stat.st_size, stat.st_mtime_ns), time.monotonic(), self.initial_interval)
+            if complete:
+                entry.closed = True
+                entry.due = 0
+            self._pending[path] = entry
+            self._start()
+            self._condition.notify()
+    
+    def completed(self, path):
+        """Mark a pending file as closed by its writer, so it is handed over right away."""
+        with self._condition:
+            entry = self._pending.get(path)
+            if entry is not None:
+                entry.closed = True
+                entry.due = 0
+                self._condition.notify()
+    
+    def pending(self):
+        """Return the paths still waiting to be completely written."""
+        with self._condition:
+            return list(self._pending)
+    
+    def stop(self):
+        """Stop polling and drop the pending files."""
+        with self._condition:
+            self._stopped = True
+            self._pending.clear()
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _start(self):
+        if self._thread is None and not self._stopped:
+            self._thread = threading.Thread(target=self._run, name='write-completion', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    now = time.monotonic()
+                    due = [path for path, entry in self._pending.items() if entry.due <= now]
+                    if due:
+                        break
+                    next_due = min((entry.due for entry in self._pending.values()), default=None)
+                    self._condition.wait(None if next_due is None else next_due - now)
+                if self._stopped:
+                    return
+                complete = [path for path in due if self._poll(path, self._pending[path], now)]
+                for path in complete:
+                    del self._pending[path]
+            for path in complete:
+                try:
+                    self.callback(path)
+                except Exception as e:
+                    self.logger.error(f"Error handling completed file {path}: {str(e)}")
+    
+    def _poll(self, path, entry, now):
+        """Return True if path is complete; otherwise schedule its next poll."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._pending.pop(path)  # Deleted or renamed before it was complete
+            return False
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if stat.st_size and entry.closed:
+            return True
+        entry.closed = False
+        if signature != entry.signature:
+            entry.signature = signature
+            entry.changed = now
+        elif not stat.st_size:
+            if now - entry.changed >= self.empty_timeout:
+                self.logger.warning(f"Giving up on empty file: {path}")
+                self._pending.pop(path)
+                return False
+        elif now - entry.changed >= self.quiet_period:
+            return True
+        else:
+            # Unchanged so far; look again when the quiet period is over
+            entry.due = entry.changed + self.quiet_period
+            return False
+        entry.interval = min(entry.interval * 2, self.max_interval)
+        entry.due = now + entry.interval
+        return False
+
+
+class ConversionQueue:
+    """Bounded job queue feeding a pool of conversion worker threads.
+    
+    submit() blocks while queue_depth jobs are already waiting, which holds
+    back its caller (the WriteCompletionDetector, never the observer
+    thread) until a worker frees up. A path that is queued or being
+    converted is not queued again. Workers start with the first job.
+    """
+    
+    def __init__(self, convert, workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH):
+        if workers < 1:
+            raise ValueError(f"Need at least one worker: {workers}")
+        if queue_depth < 1:
+            raise ValueError(f"Queue depth must be positive: {queue_depth}")
+        self.convert = convert
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.logger = logging.getLogger(__name__)
+        self._jobs = queue.Queue(maxsize=queue_depth)
+        self._active = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopped = False
+    
+    @classmethod
+    def from_environment(cls, convert, workers=DEFAULT_WORKERS):
+        """Create a queue sized by HTML_CONVERTER_WORKERS and HTML_CONVERTER_QUEUE_DEPTH."""
+        return cls(convert, workers=int(os.environ.get(WORKERS_ENV, workers)),
+                   queue_depth=int(os.environ.get(QUEUE_DEPTH_ENV, DEFAULT_QUEUE_DEPTH)))
+    
+    def submit(self, path):
+        """Queue path for conversion; returns False if it is already queued or stopped."""
+        with self._lock:
+            if self._stopped or path in self._active:
+                return False
+            self._active.add(path)
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'converter-{len(self._threads) + 1}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._jobs.put(path)
+        return True
+    
+    def qsize(self):
+        """Return the number of jobs waiting for a worker."""
+        return self._jobs.qsize()
+    
+    def join(self):
+        """Wait until every queued job has been converted."""
+        self._jobs.join()
+    
+    def stop(self):
+        """Finish the queued jobs, then stop the workers."""
+        with self._lock:
+            self._stopped = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join()
+    
+    def _run(self):
+        while True:
+            path = self._jobs.get()
+            try:
+                if path is None:
+                    return
+                try:
+                    self.convert(path)
+                except Exception as e:
+                    self.logger.error(f"Error converting {path}: {str(e)}")
+                finally:
+                    with self._lock:
+                        self._active.discard(path)
+            finally:
+                self._jobs.task_done()
+
+
+class ConversionResult(namedtuple('ConversionResult', 'html_path docx_path seconds error worker')):
+    """Outcome of converting one file in a worker process."""
+    
+    __slots__ = ()
+    
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# The converter of the current worker process, built once by _start_worker.
+_worker_converter = None
+
+
+def _start_worker(options):
+    global _worker_converter
+    _worker_converter = HTMLToDOCXConverter(**options)
+
+
+def _convert_in_worker(html_file_path):
+    start = time.perf_counter()
+    try:
+        docx_path = _worker_converter._convert_file(Path(html_file_path))
+        return ConversionResult(html_file_path, str(docx_path), time.perf_counter() - start, None, os.getpid())
+    except Exception as e:
+        return ConversionResult(html_file_path, None, time.perf_counter() - start, str(e), os.getpid())
+
+
+def _spawn_context():
+    """Return the spawn context, pointed at the interpreter when Python is embedded.
+    
+    A service run by pywin32 has pythonservice.exe as sys.executable, which
+    cannot start worker processes; frozen executables handle this themselves.
+    """
+    context = multiprocessing.get_context('spawn')
+    if not getattr(sys, 'frozen', False) and not PYTHON_EXECUTABLE_RE.match(os.path.basename(sys.executable)):
+        if os.name == 'nt':
+            context.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+        else:
+            context.set_executable(os.path.join(sys.exec_prefix, 'bin', 'python3'))
+    return context
+
+
+class ProcessConversionPool:
+    """Converts HTML files in long-lived worker processes.
+    
+    Parsing and building documents is pure Python and holds the GIL, so
+    threads cannot convert on more than one core. Each worker process
+    builds its own HTMLToDOCXConverter from converter_options when it
+    starts, loading the modules and the document template once, and keeps
+    its caches warm across files. Only paths are sent to the workers and
+    only ConversionResult records come back; documents never cross the
+    process boundary.
+    
+    Workers are spawned rather than forked, as on Windows, so they never
+    inherit locks held by the parent's threads.
+    """
+    
+    def __init__(self, workers=None, **converter_options):
+        self.workers = workers or os.cpu_count() or 1
+        self.converter_options = converter_options
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+    
+    def _new_executor(self):
+        return ProcessPoolExecutor(self.workers, mp_context=_spawn_context(),
+                                   initializer=_start_worker, initargs=(self.converter_options,))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+    
+    def submit(self, html_file_path):
+        """Queue one file; returns a Future of its ConversionResult."""
+        return self._executor.submit(_convert_in_worker, str(html_file_path))
+    
+    def map(self, html_file_paths, chunksize=1):
+        """Convert many files, yielding their ConversionResults in order."""
+        return self._executor.map(_convert_in_worker, [str(path) for path in html_file_paths], chunksize=chunksize)
+    
+    def convert(self, html_file_path):
+        """Convert one file and wait for it; a drop-in for convert_html_to_docx().
+        
+        If a worker dies, the file fails and the pool is restarted, so
+        later files are converted again.
+        """
+        executor = self._executor
+        try:
+            result = executor.submit(_convert_in_worker, str(html_file_path)).result()
+        except BrokenProcessPool as e:
+            self.logger.error(f"Error converting {html_file_path}: worker process pool failed ({str(e)}); "
+                              f"restarting it")
+            self._restart(executor)
+            return False
+        if not result.ok:
+            self.logger.error(f"Error converting {html_file_path}: {result.error}")
+        return result.ok
+    
+    def _restart(self, broken):
+        """Replace the broken executor, once, however many callers saw it fail."""
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False)
+                self._executor = self._new_executor()
+    
+    def close(self):
+        """Wait for the queued files and stop the workers."""
+        self._executor.shutdown(wait=True)
 
 
 class DownloadFolderHandler(FileSystemEventHandler):
-    """Handles file system events in the Downloads folder."""
+    """Handles file system events in the Downloads folder.
+    
+    Events only hand new HTML files to a WriteCompletionDetector, which
+    queues them on a ConversionQueue once they are completely written, so
+    the observer thread never waits or converts. When
+    HTML_CONVERTER_PROCESSES is set, the queue's workers pass each file on
+    to a ProcessConversionPool of that many processes.
+    """
     
-    def __init__(self, converter):
+    def __init__(self, converter, detector=None, conversions=None):
         self.converter = converter
         self.logger = converter.logger
+        self.processes = None
+        if conversions is None:
+            processes = int(os.environ.get(PROCESSES_ENV, 0))
+            if processes:
+                self.processes = converter.process_pool(processes)
+                conversions = ConversionQueue.from_environment(self.processes.convert, workers=processes)
+            else:
+                conversions = ConversionQueue.from_environment(converter.convert_html_to_docx)
+        self.conversions = conversions
+        self.detector = detector or WriteCompletionDetector(self.conversions.submit)
     
     def on_created(self, event):
         """Handle file creation events."""
@@ -327,9 +2607,31 @@ class DownloadFolderHandler(FileSystemEventHandler):
             file_path = Path(event.src_path)
             if file_path.suffix.lower() == '.html':
                 self.logger.info(f"New HTML file detected: {file_path.name}")
-                # Wait a moment to ensure file is fully written
-                time.sleep(1)
-                self.converter.convert_html_to_docx(str(file_path))
+                # Convert once the file is fully written
+                self.detector.watch(str(file_path))
+    
+    def on_moved(self, event):
+        """Handle renames, which is how browsers finish downloads (.crdownload, .part)."""
+        if not event.is_directory:
+            file_path = Path(event.dest_path)
+            if file_path.suffix.lower() == '.html':
+                self.logger.info(f"Downloaded HTML file detected: {file_path.name}")
+                # A renamed download is already complete
+                self.detector.watch(str(file_path), complete=True)
+    
+    def on_closed(self, event):
+        """Handle close-after-write events, reported where inotify is available."""
+        if not event.is_directory:
+            file_path = Path(event.src_path)
+            if file_path.suffix.lower() == '.html':
+                self.detector.completed(str(file_path))
+    
+    def stop(self):
+        """Stop watching files that are still being written and finish queued conversions."""
+        self.detector.stop()
+        self.conversions.stop()
+        if self.processes:
+            self.processes.close()
 
 
 class HTMLConverterService(win32serviceutil.ServiceFramework):
@@ -360,6 +2662,7 @@ class HTMLConverterService(win32serviceutil.ServiceFramework):
     
     def main(self):
         """Main service loop."""
+        event_handler = None
         try:
             # Create event handler and observer
             event_handler = DownloadFolderHandler(self.converter)
@@ -367,7 +2670,9 @@ class HTMLConverterService(win32serviceutil.ServiceFramework):
             self.observer.schedule(event_handler, self.converter.downloads_path, recursive=False)
             self.observer.start()
             
-            self.logger.info(f"Monitoring Downloads folder: {self.converter.downloads_path}")
+            self.logger.info(f"Monitoring Downloads folder: {self.converter.downloads_path} "
+                             f"({event_handler.conversions.workers} workers, "
+                             f"queue depth {event_handler.conversions.queue_depth})")
             
             # Keep service running
             while True:
@@ -381,6 +2686,8 @@ class HTMLConverterService(win32serviceutil.ServiceFramework):
             if self.observer:
                 self.observer.stop()
                 self.observer.join()
+            if event_handler:
+                event_handler.stop()
 
 
 def run_as_console():
@@ -391,7 +2698,8 @@ def run_as_console():
     observer.schedule(event_handler, converter.downloads_path, recursive=False)
     observer.start()
     
-    print(f"Monitoring Downloads folder: {converter.downloads_path}")
+    print(f"Monitoring Downloads folder: {converter.downloads_path} ({event_handler.conversions.workers} workers, "
+          f"queue depth {event_handler.conversions.queue_depth})")
     print("Press Ctrl+C to stop...")
     
     try:
@@ -400,10 +2708,13 @@ def run_as_console():
     except KeyboardInterrupt:
         observer.stop()
         observer.join()
+        event_handler.stop()
         print("Monitoring stopped.")
 
 
 if __name__ == '__main__':
+    # Let worker processes start from a frozen executable
+    multiprocessing.freeze_support()
     if len(sys.argv) == 1:
         # Run as console application
         run_as_console()
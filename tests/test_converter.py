@@ -5,16 +5,41 @@ Comprehensive test suite for HTML to DOCX Converter
 
 import pytest
 import tempfile
+import time
 import os
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, PropertyMock
 import sys
 import os
 
 # Add parent directory to path to import the converter
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from html_to_docx_converter import HTMLToDOCXConverter
+from html_to_docx_converter import HTMLToDOCXConverter, Stylesheet
+
+
+def write_html_file(directory, html_content):
+    """Write HTML (str as UTF-8, or bytes) to page.html in directory and return its path"""
+    if isinstance(html_content, str):
+        html_content = html_content.encode('utf-8')
+    html_path = Path(directory) / 'page.html'
+    html_path.write_bytes(html_content)
+    return html_path
+
+
+def convert_to_package(converter, html_content):
+    """Convert HTML through a file in a temporary directory and return the bytes of the .docx"""
+    with tempfile.TemporaryDirectory() as tmp:
+        html_path = write_html_file(tmp, html_content)
+        assert converter.convert_html_to_docx(str(html_path)) is True
+        return html_path.with_suffix('.docx').read_bytes()
+
+
+def convert_to_document(converter, html_content):
+    """Convert HTML through a temporary file and load the resulting DOCX"""
+    import io
+    from docx import Document
+    return Document(io.BytesIO(convert_to_package(converter, html_content)))
 
 
 class TestHTMLToDOCXConverter:
@@ -113,7 +138,33 @@ class TestHTMLToDOCXConverter:
         css_styles = converter._extract_css_styles(soup)
         
         assert css_styles is not None
-        assert isinstance(css_styles, dict)
+        assert isinstance(css_styles, Stylesheet)
+        assert [rule.selector for rule in css_styles.rules] == ['body', 'h1']
+    
+    def test_inline_styles_parsed_once_per_element(self, converter):
+        """Each inline style is parsed exactly once during conversion"""
+        html_content = """
+        <html><body>
+            <div style="color: #ff0000">Loose <p style="font-size: 12px">Text <b>bold</b></p></div>
+            <ul style="color: #00ff00"><li style="font-weight: bold">Item</li></ul>
+        </body></html>
+        """
+        with patch.object(converter, '_parse_inline_css', wraps=converter._parse_inline_css) as parse:
+            convert_to_document(converter, html_content)
+        
+        parsed = [call.args[0] for call in parse.call_args_list if call.args[0]]
+        assert sorted(parsed) == sorted(['color: #ff0000', 'font-size: 12px',
+                                         'color: #00ff00', 'font-weight: bold'])
+    
+    def test_style_tag_in_body(self, converter):
+        """Style tags inside the body are collected without appearing as text"""
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup("<html><body><style>h2 { color: red; }</style><h2>Title</h2></body></html>",
+                             'html.parser')
+        css_styles = converter._extract_css_styles(soup)
+        converter._process_html_elements(soup.body, MagicMock(), css_styles)
+        
+        assert css_styles.match(soup.h2) == {'color': 'red'}
     
     def test_basic_html_conversion(self, converter, sample_html):
         """Test basic HTML to DOCX conversion"""
@@ -303,6 +354,1650 @@ class TestHTMLToDOCXConverter:
         assert downloads_path is not None
 
 
+class TestParserBackends:
+    """Test cases for parser backend selection"""
+    
+    def test_auto_selects_by_size(self):
+        """Small inputs use html.parser, large inputs use lxml"""
+        converter = HTMLToDOCXConverter(lxml_threshold=1024)
+        assert converter._select_parser(100) == 'html.parser'
+        if converter.parser_available('lxml'):
+            assert converter._select_parser(4096) == 'lxml'
+    
+    def test_explicit_backend(self):
+        """An explicitly configured backend is always used"""
+        converter = HTMLToDOCXConverter(parser='html.parser')
+        assert converter._select_parser(10 * 1024 * 1024) == 'html.parser'
+    
+    def test_unknown_backend_rejected(self):
+        """Unknown backend names raise ValueError"""
+        with pytest.raises(ValueError):
+            HTMLToDOCXConverter(parser='regex')
+    
+    def test_missing_backend_rejected(self):
+        """A known backend whose package is not installed fails at construction, not per file"""
+        with patch.object(HTMLToDOCXConverter, 'parser_available', return_value=False):
+            with pytest.raises(ValueError, match='not installed'):
+                HTMLToDOCXConverter(parser='html5lib')
+    
+    @pytest.mark.parametrize('backend', ['html.parser', 'lxml', 'html5lib'])
+    def test_conversion_with_backend(self, backend):
+        """Every installed backend produces a DOCX file"""
+        if not HTMLToDOCXConverter.parser_available(backend):
+            pytest.skip(f"{backend} not installed")
+        converter = HTMLToDOCXConverter(parser=backend)
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False) as f:
+            f.write("<html><body><h1>Title</h1><p>Some <b>bold</b> text.</p></body></html>")
+            html_path = f.name
+        docx_path = Path(html_path).with_suffix('.docx')
+        
+        try:
+            assert converter.convert_html_to_docx(html_path) is True
+            assert docx_path.exists()
+        finally:
+            if Path(html_path).exists():
+                Path(html_path).unlink()
+            if docx_path.exists():
+                docx_path.unlink()
+
+
+class TestStreamingConversion:
+    """Test cases for the incremental streaming conversion mode"""
+    
+    @pytest.fixture
+    def nested_html(self):
+        return """
+        <html>
+        <head><title>Streamed</title><style>p { color: red; }</style></head>
+        <body>
+            Loose body text
+            <h2>Heading</h2>
+            <section style="color: #00ff00">
+                Section text
+                <p>Paragraph with <strong>bold</strong> text.</p>
+                <div><p>Deeply nested</p> trailing</div>
+            </section>
+            <ul><li>One</li><li>Two</li></ul>
+            <br>
+            Closing text
+        </body>
+        </html>
+        """
+    
+    def test_streaming_matches_full_parse(self, nested_html):
+        """Streaming mode produces the same paragraphs as a full parse"""
+        full = convert_to_document(HTMLToDOCXConverter(parser='lxml'), nested_html)
+        streamed = convert_to_document(HTMLToDOCXConverter(parser='lxml', streaming=True), nested_html)
+        
+        def summary(doc):
+            return [(p.style.name, p.text, [r.bold for r in p.runs]) for p in doc.paragraphs]
+        
+        assert summary(streamed) == summary(full)
+    
+    def test_streaming_keeps_container_styles(self, nested_html):
+        """Text directly inside a styled container keeps the container style"""
+        doc = convert_to_document(HTMLToDOCXConverter(streaming=True), nested_html)
+        section_text = next(p for p in doc.paragraphs if p.text == 'Section text')
+        
+        assert str(section_text.runs[0].font.color.rgb) == '00FF00'
+    
+    def test_streaming_small_chunks(self, nested_html):
+        """Blocks split across parser feeds are emitted intact"""
+        import html_to_docx_converter
+        
+        with patch.object(html_to_docx_converter, 'STREAM_CHUNK_SIZE', 7):
+            doc = convert_to_document(HTMLToDOCXConverter(streaming=True), nested_html)
+        
+        texts = [p.text for p in doc.paragraphs]
+        assert texts[:3] == ['Streamed', 'Loose body text', 'Heading']
+        assert 'Deeply nested' in texts
+        assert texts[-1] == 'Closing text'
+    
+    def test_streaming_body_stylesheet_not_escaped(self):
+        """A child combinator in a body <style> reaches the stylesheet unescaped"""
+        html_content = ('<html><body><style>div > p { color: #ff0000 }</style>'
+                        '<p>outside</p><div><p>inside</p></div></body></html>')
+        for converter in (HTMLToDOCXConverter(), HTMLToDOCXConverter(streaming=True)):
+            doc = convert_to_document(converter, html_content)
+            outside, inside = (next(p for p in doc.paragraphs if p.text == text) for text in ('outside', 'inside'))
+            
+            assert outside.runs[0].font.color.rgb is None
+            assert str(inside.runs[0].font.color.rgb) == 'FF0000'
+
+
+class TestEncodingDetection:
+    """Test cases for byte-level input and charset sniffing"""
+    
+    @pytest.fixture
+    def converter(self):
+        return HTMLToDOCXConverter()
+    
+    def test_sniff_byte_order_marks(self, converter):
+        """Byte order marks take precedence over everything else"""
+        assert converter._sniff_encoding(b'\xef\xbb\xbf<html>') == 'utf-8'
+        assert converter._sniff_encoding('<html>'.encode('utf-16')) in ('utf-16le', 'utf-16be')
+    
+    def test_sniff_meta_charset(self, converter):
+        """Both <meta charset> forms are recognised"""
+        assert converter._sniff_encoding(b'<meta charset="Shift_JIS">') == 'shift_jis'
+        assert converter._sniff_encoding(
+            b'<meta http-equiv="Content-Type" content="text/html; charset=koi8-r">') == 'koi8-r'
+        assert converter._sniff_encoding(b"<meta charset='ISO-8859-1'>") == 'windows-1252'
+        assert converter._sniff_encoding(b'<meta charset="bogus">') is None
+        assert converter._sniff_encoding(b'<p>no declaration</p>') is None
+    
+    def test_guess_encoding(self, converter):
+        """Undeclared input falls back to UTF-8, then windows-1252"""
+        assert converter._guess_encoding('caf\u00e9'.encode('utf-8')) == 'utf-8'
+        assert converter._guess_encoding('caf\u00e9'.encode('utf-8')[:-1]) == 'utf-8'
+        assert converter._guess_encoding('caf\u00e9 \u201cok\u201d'.encode('windows-1252')) == 'windows-1252'
+    
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_declared_legacy_encoding(self, streaming):
+        """A windows-1251 page with <meta charset> converts with the right text"""
+        html_content = ('<html><head><meta charset="windows-1251"></head>'
+                        '<body><p>\u041f\u0440\u0438\u0432\u0435\u0442</p></body></html>')
+        doc = convert_to_document(HTMLToDOCXConverter(streaming=streaming),
+                                  html_content.encode('windows-1251'))
+        
+        assert doc.paragraphs[-1].text == '\u041f\u0440\u0438\u0432\u0435\u0442'
+    
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_undeclared_legacy_encoding(self, streaming):
+        """A windows-1252 page without a declaration no longer fails"""
+        html_content = '<html><body><p>Caf\u00e9 cr\u00e8me</p></body></html>'
+        doc = convert_to_document(HTMLToDOCXConverter(streaming=streaming),
+                                  html_content.encode('windows-1252'))
+        
+        assert doc.paragraphs[-1].text == 'Caf\u00e9 cr\u00e8me'
+    
+    @pytest.mark.parametrize('streaming', [False, True])
+    @pytest.mark.parametrize('encoding', ['utf-16', 'utf-8-sig'])
+    def test_utf16_with_bom(self, streaming, encoding):
+        """Files with a byte order mark are decoded, without the mark becoming text"""
+        html_content = '<html><body><p>Gr\u00fc\u00dfe</p></body></html>'
+        doc = convert_to_document(HTMLToDOCXConverter(streaming=streaming),
+                                  html_content.encode(encoding))
+        
+        assert [p.text for p in doc.paragraphs] == ['Gr\u00fc\u00dfe']
+    
+    @pytest.mark.parametrize('encoding', ['utf-16', 'utf-8-sig'])
+    def test_bom_split_across_chunks(self, encoding):
+        """The encoding is sniffed and the mark dropped even when the first chunks are tiny"""
+        import io
+        from docx import Document
+        import html_to_docx_converter
+        html_content = '<html><body><p>Gr\u00fc\u00dfe</p></body></html>'
+        
+        with patch.object(html_to_docx_converter, 'STREAM_CHUNK_SIZE', 1):
+            output = HTMLToDOCXConverter(streaming=True).convert_stream(io.BytesIO(html_content.encode(encoding)))
+        
+        assert [p.text for p in Document(output).paragraphs] == ['Gr\u00fc\u00dfe']
+
+
+class TestElementDispatch:
+    """Test cases for the tag handler table"""
+    
+    def test_semantic_containers_are_kept(self):
+        """Content of blockquote, main, nav and unknown tags is no longer dropped"""
+        html_content = """
+        <html><body>
+            <main><nav>Navigation</nav><blockquote><p>Quoted</p></blockquote></main>
+            <custom-widget>Widget text</custom-widget>
+        </body></html>
+        """
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert [p.text for p in doc.paragraphs] == ['Navigation', 'Quoted', 'Widget text']
+    
+    def test_scripts_and_comments_are_skipped(self):
+        """Script content and HTML comments do not become paragraphs"""
+        html_content = "<html><body><script>var x = 1;</script><!-- note --><p>Body</p></body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(parser='html.parser'), html_content)
+        
+        assert [p.text for p in doc.paragraphs] == ['Body']
+    
+    def test_all_heading_levels(self):
+        """h1-h6 map to the matching Word heading styles"""
+        html_content = "<html><body>" + "".join(f"<h{i}>H{i}</h{i}>" for i in range(1, 7)) + "</body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert [p.style.name for p in doc.paragraphs] == [f'Heading {i}' for i in range(1, 7)]
+    
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_register_element_handler(self, streaming):
+        """User-registered handlers are called for their tag"""
+        converter = HTMLToDOCXConverter(streaming=streaming)
+        calls = []
+        
+        def handle_hr(element, doc, css_styles, style):
+            calls.append(element.name)
+            doc.add_paragraph('----')
+        
+        converter.register_element_handler('HR', handle_hr)
+        doc = convert_to_document(converter, "<html><body><p>Above</p><div><hr></div><p>Below</p></body></html>")
+        
+        assert calls == ['hr']
+        assert [p.text for p in doc.paragraphs] == ['Above', '----', 'Below']
+
+
+class TestDeepNesting:
+    """Test cases for deeply nested documents"""
+    
+    @staticmethod
+    def nested_html(depth):
+        tags = ['div', 'section', 'article', 'span']
+        opening = ''.join(f'<{tags[i % 4]}>' for i in range(depth))
+        closing = ''.join(f'</{tags[i % 4]}>' for i in reversed(range(depth)))
+        return f"<html><body><p>Top</p>{opening}<p>Bottom</p>{closing}<p>After</p></body></html>"
+    
+    @pytest.mark.parametrize('parser', ['html.parser', 'lxml'])
+    def test_ten_thousand_levels(self, parser):
+        """Nesting far beyond the recursion limit converts without RecursionError"""
+        depth = max(10000, sys.getrecursionlimit() * 2)
+        doc = convert_to_document(HTMLToDOCXConverter(parser=parser), self.nested_html(depth))
+        
+        assert [p.text for p in doc.paragraphs] == ['Top', 'Bottom', 'After']
+    
+    def test_ten_thousand_levels_streaming(self):
+        """Streaming mode handles the same nesting depth"""
+        doc = convert_to_document(HTMLToDOCXConverter(streaming=True), self.nested_html(10000))
+        
+        assert [p.text for p in doc.paragraphs] == ['Top', 'Bottom', 'After']
+    
+    def test_text_order_across_levels(self):
+        """Text before, inside and after nested containers keeps document order"""
+        html_content = "<html><body><div>a<div>b<div>c</div>d</div>e</div></body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert [p.text for p in doc.paragraphs] == ['a', 'b', 'c', 'd', 'e']
+
+
+class TestDeclarationCache:
+    """Test cases for the shared inline declaration cache"""
+    
+    def test_repeated_strings_hit_cache(self):
+        """Repeated style strings are parsed once and counted as hits"""
+        from html_to_docx_converter import parse_declarations, declaration_cache_info
+        parse_declarations.cache_clear()
+        
+        first = parse_declarations('color: #123456; font-weight: bold')
+        second = parse_declarations('color: #123456; font-weight: bold')
+        info = declaration_cache_info()
+        
+        assert first is second
+        assert (info.hits, info.misses) == (1, 1)
+    
+    def test_equal_declarations_are_interned(self):
+        """Differently written but equal declarations share one object"""
+        from html_to_docx_converter import parse_declarations
+        
+        assert parse_declarations('color:red;') is parse_declarations(' color : red ')
+        assert parse_declarations('color: red') != parse_declarations('color: blue')
+    
+    def test_declarations_are_immutable(self):
+        """Parsed declarations cannot be modified by callers"""
+        from html_to_docx_converter import parse_declarations
+        declarations = parse_declarations('color: red')
+        
+        with pytest.raises(TypeError):
+            declarations['color'] = 'blue'
+        assert declarations == {'color': 'red'}
+        assert hash(declarations) == hash(parse_declarations('color:red'))
+    
+    def test_cache_is_bounded(self):
+        """The cache never holds more than its configured number of strings"""
+        from html_to_docx_converter import parse_declarations, declaration_cache_info
+        parse_declarations.cache_clear()
+        
+        for i in range(declaration_cache_info().maxsize + 100):
+            parse_declarations(f'width: {i}px')
+        
+        info = declaration_cache_info()
+        assert info.currsize == info.maxsize
+    
+    def test_conversion_reuses_parsed_styles(self):
+        """A page repeating one style string parses it only once"""
+        from html_to_docx_converter import parse_declarations, declaration_cache_info
+        parse_declarations.cache_clear()
+        html_content = "<html><body>" + '<p style="color: #ff0000">Row</p>' * 50 + "</body></html>"
+        
+        convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        info = declaration_cache_info()
+        assert info.misses == 1
+        assert info.hits == 49
+
+
+class TestStylesheetCascade:
+    """Test cases for the <style> rule cascade"""
+    
+    @pytest.fixture
+    def soup(self):
+        from bs4 import BeautifulSoup
+        return BeautifulSoup("""
+        <html><body>
+            <div id="main" class="content wide">
+                <p class="note">Note</p>
+                <section><p class="note" id="special">Special</p></section>
+            </div>
+            <p>Plain</p>
+        </body></html>
+        """, 'html.parser')
+    
+    def build(self, css_text):
+        converter = HTMLToDOCXConverter()
+        stylesheet = Stylesheet()
+        converter._add_css_rules(stylesheet, css_text)
+        return stylesheet
+    
+    def test_specificity_beats_source_order(self, soup):
+        """An id selector wins over later class and tag selectors"""
+        stylesheet = self.build("#special { color: blue; } .note { color: green; } p { color: red; }")
+        
+        assert stylesheet.match(soup.find(id='special'))['color'] == 'blue'
+        assert stylesheet.match(soup.find('p', class_='note'))['color'] == 'green'
+        assert stylesheet.match(soup.find_all('p')[-1])['color'] == 'red'
+    
+    def test_source_order_breaks_ties(self, soup):
+        """Later rules of equal specificity override earlier ones per property"""
+        stylesheet = self.build("p { color: red; font-size: 10px; } p { color: blue; }")
+        
+        assert stylesheet.match(soup.p) == {'color': 'blue', 'font-size': '10px'}
+    
+    def test_combinators(self, soup):
+        """Descendant and child combinators are matched right to left"""
+        stylesheet = self.build("""
+            #main p { font-weight: bold; }
+            div > p { font-style: italic; }
+            .content.wide section .note { color: #00ff00; }
+        """)
+        special = soup.find(id='special')
+        
+        assert stylesheet.match(soup.find('p', class_='note')) == {'font-weight': 'bold', 'font-style': 'italic'}
+        assert stylesheet.match(special) == {'font-weight': 'bold', 'color': '#00ff00'}
+        assert stylesheet.match(soup.find_all('p')[-1]) == {}
+    
+    def test_selector_lists_and_important(self, soup):
+        """Comma-separated selectors are split and !important wins the cascade"""
+        stylesheet = self.build("h1, .note { color: red !important; } #special { color: blue; }")
+        
+        assert len(stylesheet) == 3
+        assert stylesheet.match(soup.find(id='special'))['color'] == 'red'
+    
+    def test_unsupported_selectors_are_dropped(self):
+        """Pseudo-classes and pseudo-elements never match a static document"""
+        stylesheet = self.build("a:hover { color: red; } p::before { color: blue; } p { color: green; }")
+        
+        assert [rule.selector for rule in stylesheet.rules] == ['p']
+    
+    def test_candidates_come_from_index(self, soup):
+        """Only rules in the element's id, class and tag buckets are tested"""
+        stylesheet = self.build("".join(f".unused{i} {{ color: red; }}" for i in range(500)) + ".note { color: blue; }")
+        candidates = stylesheet._candidates(('p', None, ('note',)))
+        
+        assert [rule.selector for rule in candidates] == ['.note']
+    
+    def test_class_and_id_styles_reach_document(self):
+        """Class- and id-based rules are applied during conversion"""
+        html_content = """
+        <html><head><style>
+            .warning { color: #ff0000; font-weight: bold; }
+            #intro { text-align: center; }
+        </style></head>
+        <body><p class="warning">Careful</p><p id="intro">Welcome</p></body></html>
+        """
+        for streaming in (False, True):
+            doc = convert_to_document(HTMLToDOCXConverter(streaming=streaming), html_content)
+            warning, intro = doc.paragraphs
+            
+            assert str(warning.runs[0].font.color.rgb) == 'FF0000'
+            assert warning.runs[0].font.bold is True
+            assert intro.alignment == 1  # WD_ALIGN_PARAGRAPH.CENTER
+    
+    def test_inline_style_overrides_stylesheet(self):
+        """Inline style attributes take precedence over style sheet rules"""
+        html_content = """
+        <html><head><style>p { color: #ff0000; }</style></head>
+        <body><p style="color: #0000ff">Inline wins</p></body></html>
+        """
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert str(doc.paragraphs[0].runs[0].font.color.rgb) == '0000FF'
+
+
+class TestCSSTokenizer:
+    """Test cases for the single-pass style sheet parser"""
+    
+    def rules(self, css_text):
+        from html_to_docx_converter import iter_css_rules
+        return list(iter_css_rules(css_text))
+    
+    def test_comments_and_strings(self):
+        """Braces and semicolons inside comments and strings do not split rules"""
+        css_text = """
+        /* h1 { color: blue; } */
+        h1 { color: red; /* ignored; */ font-size: 12px }
+        a[title="x{y}"], .icon { content: "};"; background: url("data:image/png;base64,AA==") }
+        """
+        
+        assert self.rules(css_text) == [
+            ('h1', {'color': 'red', 'font-size': '12px'}),
+            ('a[title="x{y}"], .icon', {'content': '"};"', 'background': 'url("data:image/png;base64,AA==")'}),
+        ]
+    
+    def test_media_queries(self):
+        """Screen-only media blocks are skipped; print and untyped ones are kept"""
+        css_text = """
+        @media screen and (max-width: 600px) { .a { color: red } }
+        @media print { .b { color: red } }
+        @media only screen, print { .c { color: red } }
+        @media (min-width: 1px) { .d { color: red } }
+        @media not print { .e { color: red } }
+        @media not screen { .f { color: red } }
+        """
+        
+        assert [selector for selector, _ in self.rules(css_text)] == ['.b', '.c', '.d', '.f']
+    
+    def test_skipped_at_rules(self):
+        """Font faces, keyframes and statement at-rules never produce rules"""
+        css_text = """
+        @charset "utf-8";
+        @import url("print.css");
+        @font-face { font-family: X; src: url(x.woff) }
+        @keyframes spin { from { transform: rotate(0) } to { transform: rotate(360deg) } }
+        @supports (display: grid) { .grid { display: grid } }
+        p { color: red }
+        """
+        
+        assert [selector for selector, _ in self.rules(css_text)] == ['.grid', 'p']
+    
+    def test_malformed_input(self):
+        """Broken declarations and nested rules are dropped, the rest survives"""
+        css_text = ".x { color red; ; width: ; font-weight: bold; &:hover { color: blue } } .y { color: #fff"
+        
+        assert self.rules(css_text) == [('.x', {'font-weight': 'bold'}), ('.y', {'color': '#fff'})]
+    
+    def test_parse_css_rules_keeps_dict_view(self):
+        """_parse_css_rules still returns declarations keyed by selector"""
+        converter = HTMLToDOCXConverter()
+        styles = converter._parse_css_rules("p { color: red } p { font-size: 10px }")
+        
+        assert styles == {'p': {'color': 'red', 'font-size': '10px'}}
+
+
+class TestStyleInheritance:
+    """Test cases for computed styles inherited from parent elements"""
+    
+    def test_parent_color_reaches_child_paragraph(self):
+        """A color set on a div formats the paragraphs inside it"""
+        html_content = '<html><body><div style="color: #ff0000"><p>Inherited</p></div></body></html>'
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        run = next(p for p in doc.paragraphs if p.text == 'Inherited').runs[0]
+        assert str(run.font.color.rgb) == 'FF0000'
+    
+    def test_style_sheet_rules_are_inherited(self):
+        """Body rules from a style tag reach nested list items"""
+        html_content = """
+        <html><head><style>body { font-size: 12px; } ul { color: blue; }</style></head>
+        <body><div><ul><li>Item</li></ul></div></body></html>
+        """
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        run = next(p for p in doc.paragraphs if p.text == 'Item').runs[0]
+        assert run.font.size.pt == 12
+        assert str(run.font.color.rgb) == '0000FF'
+    
+    def test_relative_font_size_resolves_against_parent(self):
+        """em and percentage sizes scale the parent's computed size"""
+        from html_to_docx_converter import compute_style, parse_declarations
+        parent = compute_style(parse_declarations('font-size: 10px'), parse_declarations('font-size: 2em'))
+        child = compute_style(parent, parse_declarations('font-size: 50%'))
+        
+        assert parent['font-size'] == '20px'
+        assert child['font-size'] == '10px'
+    
+    def test_non_inherited_properties_stay_on_element(self):
+        """Properties such as background-color do not pass to children"""
+        from html_to_docx_converter import compute_style, parse_declarations, EMPTY_DECLARATIONS
+        parent = compute_style(EMPTY_DECLARATIONS, parse_declarations('color: red; background-color: blue'))
+        child = compute_style(parent, EMPTY_DECLARATIONS)
+        
+        assert parent == {'color': 'red', 'background-color': 'blue'}
+        assert child == {'color': 'red'}
+    
+    def test_inherit_keyword_takes_parent_value(self):
+        """'inherit' copies the parent's value, even for non-inherited properties"""
+        from html_to_docx_converter import compute_style, parse_declarations
+        parent = parse_declarations('background-color: blue; color: red')
+        child = compute_style(parent, parse_declarations('background-color: inherit; color: initial'))
+        
+        assert child == {'background-color': 'blue'}
+    
+    def test_unstyled_children_share_parent_style(self):
+        """Elements declaring nothing reuse their parent's computed style object"""
+        from bs4 import BeautifulSoup
+        converter = HTMLToDOCXConverter()
+        soup = BeautifulSoup('<div style="color: red"><section><p>x</p></section></div>', 'html.parser')
+        css_styles = Stylesheet()
+        
+        div_style = converter._element_style(soup.div, css_styles)
+        section_style = converter._element_style(soup.section, css_styles, div_style)
+        p_style = converter._element_style(soup.p, css_styles, section_style)
+        
+        assert section_style is div_style
+        assert p_style is div_style
+
+
+class TestMixedContent:
+    """Test cases for runs built from paragraphs with inline elements"""
+    
+    def test_each_run_formatted_once(self):
+        """Runs are formatted when created, not again for every later fragment"""
+        converter = HTMLToDOCXConverter()
+        html_content = '<html><body><p style="color: #00ff00">' + 'a <b>b</b> ' * 20 + '</p></body></html>'
+        
+        with patch.object(converter, '_format_run', wraps=converter._format_run) as format_run:
+            doc = convert_to_document(converter, html_content)
+        
+        paragraph = next(p for p in doc.paragraphs if p.runs)
+        assert len(paragraph.runs) == 40
+        assert format_run.call_count == 40
+        assert all(str(run.font.color.rgb) == '00FF00' for run in paragraph.runs)
+    
+    def test_inline_styles_survive_later_text(self):
+        """A span keeps its own color when paragraph text follows it"""
+        html_content = ('<html><body><p style="color: #0000ff">before '
+                        '<span style="color: #ff0000">red</span> after</p></body></html>')
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        runs = {run.text: run for p in doc.paragraphs for run in p.runs}
+        assert str(runs['red'].font.color.rgb) == 'FF0000'
+        assert str(runs['after'].font.color.rgb) == '0000FF'
+        assert str(runs['before'].font.color.rgb) == '0000FF'
+    
+    def test_inline_tags_keep_their_formatting(self):
+        """strong, em and u runs are bold, italic and underlined"""
+        html_content = '<html><body><p><strong>s</strong><em>e</em><u>u</u></p></body></html>'
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        runs = {run.text: run for p in doc.paragraphs for run in p.runs}
+        assert runs['s'].font.bold is True
+        assert runs['e'].font.italic is True
+        assert runs['u'].font.underline is True
+
+
+class TestFormattingCache:
+    """Test cases for cached run and paragraph property fragments"""
+    
+    def test_run_properties_built_once_per_style(self):
+        """Equal computed styles share one cached w:rPr fragment"""
+        from html_to_docx_converter import run_properties, parse_declarations
+        
+        first = run_properties(parse_declarations('color: #ff0000; font-weight: bold'))
+        second = run_properties(parse_declarations('font-weight: bold; color: #ff0000'))
+        
+        assert first is second
+        assert run_properties(parse_declarations('line-height: 18px')) is None
+    
+    def test_runs_get_independent_copies(self):
+        """Changing one run's formatting leaves other runs with the same style alone"""
+        html_content = '<html><body><p style="color: #ff0000">a <b>b</b> c</p></body></html>'
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        runs = next(p for p in doc.paragraphs if p.runs).runs
+        
+        runs[0].font.italic = True
+        
+        assert runs[0]._r.rPr is not runs[2]._r.rPr
+        assert runs[2].font.italic is None
+        assert runs[1].font.bold is True
+        assert str(runs[2].font.color.rgb) == 'FF0000'
+    
+    def test_paragraph_properties_merge_with_style(self):
+        """Cached paragraph properties keep the paragraph's Word style"""
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        html_content = '<html><body><h2 style="text-align: center; line-height: 20px">Title</h2></body></html>'
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        heading = next(p for p in doc.paragraphs if p.text == 'Title')
+        
+        assert heading.style.name == 'Heading 2'
+        assert heading.alignment == WD_ALIGN_PARAGRAPH.CENTER
+        assert heading.paragraph_format.line_spacing.pt == 20
+
+
+class TestNamedStyles:
+    """Test cases for registering recurring formatting as named styles"""
+    
+    STYLED_SPAN = '<span style="font-weight: bold; font-style: italic; color: #1a1a1a; font-size: 15px">lead</span>'
+    
+    def test_recurring_run_formatting_becomes_character_style(self):
+        """Runs sharing a formatting combination reference one character style"""
+        html_content = "<html><body>" + f"<p>Text {self.STYLED_SPAN}</p>" * 20 + "</body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(named_styles=True), html_content)
+        
+        runs = [run for p in doc.paragraphs for run in p.runs if run.text == 'lead']
+        style = runs[0].style
+        assert style.name.startswith('HTML Text')
+        assert all(run.style.style_id == style.style_id for run in runs)
+        assert all(run.font.bold is None for run in runs)
+        assert style.font.bold is True
+        assert style.font.italic is True
+        assert str(style.font.color.rgb) == '1A1A1A'
+    
+    def test_rare_or_small_formatting_stays_direct(self):
+        """Single-use combinations and ones cheaper than a reference keep direct formatting"""
+        html_content = ("<html><body>" + f"<p>{self.STYLED_SPAN}</p>" + "<p><b>bold</b></p>" * 20
+                        + "</body></html>")
+        doc = convert_to_document(HTMLToDOCXConverter(named_styles=True), html_content)
+        
+        runs = {run.text: run for p in doc.paragraphs for run in p.runs}
+        assert runs['lead'].font.bold is True
+        assert runs['bold'].font.bold is True
+        assert not any(style.name.startswith('HTML Text') for style in doc.styles)
+    
+    def test_paragraph_style_based_on_word_style(self):
+        """Recurring heading formatting becomes a paragraph style based on the heading"""
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        html_content = ("<html><body>"
+                        + '<h2 style="text-align: center; line-height: 22px">Title</h2>' * 20
+                        + "</body></html>")
+        doc = convert_to_document(HTMLToDOCXConverter(named_styles=True), html_content)
+        
+        headings = [p for p in doc.paragraphs if p.text == 'Title']
+        style = headings[0].style
+        assert style.name.startswith('HTML Paragraph')
+        assert style.base_style.name == 'Heading 2'
+        assert style.paragraph_format.alignment == WD_ALIGN_PARAGRAPH.CENTER
+        assert all(p.alignment is None and p.style.style_id == style.style_id for p in headings)
+    
+    def test_disabled_by_default(self):
+        """Without named_styles the output keeps direct formatting"""
+        html_content = "<html><body>" + f"<p>Text {self.STYLED_SPAN}</p>" * 5 + "</body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        runs = [run for p in doc.paragraphs for run in p.runs if run.text == 'lead']
+        assert all(run.font.bold is True for run in runs)
+        assert not any(style.name.startswith('HTML') for style in doc.styles)
+
+
+class TestTableBuilder:
+    """Test cases for tables built as a single w:tbl element"""
+    
+    def test_table_structure_and_text(self):
+        """Every row and cell lands in the Word table in order"""
+        html_content = """
+        <html><body><table>
+            <thead><tr><th>Name</th><th>Value</th></tr></thead>
+            <tbody><tr><td>a</td><td>1</td></tr><tr><td>b</td><td>2</td></tr></tbody>
+        </table></body></html>
+        """
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        table = doc.tables[0]
+        assert table.style.name == 'Table Grid'
+        assert len(table.columns) == 2
+        assert [[cell.text for cell in row.cells] for row in table.rows] == [
+            ['Name', 'Value'], ['a', '1'], ['b', '2']]
+    
+    def test_short_rows_are_padded(self):
+        """Rows with fewer cells are filled with empty cells up to the widest row"""
+        html_content = "<html><body><table><tr><td>1</td></tr><tr><td>2</td><td>3</td><td>4</td></tr></table></body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        table = doc.tables[0]
+        assert [[cell.text for cell in row.cells] for row in table.rows] == [['1', '', ''], ['2', '3', '4']]
+    
+    def test_nested_table_rows_stay_in_their_cell(self):
+        """Rows of a table inside a cell are not added to the outer table"""
+        html_content = """
+        <html><body><table><tr><td>outer<table><tr><td>inner</td></tr></table></td><td>x</td></tr></table></body></html>
+        """
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        table = doc.tables[0]
+        assert len(table.rows) == 1
+        assert table.rows[0].cells[0].text == 'outerinner'
+    
+    def test_line_breaks_in_cell_text(self):
+        """Newlines inside cell text become Word line breaks"""
+        html_content = "<html><body><table><tr><td>first\nsecond</td><td>plain</td></tr></table></body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        cell = doc.tables[0].rows[0].cells[0]
+        assert cell.text == 'first\nsecond'
+        assert cell._tc.xpath('.//w:br')
+    
+    def test_table_keeps_document_order(self):
+        """The table sits between the paragraphs around it"""
+        html_content = "<html><body><p>before</p><table><tr><td>cell</td></tr></table><p>after</p></body></html>"
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        body = doc.element.body
+        tags = [child.tag.split('}')[1] for child in body]
+        texts = [p.text for p in doc.paragraphs]
+        assert tags[texts.index('before') + 1] == 'tbl'
+        assert tags[-1] == 'sectPr'
+    
+    def test_cells_inherit_table_styles(self):
+        """Cell text is formatted from the computed style of its cell"""
+        html_content = ('<html><body><table style="color: #ff0000">'
+                        '<tr><td style="font-weight: bold">x</td><td>y</td></tr></table></body></html>')
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        x, y = (cell.paragraphs[0].runs[0] for cell in doc.tables[0].rows[0].cells)
+        assert x.font.bold is True
+        assert str(x.font.color.rgb) == 'FF0000'
+        assert y.font.bold is None
+        assert str(y.font.color.rgb) == 'FF0000'
+    
+    def test_width_and_style_resolved_from_template(self):
+        """Tables take the section width and table style the template resolved, not per-table lookups"""
+        from bs4 import BeautifulSoup
+        from docx.document import Document as WordDocument
+        from html_to_docx_converter import get_document_template
+        converter = HTMLToDOCXConverter()
+        doc = get_document_template().new_document()
+        body = BeautifulSoup('<html><body>' + '<table><tr><td>x</td></tr></table>' * 5 + '</body></html>', 'lxml').body
+        
+        with patch.object(WordDocument, 'sections', new_callable=PropertyMock) as sections, \
+                patch.object(WordDocument, 'styles', new_callable=PropertyMock) as styles:
+            converter._process_html_elements(body, doc, Stylesheet())
+        
+        assert sections.call_count == styles.call_count == 0
+        assert len(doc.tables) == 5
+        assert all(table.style.name == 'Table Grid' for table in doc.tables)
+    
+    def test_documents_do_not_share_defaults_through_stylesheet(self):
+        """A Stylesheet reused across documents does not carry one document's table width to another"""
+        from bs4 import BeautifulSoup
+        from docx import Document
+        from docx.shared import Inches
+        converter = HTMLToDOCXConverter()
+        stylesheet = Stylesheet()
+        body = BeautifulSoup('<html><body><table><tr><td>x</td></tr></table></body></html>', 'lxml').body
+        narrow, wide = Document(), Document()
+        wide.sections[-1].left_margin = wide.sections[-1].right_margin = Inches(0.2)
+        
+        for doc in (narrow, wide):
+            converter._process_html_elements(body, doc, stylesheet)
+        
+        for doc in (narrow, wide):
+            section = doc.sections[-1]
+            assert doc.tables[0].columns[0].width == section.page_width - section.left_margin - section.right_margin
+
+
+class TestTableLayout:
+    """Test cases for colspan and rowspan layout"""
+    
+    @staticmethod
+    def layout(html_content):
+        """Return the layout_table grid as (text, colspan, merge) triples, and the width"""
+        from bs4 import BeautifulSoup
+        from html_to_docx_converter import layout_table, EMPTY_DECLARATIONS
+        soup = BeautifulSoup(html_content, 'html.parser')
+        rows = [[(cell, EMPTY_DECLARATIONS) for cell in tr.find_all(['td', 'th'])] for tr in soup.find_all('tr')]
+        grid, columns = layout_table(rows)
+        return [[(cell.get_text() if cell else '', colspan, merge) for cell, _, colspan, merge in slots]
+                for slots in grid], columns
+    
+    def test_colspan_widens_grid(self):
+        """A spanning header covers the columns of the rows below it"""
+        grid, columns = self.layout("<table><tr><th colspan='3'>H</th></tr><tr><td>a</td><td>b</td><td>c</td></tr></table>")
+        
+        assert columns == 3
+        assert grid[0] == [('H', 3, None)]
+    
+    def test_rowspan_continues_in_later_rows(self):
+        """Cells spanning rows leave continuation slots at their column"""
+        grid, columns = self.layout(
+            "<table><tr><td rowspan='3'>A</td><td>1</td></tr>"
+            "<tr><td>2</td></tr><tr><td>3</td></tr><tr><td>x</td><td>4</td></tr></table>")
+        
+        assert columns == 2
+        assert grid[0] == [('A', 1, 'restart'), ('1', 1, None)]
+        assert grid[1] == [('', 1, 'continue'), ('2', 1, None)]
+        assert grid[2] == [('', 1, 'continue'), ('3', 1, None)]
+        assert grid[3] == [('x', 1, None), ('4', 1, None)]
+    
+    def test_rowspan_in_middle_and_end_columns(self):
+        """Continuations are placed at their own column, after earlier cells"""
+        grid, columns = self.layout(
+            "<table><tr><td>a</td><td rowspan='2' colspan='2'>B</td><td rowspan='2'>C</td></tr>"
+            "<tr><td>d</td></tr></table>")
+        
+        assert columns == 4
+        assert grid[1] == [('d', 1, None), ('', 2, 'continue'), ('', 1, 'continue')]
+    
+    def test_rowspan_zero_and_ragged_rows(self):
+        """rowspan=0 spans the remaining rows and short rows are padded"""
+        grid, columns = self.layout(
+            "<table><tr><td rowspan='0'>A</td><td>1</td><td>2</td></tr><tr><td>3</td></tr><tr></tr></table>")
+        
+        assert columns == 3
+        assert grid[1] == [('', 1, 'continue'), ('3', 1, None), ('', 1, None)]
+        assert grid[2] == [('', 1, 'continue'), ('', 1, None), ('', 1, None)]
+    
+    def test_overlapping_colspan_is_truncated(self):
+        """A colspan running into a cell carried down from above stops before it"""
+        grid, columns = self.layout(
+            "<table><tr><td>a</td><td rowspan='2'>B</td></tr><tr><td colspan='3'>c</td></tr></table>")
+        
+        assert grid[1] == [('c', 1, None), ('', 1, 'continue')]
+        assert columns == 2
+    
+    def test_invalid_spans_fall_back(self):
+        """Non-numeric and out-of-range spans are treated like the browser does"""
+        grid, columns = self.layout("<table><tr><td colspan='x' rowspan='-2'>a</td><td colspan='0'>b</td></tr></table>")
+        
+        assert grid[0] == [('a', 1, None), ('b', 1, None)]
+    
+    def test_merged_cells_in_document(self):
+        """Merged cells are written with gridSpan and vMerge markup"""
+        html_content = ("<html><body><table>"
+                        "<tr><th colspan='2'>Header</th><th>Z</th></tr>"
+                        "<tr><td rowspan='2'>Group</td><td>1</td><td>a</td></tr>"
+                        "<tr><td>2</td><td>b</td></tr>"
+                        "</table></body></html>")
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        table = doc.tables[0]
+        assert len(table.columns) == 3
+        assert [[cell.text for cell in row.cells] for row in table.rows] == [
+            ['Header', 'Header', 'Z'], ['Group', '1', 'a'], ['Group', '2', 'b']]
+        assert table.cell(1, 0)._tc is table.cell(2, 0)._tc
+        assert table.cell(0, 0)._tc is table.cell(0, 1)._tc
+
+
+class TestCellShading:
+    """Test cases for table cell background colors"""
+    
+    @staticmethod
+    def fills(doc):
+        """Return the w:shd fill of every cell of the first table, row by row"""
+        from docx.oxml.ns import qn
+        fills = []
+        for tr in doc.tables[0]._tbl.tr_lst:
+            row = []
+            for tc in tr.tc_lst:
+                shd = tc.tcPr.find(qn('w:shd'))
+                row.append(shd.get(qn('w:fill')) if shd is not None else None)
+            fills.append(row)
+        return fills
+    
+    def test_cell_background_colors(self):
+        """background-color, the background shorthand and bgcolor all shade a cell"""
+        html_content = ('<html><head><style>.hot { background: url(red.png) #ff0000 no-repeat; }</style></head>'
+                        '<body><table><tr><td style="background-color: #00ff00">a</td><td class="hot">b</td>'
+                        '<td bgcolor="navy">c</td><td>d</td></tr></table></body></html>')
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert self.fills(doc) == [['00FF00', 'FF0000', '000080', None]]
+    
+    def test_row_and_table_backgrounds_fill_cells(self):
+        """Cells without a background show their row's, then their table's"""
+        html_content = ('<html><body><table bgcolor="#eeeeee">'
+                        '<tr style="background-color: #0000ff"><td>a</td><td style="background: #ff0000">b</td></tr>'
+                        '<tr><td>c</td><td>d</td></tr></table></body></html>')
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert self.fills(doc) == [['0000FF', 'FF0000'], ['EEEEEE', 'EEEEEE']]
+    
+    def test_css_background_wins_over_bgcolor(self):
+        """The bgcolor attribute only applies when CSS sets no background"""
+        html_content = ('<html><body><table><tr>'
+                        '<td bgcolor="#ff0000" style="background-color: #00ff00">a</td></tr></table></body></html>')
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert self.fills(doc) == [['00FF00']]
+    
+    def test_merged_cells_keep_their_shading(self):
+        """Continuation cells of a rowspan are shaded like the cell they continue"""
+        html_content = ('<html><body><table><tr><td rowspan="2" style="background-color: #123456">a</td>'
+                        '<td>b</td></tr><tr><td>c</td></tr></table></body></html>')
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        assert self.fills(doc) == [['123456', None], ['123456', None]]
+    
+    def test_shading_elements_are_shared_templates(self):
+        """Each color's w:shd is built once and cells hold independent copies"""
+        from html_to_docx_converter import shading_element
+        from docx.oxml.ns import qn
+        html_content = ("<html><body><table>"
+                        + '<tr><td style="background-color: #abcdef">x</td></tr>' * 3
+                        + "</table></body></html>")
+        doc = convert_to_document(HTMLToDOCXConverter(), html_content)
+        
+        shading = [tr.tc_lst[0].tcPr.find(qn('w:shd')) for tr in doc.tables[0]._tbl.tr_lst]
+        assert shading_element('ABCDEF') is shading_element('ABCDEF')
+        assert len({id(shd) for shd in shading}) == 3
+        assert all(shd.getparent().getparent().tag == qn('w:tc') for shd in shading)
+
+
+class TestDocumentTemplate:
+    """Test cases for the cached template documents"""
+    
+    def test_default_template_has_minimal_margins(self):
+        """Copies of the default template carry the 0.2 inch margins"""
+        from docx.shared import Inches
+        from html_to_docx_converter import get_document_template
+        doc = get_document_template().new_document()
+        
+        section = doc.sections[0]
+        assert section.left_margin == Inches(0.2)
+        assert section.top_margin == Inches(0.2)
+    
+    def test_template_parsed_once(self):
+        """The template is loaded once and reused by every converter"""
+        from html_to_docx_converter import get_document_template
+        
+        assert get_document_template() is get_document_template()
+    
+    def test_copies_are_independent(self):
+        """Content added to one copy does not appear in the template or other copies"""
+        from html_to_docx_converter import get_document_template
+        template = get_document_template()
+        first = template.new_document()
+        first.add_paragraph('only here')
+        second = template.new_document()
+        
+        assert [p.text for p in first.paragraphs] == ['only here']
+        assert second.paragraphs == []
+        assert first.part is not second.part
+    
+    def test_styles_shared_unless_copied(self):
+        """Copies share the styles part unless they are going to add styles"""
+        from html_to_docx_converter import get_document_template
+        template = get_document_template()
+        
+        assert template.new_document().styles.element is template.new_document().styles.element
+        assert template.new_document(copy_styles=True).styles.element is not template.new_document().styles.element
+    
+    def test_named_styles_do_not_leak_into_template(self):
+        """Styles added in named-styles mode stay in their own document"""
+        from html_to_docx_converter import get_document_template
+        html_content = "<html><body>" + '<p><span style="font-weight: bold; font-style: italic; color: #1a1a1a; font-size: 15px">x</span></p>' * 20 + "</body></html>"
+        convert_to_document(HTMLToDOCXConverter(named_styles=True), html_content)
+        
+        assert not any(style.name.startswith('HTML') for style in get_document_template().new_document().styles)
+    
+    def test_custom_template(self):
+        """A custom .docx supplies styles and content, and is reloaded when it changes"""
+        from docx import Document
+        from docx.enum.style import WD_STYLE_TYPE
+        from html_to_docx_converter import get_document_template
+        with tempfile.TemporaryDirectory() as tmp:
+            template_path = Path(tmp) / 'letterhead.docx'
+            template = Document()
+            template.add_paragraph('Letterhead')
+            template.styles.add_style('Company', WD_STYLE_TYPE.PARAGRAPH)
+            template.save(str(template_path))
+            
+            converter = HTMLToDOCXConverter(template=template_path)
+            doc = convert_to_document(converter, "<html><body><p>Body</p></body></html>")
+            
+            assert [p.text for p in doc.paragraphs] == ['Letterhead', 'Body']
+            assert 'Company' in doc.styles
+            assert get_document_template(template_path) is get_document_template(str(template_path))
+            
+            first = get_document_template(template_path)
+            os.utime(template_path, ns=(0, template_path.stat().st_mtime_ns + 10**9))
+            assert get_document_template(template_path) is not first
+    
+    def test_template_without_heading_and_list_styles(self):
+        """Headings and list items whose style the template lacks get direct formatting instead"""
+        from docx import Document
+        with tempfile.TemporaryDirectory() as tmp:
+            template_path = Path(tmp) / 'word.docx'
+            template = Document()
+            for name in ('Title', 'Heading 3', 'List Bullet', 'List Number'):
+                template.styles[name].delete()
+            template.save(str(template_path))
+            html_content = ('<html><head><title>Report</title></head><body><h2>Kept</h2><h3>Plain</h3>'
+                            '<ul><li>a</li><li>b</li></ul><ol><li>one</li><li>two</li></ol></body></html>')
+            
+            for streaming in (False, True):
+                doc = convert_to_document(HTMLToDOCXConverter(template=template_path, streaming=streaming),
+                                          html_content)
+                paragraphs = {p.text: p for p in doc.paragraphs}
+                
+                assert list(paragraphs) == ['Report', 'Kept', 'Plain', '\u2022 a', '\u2022 b', '1. one', '2. two']
+                assert paragraphs['Kept'].style.name == 'Heading 2'
+                assert paragraphs['Plain'].style.name == 'Normal'
+                assert paragraphs['Plain'].runs[0].bold is True
+                assert paragraphs['Report'].runs[0].font.size.pt == 26
+                assert paragraphs['1. one'].style.name == 'Normal'
+    
+    def test_missing_template_fails_at_construction(self):
+        """A template path that does not exist is reported when the converter is created"""
+        with pytest.raises(FileNotFoundError):
+            HTMLToDOCXConverter(template='/nonexistent/template.docx')
+
+
+class TestStreamingWriter:
+    """Test cases for the streaming document.xml writer"""
+    
+    @staticmethod
+    def package(html_content, **options):
+        """Convert HTML and return {entry name: bytes}, in zip order"""
+        import io
+        import zipfile
+        with zipfile.ZipFile(io.BytesIO(convert_to_package(HTMLToDOCXConverter(**options), html_content))) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+    
+    @staticmethod
+    def canonical(xml):
+        from lxml import etree
+        return etree.tostring(etree.fromstring(xml), method='c14n')
+    
+    def test_same_package_as_python_docx(self):
+        """Both writers produce the same entries, and equivalent document.xml"""
+        rows = ''.join(f'<tr><td rowspan="2">{i}</td><td bgcolor="#eeeeee">cell</td></tr><tr><td>x</td></tr>' for i in range(20))
+        html_content = ("<html><head><title>Report</title><style>.note { color: #336699 }</style></head><body>"
+                        + "<h2>Section</h2><p class='note'>Some <b>bold</b> text</p><ul><li>item</li></ul>" * 200
+                        + f"<table>{rows}</table>loose text</body></html>")
+        python_docx = self.package(html_content)
+        streamed = self.package(html_content, writer='stream')
+        
+        assert list(streamed) == list(python_docx)
+        for name in python_docx:
+            if name == 'word/document.xml':
+                assert self.canonical(streamed[name]) == self.canonical(python_docx[name])
+            else:
+                assert streamed[name] == python_docx[name]
+    
+    def test_blocks_built_without_python_docx(self):
+        """The stream writer builds paragraphs itself rather than through Document.add_paragraph()"""
+        from docx.document import Document as WordDocument
+        html_content = ("<html><head><title>Report</title></head><body><h2>Section</h2>loose text<br>"
+                        "<p>Some <b>bold</b> text</p><ul><li>item</li></ul><ol><li>first</li></ol></body></html>")
+        expected = self.package(html_content)['word/document.xml']
+        
+        with patch.object(WordDocument, 'add_paragraph', side_effect=AssertionError('python-docx used')):
+            streamed = self.package(html_content, writer='stream')['word/document.xml']
+        
+        assert self.canonical(streamed) == self.canonical(expected)
+    
+    def test_breaks_and_missing_styles_match_python_docx(self):
+        """Text with tabs and line breaks, and styles a template lacks, come out as python-docx writes them"""
+        from docx import Document
+        html_content = ("<html><head><title>Report</title></head><body><h2>Tab\there</h2><h3>Plain</h3>"
+                        "<p style='color: #ff0000'>first\nsecond</p><ul><li>a</li><li>b</li></ul></body></html>")
+        with tempfile.TemporaryDirectory() as tmp:
+            template_path = Path(tmp) / 'word.docx'
+            template = Document()
+            for name in ('Title', 'Heading 3', 'List Bullet'):
+                template.styles[name].delete()
+            template.save(str(template_path))
+            
+            for template in (None, template_path):
+                expected = self.package(html_content, template=template)['word/document.xml']
+                streamed = self.package(html_content, template=template, writer='stream')['word/document.xml']
+                
+                assert self.canonical(streamed) == self.canonical(expected)
+    
+    def test_streaming_parser_and_writer(self):
+        """The streaming parser feeds the writer block by block"""
+        html_content = "<html><body>" + "<div><p>para</p></div>" * 1000 + "</body></html>"
+        
+        assert self.canonical(self.package(html_content, streaming=True, writer='stream')['word/document.xml']) == \
+            self.canonical(self.package(html_content)['word/document.xml'])
+    
+    def test_custom_template_content(self):
+        """Content and section properties of a custom template are kept"""
+        from docx import Document
+        from docx.enum.section import WD_ORIENT
+        with tempfile.TemporaryDirectory() as tmp:
+            template_path = Path(tmp) / 'landscape.docx'
+            template = Document()
+            template.add_paragraph('Letterhead')
+            template.sections[0].orientation = WD_ORIENT.LANDSCAPE
+            template.save(str(template_path))
+            
+            doc = convert_to_document(HTMLToDOCXConverter(template=template_path, writer='stream'),
+                                      "<html><body><p>Body</p></body></html>")
+        
+        assert [p.text for p in doc.paragraphs] == ['Letterhead', 'Body']
+        assert doc.sections[0].orientation == WD_ORIENT.LANDSCAPE
+    
+    def test_failed_conversion_removes_partial_file(self):
+        """An error while streaming leaves no truncated .docx behind"""
+        with tempfile.TemporaryDirectory() as tmp:
+            html_path = write_html_file(tmp, "<html><body><p>Body</p></body></html>")
+            converter = HTMLToDOCXConverter(writer='stream')
+            with patch.object(converter, '_process_html_elements', side_effect=RuntimeError('boom')):
+                assert converter.convert_html_to_docx(str(html_path)) is False
+            
+            assert not html_path.with_suffix('.docx').exists()
+            assert html_path.exists()
+    
+    def test_invalid_options(self):
+        """Unknown writers and named styles with the stream writer are rejected"""
+        with pytest.raises(ValueError):
+            HTMLToDOCXConverter(writer='odt')
+        with pytest.raises(ValueError):
+            HTMLToDOCXConverter(writer='stream', named_styles=True)
+
+
+class TestPackaging:
+    """Test cases for the .docx zip packaging options"""
+    
+    HTML = "<html><body>" + "<h2>Heading</h2><p>Some <b>bold</b> text</p>" * 200 + "</body></html>"
+    
+    @staticmethod
+    def entries(package):
+        import io
+        import zipfile
+        with zipfile.ZipFile(io.BytesIO(package)) as archive:
+            return archive.infolist()
+    
+    def test_default_matches_python_docx(self):
+        """Default packaging writes the entries Document.save() writes"""
+        import io
+        import zipfile
+        from html_to_docx_converter import get_document_template
+        expected = io.BytesIO()
+        get_document_template().new_document().save(expected)
+        
+        package = convert_to_package(HTMLToDOCXConverter(), "<html><body></body></html>")
+        
+        with zipfile.ZipFile(expected) as archive:
+            assert [(i.filename, i.compress_type) for i in self.entries(package)] == \
+                [(i.filename, i.compress_type) for i in archive.infolist()]
+    
+    @pytest.mark.parametrize('writer', ['docx', 'stream'])
+    def test_store_mode(self, writer):
+        """Store mode leaves every entry uncompressed"""
+        import zipfile
+        package = convert_to_package(HTMLToDOCXConverter(writer=writer, compression='store'), self.HTML)
+        
+        assert {entry.compress_type for entry in self.entries(package)} == {zipfile.ZIP_STORED}
+        assert len(package) > len(convert_to_package(HTMLToDOCXConverter(writer=writer), self.HTML))
+    
+    def test_compression_level(self):
+        """Higher deflate levels give smaller packages"""
+        fastest = convert_to_package(HTMLToDOCXConverter(compress_level=0), self.HTML)
+        smallest = convert_to_package(HTMLToDOCXConverter(compress_level=9), self.HTML)
+        
+        assert len(smallest) < len(fastest)
+    
+    @pytest.mark.parametrize('writer', ['docx', 'stream'])
+    def test_deterministic_output(self, writer):
+        """Identical input gives byte-identical packages with fixed timestamps"""
+        from html_to_docx_converter import DETERMINISTIC_DATE_TIME
+        first = convert_to_package(HTMLToDOCXConverter(writer=writer, deterministic=True), self.HTML)
+        with patch('time.time', return_value=time.time() + 86400):
+            second = convert_to_package(HTMLToDOCXConverter(writer=writer, deterministic=True), self.HTML)
+        
+        assert first == second
+        assert {entry.date_time for entry in self.entries(first)} == {DETERMINISTIC_DATE_TIME}
+    
+    def test_invalid_options(self):
+        """Unknown compression methods and out of range levels are rejected"""
+        with pytest.raises(ValueError):
+            HTMLToDOCXConverter(compression='bzip2')
+        with pytest.raises(ValueError):
+            HTMLToDOCXConverter(compress_level=10)
+        with pytest.raises(ValueError):
+            HTMLToDOCXConverter(compression='store', compress_level=6)
+
+
+class TestInMemoryConversion:
+    """Test cases for converting HTML held in memory"""
+    
+    HTML = ("<html><head><title>Report</title></head><body>"
+            + "<h2>Section</h2><p>Some <b>bold</b> text</p><ul><li>item</li></ul>" * 50 + "</body></html>")
+    
+    @staticmethod
+    def read(output):
+        from docx import Document
+        return Document(output)
+    
+    @pytest.mark.parametrize('options', [{}, {'streaming': True}, {'writer': 'stream'}])
+    def test_same_output_as_file_conversion(self, options):
+        """Strings, bytes and streams give the same package as a file on disk"""
+        import io
+        converter = HTMLToDOCXConverter(deterministic=True, **options)
+        expected = convert_to_package(HTMLToDOCXConverter(deterministic=True, **options), self.HTML)
+        
+        assert converter.convert_string(self.HTML).getvalue() == expected
+        assert converter.convert_bytes(self.HTML.encode('utf-8')).getvalue() == expected
+        assert converter.convert_stream(io.BytesIO(self.HTML.encode('utf-8'))).getvalue() == expected
+        assert converter.convert_stream(io.StringIO(self.HTML)).getvalue() == expected
+    
+    def test_returns_rewound_buffer(self):
+        """Without a sink a new BytesIO is returned, ready to read"""
+        output = HTMLToDOCXConverter().convert_string(self.HTML)
+        
+        assert output.tell() == 0
+        assert self.read(output).paragraphs[0].text == 'Report'
+    
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_writes_to_sink(self, streaming):
+        """A caller-supplied sink receives the package and is returned"""
+        with tempfile.TemporaryFile() as sink:
+            assert HTMLToDOCXConverter(streaming=streaming).convert_string(self.HTML, sink) is sink
+            sink.seek(0)
+            
+            assert 'bold' in [run.text for run in self.read(sink).paragraphs[2].runs]
+    
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_bytes_encoding_detection(self, streaming):
+        """Declared charsets are honoured for bytes input"""
+        html_bytes = '<html><head><meta charset="windows-1252"></head><body><p>café – naïve</p></body></html>'.encode('cp1252')
+        
+        output = HTMLToDOCXConverter(streaming=streaming).convert_bytes(html_bytes)
+        
+        assert self.read(output).paragraphs[0].text == 'café – naïve'
+    
+    def test_errors_are_raised(self):
+        """In-memory conversion raises instead of logging and returning False"""
+        converter = HTMLToDOCXConverter()
+        with patch.object(converter, '_process_html_elements', side_effect=RuntimeError('boom')):
+            with pytest.raises(RuntimeError):
+                converter.convert_string(self.HTML)
+
+
+class TestStagedOutput:
+    """Test cases for writing the .docx to a staging file and renaming it into place"""
+    
+    HTML = "<html><body>" + "<p>Some <b>bold</b> text</p>" * 50 + "</body></html>"
+    
+    @pytest.mark.parametrize('writer', ['docx', 'stream'])
+    def test_docx_appears_complete(self, writer):
+        """The .docx only appears by rename, as a complete package"""
+        import zipfile
+        renames = []
+        real_replace = os.replace
+        
+        def replace(source, destination):
+            renames.append((Path(destination).exists(), zipfile.ZipFile(source).testzip()))
+            real_replace(source, destination)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            html_path = write_html_file(tmp, self.HTML)
+            with patch('os.replace', side_effect=replace):
+                assert HTMLToDOCXConverter(writer=writer).convert_html_to_docx(str(html_path)) is True
+            
+            assert renames == [(False, None)]
+            assert os.listdir(tmp) == ['page.docx']
+    
+    def test_existing_docx_replaced(self):
+        """A previous .docx of the same name is replaced"""
+        from docx import Document
+        with tempfile.TemporaryDirectory() as tmp:
+            html_path = write_html_file(tmp, self.HTML)
+            html_path.with_suffix('.docx').write_bytes(b'stale')
+            
+            assert HTMLToDOCXConverter().convert_html_to_docx(str(html_path)) is True
+            assert len(Document(str(html_path.with_suffix('.docx'))).paragraphs) == 50
+    
+    @pytest.mark.parametrize('writer', ['docx', 'stream'])
+    def test_failure_leaves_no_files(self, writer):
+        """A failed conversion removes the staging file and keeps the HTML"""
+        with tempfile.TemporaryDirectory() as tmp:
+            html_path = write_html_file(tmp, self.HTML)
+            converter = HTMLToDOCXConverter(writer=writer)
+            with patch.object(converter, '_process_html_elements', side_effect=RuntimeError('boom')):
+                assert converter.convert_html_to_docx(str(html_path)) is False
+            
+            assert os.listdir(tmp) == ['page.html']
+    
+    def test_html_kept_when_rename_fails(self):
+        """The source HTML is only deleted after the rename succeeds"""
+        with tempfile.TemporaryDirectory() as tmp:
+            html_path = write_html_file(tmp, self.HTML)
+            with patch('os.replace', side_effect=PermissionError('in use')):
+                assert HTMLToDOCXConverter().convert_html_to_docx(str(html_path)) is False
+            
+            assert os.listdir(tmp) == ['page.html']
+    
+    @pytest.mark.parametrize('fsync', [False, True])
+    def test_fsync_option(self, fsync):
+        """With fsync the file is flushed before the rename"""
+        with tempfile.TemporaryDirectory() as tmp:
+            html_path = write_html_file(tmp, self.HTML)
+            with patch('os.fsync') as mock_fsync:
+                assert HTMLToDOCXConverter(fsync=fsync).convert_html_to_docx(str(html_path)) is True
+            
+            assert mock_fsync.called == fsync
+
+
+class TestWriteCompletionDetector:
+    """Test cases for detecting when a new file has been completely written"""
+    
+    @pytest.fixture
+    def completions(self):
+        """Detector factory recording (path, size, time) for each completed file"""
+        import threading
+        from html_to_docx_converter import WriteCompletionDetector
+        detectors = []
+        
+        class Completions(list):
+            event = threading.Event()
+            
+            def detector(self, **options):
+                def callback(path):
+                    self.append((path, os.path.getsize(path), time.monotonic()))
+                    self.event.set()
+                detectors.append(WriteCompletionDetector(callback, **options))
+                return detectors[-1]
+        
+        yield Completions()
+        for detector in detectors:
+            detector.stop()
+    
+    def test_written_file_completes_after_quiet_period(self, completions):
+        """An unchanged file is handed over once the quiet period has passed, not at the first poll"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'page.html')
+            Path(path).write_text('<p>done</p>')
+            start = time.monotonic()
+            completions.detector(quiet_period=0.3).watch(path)
+            
+            assert completions.event.wait(2)
+            assert completions[0][0] == path
+            assert 0.3 <= completions[0][2] - start < 1
+    
+    def test_waits_while_file_grows(self, completions):
+        """A file still being written is not handed over until writing stops"""
+        import threading
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'page.html')
+            Path(path).write_text('<p>')
+            completions.detector(max_interval=0.1, quiet_period=0.2).watch(path)
+            
+            def write():
+                with open(path, 'a') as f:
+                    for _ in range(20):
+                        time.sleep(0.03)
+                        f.write('chunk ')
+                        f.flush()
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join()
+            finished = time.monotonic()
+            
+            assert completions.event.wait(2)
+            assert completions[0][1] == os.path.getsize(path)
+            assert completions[0][2] >= finished
+    
+    def test_waits_while_writer_pauses(self, completions):
+        """A writer pausing for longer than the polling interval does not get a truncated file converted"""
+        import threading
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'page.html')
+            chunk = b'x' * 64 * 1024
+            Path(path).write_bytes(chunk)
+            completions.detector(quiet_period=0.5).watch(path)
+            
+            def write():
+                with open(path, 'ab') as f:
+                    for _ in range(4):
+                        time.sleep(0.25)
+                        f.write(chunk)
+                        f.flush()
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join()
+            
+            assert completions.event.wait(3)
+            assert completions[0][1] == 5 * len(chunk)
+    
+    def test_closed_file_completes_without_polling(self, completions):
+        """A close-after-write report hands the file over before the next poll"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'page.html')
+            Path(path).write_text('<p>done</p>')
+            detector = completions.detector(initial_interval=30)
+            detector.watch(path)
+            detector.completed(path)
+            
+            assert completions.event.wait(1)
+    
+    def test_complete_file_handed_over_at_once(self, completions):
+        """Files known to be complete skip the polling interval"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'page.html')
+            Path(path).write_text('<p>done</p>')
+            completions.detector(initial_interval=30).watch(path, complete=True)
+            
+            assert completions.event.wait(1)
+    
+    def test_empty_file_given_up(self, completions):
+        """Empty files are never handed over and are dropped after the timeout"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'page.html')
+            Path(path).touch()
+            detector = completions.detector(max_interval=0.05, empty_timeout=0.2)
+            detector.watch(path)
+            detector.completed(path)
+            
+            deadline = time.monotonic() + 2
+            while detector.pending() and time.monotonic() < deadline:
+                time.sleep(0.02)
+            assert detector.pending() == []
+            assert completions == []
+    
+    def test_removed_file_dropped(self, completions):
+        """A file deleted before it completes is forgotten"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'page.html')
+            Path(path).write_text('<p>')
+            detector = completions.detector(initial_interval=0.1)
+            detector.watch(path)
+            os.remove(path)
+            
+            time.sleep(0.3)
+            assert detector.pending() == []
+            assert completions == []
+
+
+class TestConversionQueue:
+    """Test cases for the bounded conversion worker pool"""
+    
+    @pytest.fixture
+    def pools(self):
+        """ConversionQueue factory that stops every queue it made"""
+        from html_to_docx_converter import ConversionQueue
+        queues = []
+        
+        def create(convert, **options):
+            queues.append(ConversionQueue(convert, **options))
+            return queues[-1]
+        
+        yield create
+        for conversions in queues:
+            conversions.stop()
+    
+    def test_workers_convert_concurrently(self, pools):
+        """Slow conversions run side by side on separate workers"""
+        conversions = pools(lambda path: time.sleep(0.2), workers=4)
+        start = time.monotonic()
+        for i in range(4):
+            conversions.submit(f'page{i}.html')
+        conversions.join()
+        
+        assert time.monotonic() - start < 0.6
+    
+    def test_submit_blocks_when_queue_full(self, pools):
+        """Once queue_depth jobs are waiting, submit waits for a worker"""
+        import threading
+        release = threading.Event()
+        conversions = pools(lambda path: release.wait(5), workers=1, queue_depth=1)
+        conversions.submit('running.html')
+        conversions.submit('waiting.html')
+        blocked = threading.Thread(target=conversions.submit, args=('blocked.html',))
+        blocked.start()
+        
+        blocked.join(0.2)
+        assert blocked.is_alive()
+        release.set()
+        blocked.join(2)
+        assert not blocked.is_alive()
+    
+    def test_duplicate_paths_skipped(self, pools):
+        """A path already queued or being converted is not queued again"""
+        import threading
+        release = threading.Event()
+        converted = []
+        conversions = pools(lambda path: (release.wait(5), converted.append(path)), workers=1)
+        
+        assert conversions.submit('page.html') is True
+        assert conversions.submit('page.html') is False
+        release.set()
+        conversions.join()
+        assert converted == ['page.html']
+        assert conversions.submit('page.html') is True
+    
+    def test_stop_finishes_queued_jobs(self, pools):
+        """Stopping converts what is already queued and refuses new jobs"""
+        converted = []
+        conversions = pools(lambda path: (time.sleep(0.01), converted.append(path)), workers=2)
+        for i in range(10):
+            conversions.submit(f'page{i}.html')
+        conversions.stop()
+        
+        assert sorted(converted) == sorted(f'page{i}.html' for i in range(10))
+        assert conversions.submit('late.html') is False
+    
+    def test_errors_do_not_stop_workers(self, pools):
+        """A failing conversion is logged and the worker carries on"""
+        converted = []
+        
+        def convert(path):
+            if path == 'bad.html':
+                raise RuntimeError('boom')
+            converted.append(path)
+        
+        conversions = pools(convert, workers=1)
+        conversions.submit('bad.html')
+        conversions.submit('good.html')
+        conversions.join()
+        
+        assert converted == ['good.html']
+    
+    def test_sizes_from_environment(self):
+        """Worker count and queue depth can be set through the environment"""
+        from html_to_docx_converter import ConversionQueue
+        with patch.dict(os.environ, {'HTML_CONVERTER_WORKERS': '16', 'HTML_CONVERTER_QUEUE_DEPTH': '500'}):
+            conversions = ConversionQueue.from_environment(lambda path: None)
+        
+        assert (conversions.workers, conversions.queue_depth) == (16, 500)
+    
+    def test_invalid_sizes(self):
+        """Pools need at least one worker and a positive queue depth"""
+        from html_to_docx_converter import ConversionQueue
+        with pytest.raises(ValueError):
+            ConversionQueue(lambda path: None, workers=0)
+        with pytest.raises(ValueError):
+            ConversionQueue(lambda path: None, queue_depth=0)
+
+
+@pytest.fixture(scope='module')
+def pool():
+    """Two-process pool shared by the process pool tests, since workers take a while to start"""
+    with HTMLToDOCXConverter(deterministic=True).process_pool(2) as pool:
+        yield pool
+
+
+class TestProcessConversionPool:
+    """Test cases for converting in long-lived worker processes"""
+    
+    @staticmethod
+    def write_pages(tmp, count):
+        paths = []
+        for i in range(count):
+            paths.append(Path(tmp) / f'page{i}.html')
+            paths[-1].write_text(f"<html><body><h1>Page {i}</h1><p>Some <b>bold</b> text</p></body></html>",
+                                 encoding='utf-8')
+        return paths
+    
+    def test_converts_files(self, pool):
+        """Workers convert the files and return a small record for each, in order"""
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = self.write_pages(tmp, 4)
+            results = list(pool.map(paths))
+            
+            assert [result.html_path for result in results] == [str(path) for path in paths]
+            assert all(result.ok for result in results)
+            assert sorted(os.listdir(tmp)) == [f'page{i}.docx' for i in range(4)]
+            assert results[0].docx_path == str(paths[0].with_suffix('.docx'))
+    
+    def test_same_output_as_in_process(self, pool):
+        """Workers are built with the options of the converter that made the pool"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.write_pages(tmp, 1)[0]
+            expected = HTMLToDOCXConverter(deterministic=True).convert_string(path.read_text()).getvalue()
+            
+            assert pool.submit(path).result().ok
+            assert path.with_suffix('.docx').read_bytes() == expected
+    
+    def test_errors_returned_as_records(self, pool):
+        """A failed conversion comes back as a record and convert() returns False"""
+        result = pool.submit('/nonexistent/page.html').result()
+        
+        assert not result.ok
+        assert result.docx_path is None
+        assert 'No such file' in result.error
+        assert pool.convert('/nonexistent/page.html') is False
+    
+    def test_workers_are_long_lived(self, pool):
+        """The same worker processes convert file after file"""
+        with tempfile.TemporaryDirectory() as tmp:
+            workers = {result.worker for result in pool.map(self.write_pages(tmp, 10))}
+        
+        assert len(workers) <= 2
+        assert os.getpid() not in workers
+    
+    def test_pool_restarted_after_worker_dies(self):
+        """A dead worker fails the file in flight, then the pool is rebuilt for later files"""
+        from concurrent.futures.process import BrokenProcessPool
+        with tempfile.TemporaryDirectory() as tmp, HTMLToDOCXConverter().process_pool(1) as pool:
+            path = self.write_pages(tmp, 1)[0]
+            with pytest.raises(BrokenProcessPool):
+                pool._executor.submit(os._exit, 1).result()
+            
+            assert pool.convert(path) is False
+            assert pool.convert(path) is True
+            assert path.with_suffix('.docx').exists()
+    
+    @pytest.mark.parametrize('executable, replaced', [
+        ('python3.11', False),
+        ('python.exe', False),
+        ('pythonw.exe', False),
+        ('pythonservice.exe', True),
+    ])
+    def test_spawn_executable(self, executable, replaced):
+        """Workers are started with the interpreter when Python is embedded in a host process"""
+        from html_to_docx_converter import _spawn_context
+        with patch('sys.executable', os.path.join(sys.exec_prefix, executable)), \
+                patch('multiprocessing.get_context') as get_context:
+            _spawn_context()
+        
+        assert get_context.return_value.set_executable.called == replaced
+    
+    def test_registered_handlers_refused(self):
+        """Workers cannot run handlers registered on the parent's converter"""
+        converter = HTMLToDOCXConverter()
+        converter.register_element_handler('hr', lambda element, doc, css_styles, style: doc.add_paragraph('---'))
+        
+        with pytest.raises(ValueError):
+            converter.process_pool(2)
+    
+    def test_handler_uses_processes_from_environment(self):
+        """HTML_CONVERTER_PROCESSES puts a process pool behind the handler's queue"""
+        from html_to_docx_converter import DownloadFolderHandler
+        with patch.dict(os.environ, {'HTML_CONVERTER_PROCESSES': '2'}):
+            handler = DownloadFolderHandler(HTMLToDOCXConverter())
+        try:
+            assert handler.processes.workers == 2
+            assert handler.conversions.workers == 2
+            assert handler.conversions.convert == handler.processes.convert
+        finally:
+            handler.stop()
+
+
 class TestFileSystemHandler:
     """Test cases for file system event handling"""
     
@@ -319,49 +2014,116 @@ class TestFileSystemHandler:
         """Test file system handler initialization"""
         assert handler.converter == converter
         assert handler.logger == converter.logger
+        assert handler.detector.callback == handler.conversions.submit
+        assert handler.conversions.convert == converter.convert_html_to_docx
     
-    @patch('html_to_docx_converter.HTMLToDOCXConverter.convert_html_to_docx')
-    def test_on_created_html_file(self, mock_convert, handler):
+    def test_on_created_html_file(self, handler):
         """Test handling of HTML file creation event"""
-        from watchdog.events import FileCreatedEvent
-        
         # Mock event
         event = MagicMock()
         event.is_directory = False
         event.src_path = "/path/to/test.html"
         
-        # Mock Path
-        with patch('pathlib.Path') as mock_path:
-            mock_path_instance = MagicMock()
-            mock_path_instance.suffix = '.html'
-            mock_path.return_value = mock_path_instance
-            
+        with patch.object(handler.detector, 'watch') as mock_watch:
             # Test the handler
             handler.on_created(event)
             
-            # Verify conversion was called
-            mock_convert.assert_called_once_with("/path/to/test.html")
+            # Conversion waits for the file to be completely written
+            mock_watch.assert_called_once_with(str(Path("/path/to/test.html")))
     
     def test_on_created_non_html_file(self, handler):
         """Test handling of non-HTML file creation event"""
-        from watchdog.events import FileCreatedEvent
-        
         # Mock event
         event = MagicMock()
         event.is_directory = False
         event.src_path = "/path/to/test.txt"
         
-        # Mock Path
-        with patch('pathlib.Path') as mock_path:
-            mock_path_instance = MagicMock()
-            mock_path_instance.suffix = '.txt'
-            mock_path.return_value = mock_path_instance
-            
+        with patch.object(handler.detector, 'watch') as mock_watch:
             # Test the handler
             handler.on_created(event)
             
             # Should not trigger conversion for non-HTML files
-
+            mock_watch.assert_not_called()
+    
+    def test_on_closed_completes_html_file(self, handler):
+        """A close-after-write event hands the file over without waiting"""
+        event = MagicMock()
+        event.is_directory = False
+        event.src_path = "/path/to/test.html"
+        
+        with patch.object(handler.detector, 'completed') as mock_completed:
+            handler.on_closed(event)
+            
+            mock_completed.assert_called_once_with(str(Path("/path/to/test.html")))
+    
+    @pytest.mark.parametrize('source', ['test.html.crdownload', 'test.html.part', 'Unconfirmed 1234.crdownload'])
+    def test_on_moved_to_html_file(self, handler, source):
+        """A download renamed to .html is handed over as complete"""
+        event = MagicMock()
+        event.is_directory = False
+        event.src_path = f"/path/to/{source}"
+        event.dest_path = "/path/to/test.html"
+        
+        with patch.object(handler.detector, 'watch') as mock_watch:
+            handler.on_moved(event)
+            
+            mock_watch.assert_called_once_with(str(Path("/path/to/test.html")), complete=True)
+    
+    def test_on_moved_to_non_html_file(self, handler):
+        """Renames to other file types are ignored"""
+        event = MagicMock()
+        event.is_directory = False
+        event.src_path = "/path/to/test.zip.crdownload"
+        event.dest_path = "/path/to/test.zip"
+        
+        with patch.object(handler.detector, 'watch') as mock_watch:
+            handler.on_moved(event)
+            
+            mock_watch.assert_not_called()
+    
+    def test_renamed_download_converted(self, converter):
+        """A browser-style download, written under a temporary name and renamed, is converted"""
+        import threading
+        from watchdog.observers import Observer
+        from html_to_docx_converter import DownloadFolderHandler
+        converted = []
+        done = threading.Event()
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch.object(converter, 'convert_html_to_docx', side_effect=lambda path: (converted.append(path), done.set())):
+                handler = DownloadFolderHandler(converter)
+                observer = Observer()
+                observer.schedule(handler, tmp, recursive=False)
+                observer.start()
+                try:
+                    partial = Path(tmp) / 'page.html.crdownload'
+                    partial.write_text("<html><body><p>Hello</p></body></html>", encoding='utf-8')
+                    os.rename(partial, Path(tmp) / 'page.html')
+                    assert done.wait(5)
+                finally:
+                    observer.stop()
+                    observer.join()
+                    handler.stop()
+            
+            assert converted == [str(Path(tmp) / 'page.html')]
+    
+    def test_on_created_does_not_block(self, converter):
+        """The observer thread returns at once and the file is converted once written"""
+        import threading
+        from html_to_docx_converter import DownloadFolderHandler
+        converted = threading.Event()
+        with tempfile.TemporaryDirectory() as tmp:
+            html_path = write_html_file(tmp, "<html><body><p>Hello</p></body></html>")
+            event = MagicMock()
+            event.is_directory = False
+            event.src_path = str(html_path)
+            
+            with patch.object(converter, 'convert_html_to_docx', side_effect=lambda path: converted.set()):
+                handler = DownloadFolderHandler(converter)
+                start = time.perf_counter()
+                handler.on_created(event)
+                assert time.perf_counter() - start < 0.1
+                assert converted.wait(2)
+            handler.stop()
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
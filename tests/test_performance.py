@@ -0,0 +1,780 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for HTML to DOCX Converter
+
+Run with ``pytest tests/test_performance.py -m performance -s`` to see the
+timing tables. Set HTML_BENCH_CORPUS to a directory of saved pages to
+benchmark against real input instead of the generated corpus.
+"""
+
+import pytest
+import os
+import time
+from pathlib import Path
+import sys
+
+# Add parent directory to path to import the converter
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from html_to_docx_converter import HTMLToDOCXConverter, PARSER_BACKENDS, Stylesheet, EMPTY_DECLARATIONS
+
+
+def generate_saved_page(sections=200):
+    """Generate a page shaped like a saved article with nav, text, lists and tables"""
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Saved page</title>",
+        "<style>body { font-family: Arial; } .note { color: #555555; }</style></head><body>",
+        "<nav><ul>" + "".join(f"<li><a href='/p{i}'>Link {i}</a></li>" for i in range(20)) + "</ul></nav>",
+    ]
+    for i in range(sections):
+        parts.append(
+            f"<section><h2>Section {i}</h2>"
+            f"<p style='font-size: 14px'>Paragraph {i} with <strong>bold</strong>, "
+            f"<em>italic</em> and <span style='color: #ff0000'>red</span> text.</p>"
+            f"<div class='note'><p>Nested note {i}</p></div>"
+            "<table><tr><th>Key</th><th>Value</th></tr>"
+            + "".join(f"<tr><td>k{j}</td><td>v{j}</td></tr>" for j in range(5))
+            + "</table></section>"
+        )
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def load_corpus():
+    """Return a list of (name, html) pairs to benchmark against"""
+    corpus_dir = os.environ.get('HTML_BENCH_CORPUS')
+    if corpus_dir:
+        return [(path.name, path.read_bytes()) for path in sorted(Path(corpus_dir).glob('*.htm*'))]
+    return [('generated-small', generate_saved_page(10)), ('generated-large', generate_saved_page(2000))]
+
+
+def best_of(func, repeat=3):
+    """Return the best wall-clock time of several runs"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@pytest.mark.performance
+class TestParserBackendPerformance:
+    """Parse cost per parser backend"""
+
+    def test_parse_cost_per_backend(self):
+        """Report parse time for every installed backend on the corpus"""
+        backends = [name for name in PARSER_BACKENDS if HTMLToDOCXConverter.parser_available(name)]
+        print(f"\n{'document':<24}{'size':>12}" + "".join(f"{name:>14}" for name in backends))
+
+        for name, html in load_corpus():
+            row = f"{name:<24}{len(html):>12}"
+            for backend in backends:
+                elapsed = best_of(lambda: BeautifulSoup(html, backend))
+                row += f"{elapsed * 1000:>12.1f}ms"
+            print(row)
+
+        assert backends
+
+    def test_auto_backend_not_slower_than_html_parser(self):
+        """The auto-selected backend is at least as fast as html.parser on large input"""
+        if not HTMLToDOCXConverter.parser_available('lxml'):
+            pytest.skip("lxml not installed")
+        html = generate_saved_page(2000)
+        converter = HTMLToDOCXConverter()
+        auto_time = best_of(lambda: converter._parse_html(html))
+        baseline_time = best_of(lambda: BeautifulSoup(html, 'html.parser'))
+        print(f"\nauto: {auto_time * 1000:.1f}ms, html.parser: {baseline_time * 1000:.1f}ms")
+
+        assert auto_time <= baseline_time * 1.1
+
+
+def write_temp_html(html):
+    """Write HTML to a temporary file and return its path"""
+    import tempfile
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as f:
+        f.write(html)
+        return Path(f.name)
+
+
+def measure_conversion(converter, html):
+    """Convert HTML from a temporary file and return (seconds, peak traced bytes)"""
+    import tracemalloc
+    html_path = write_temp_html(html)
+    try:
+        tracemalloc.start()
+        start = time.perf_counter()
+        assert converter.convert_html_to_docx(str(html_path)) is True
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak
+    finally:
+        for path in (html_path, html_path.with_suffix('.docx')):
+            if path.exists():
+                path.unlink()
+
+
+@pytest.mark.performance
+class TestStreamingPerformance:
+    """Peak memory of streaming conversion against a full parse"""
+
+    def test_streaming_peak_memory(self):
+        """Streaming keeps less resident than a full parse of the same page"""
+        html = generate_saved_page(300).replace('<table>', '<!--').replace('</table>', '-->')
+        full_time, full_peak = measure_conversion(HTMLToDOCXConverter(parser='lxml'), html)
+        stream_time, stream_peak = measure_conversion(HTMLToDOCXConverter(streaming=True), html)
+        print(f"\nfull parse: {full_time:.2f}s peak {full_peak / 2**20:.1f} MiB; "
+              f"streaming: {stream_time:.2f}s peak {stream_peak / 2**20:.1f} MiB")
+
+        assert stream_peak < full_peak
+
+
+def generate_div_soup(depth=200, breadth=50):
+    """Generate nested div soup: breadth independent stacks of depth divs"""
+    stack = "<div>" * depth + "text" + "</div>" * depth
+    return "<html><body>" + stack * breadth + "</body></html>"
+
+
+def legacy_dispatch(name):
+    """The if/elif chain _process_html_elements used before the handler table"""
+    if name == 'h1':
+        return 'h1'
+    elif name == 'h2':
+        return 'h2'
+    elif name == 'h3':
+        return 'h3'
+    elif name == 'h4':
+        return 'h4'
+    elif name == 'h5':
+        return 'h5'
+    elif name == 'h6':
+        return 'h6'
+    elif name == 'p':
+        return 'p'
+    elif name == 'br':
+        return 'br'
+    elif name == 'ul':
+        return 'ul'
+    elif name == 'ol':
+        return 'ol'
+    elif name == 'table':
+        return 'table'
+    elif name in ['div', 'span', 'section', 'article']:
+        return 'container'
+    return None
+
+
+@pytest.mark.performance
+class TestDispatchPerformance:
+    """Per-node cost of tag dispatch"""
+
+    def test_dispatch_cost_per_node(self):
+        """Compare the if/elif chain with the handler table on nested div soup"""
+        converter = HTMLToDOCXConverter()
+        soup = BeautifulSoup(generate_div_soup(), 'html.parser')
+        names = [tag.name for tag in soup.find_all(True)]
+        handlers = converter._element_handlers
+        default = converter._handle_container
+
+        def chain():
+            for name in names:
+                legacy_dispatch(name)
+
+        def table():
+            for name in names:
+                handlers.get(name, default)
+
+        chain_time = best_of(chain, repeat=5)
+        table_time = best_of(table, repeat=5)
+        print(f"\n{len(names)} nodes: if/elif {chain_time / len(names) * 1e9:.0f} ns/node, "
+              f"table {table_time / len(names) * 1e9:.0f} ns/node")
+
+        assert table_time < chain_time
+
+
+@pytest.mark.performance
+class TestTraversalPerformance:
+    """Traversal cost on deeply nested documents"""
+
+    def test_deep_nesting_is_linear(self):
+        """Doubling the nesting depth roughly doubles conversion time"""
+        import gc
+        gc.collect()
+        from bs4 import BeautifulSoup as Soup
+        from docx import Document
+        converter = HTMLToDOCXConverter()
+        timings = {}
+        for depth in (10000, 20000, 40000):
+            html = "<html><body>" + "<div>" * depth + "x" + "</div>" * depth + "</body></html>"
+            body = Soup(html, 'lxml').body
+            timings[depth] = best_of(lambda: converter._process_html_elements(body, Document(), Stylesheet()))
+            print(f"\ndepth {depth}: {timings[depth]:.2f}s")
+
+        assert timings[40000] < timings[10000] * 4 * 2
+
+
+def generate_framework_css(rule_count=4000):
+    """Generate a framework-sized style sheet of mostly class-keyed rules"""
+    rules = []
+    for i in range(rule_count):
+        kind = i % 4
+        if kind == 0:
+            rules.append(f".c{i} {{ color: #{i % 256:02x}0000; }}")
+        elif kind == 1:
+            rules.append(f".wrap .c{i} > span {{ font-weight: bold; }}")
+        elif kind == 2:
+            rules.append(f"#id{i} {{ font-size: {10 + i % 8}px; }}")
+        else:
+            rules.append(f"div.c{i} p {{ text-align: center; }}")
+    rules.append("p { line-height: 18px; }")
+    return "\n".join(rules)
+
+
+@pytest.mark.performance
+class TestCascadePerformance:
+    """Selector matching cost with framework-sized style sheets"""
+
+    def test_indexed_matching_against_naive(self):
+        """The indexed matcher beats testing every rule against every element"""
+        from html_to_docx_converter import _selector_matches
+        converter = HTMLToDOCXConverter()
+        stylesheet = Stylesheet()
+        converter._add_css_rules(stylesheet, generate_framework_css())
+        soup = BeautifulSoup(generate_saved_page(200).replace("<p ", "<p class='c4 c8' "), 'lxml')
+        elements = soup.find_all(True)
+
+        def indexed():
+            stylesheet._match_cache.clear()
+            for element in elements:
+                stylesheet.match(element)
+
+        def naive():
+            for element in elements:
+                [rule for rule in stylesheet.rules if _selector_matches(rule.compounds, 0, element)]
+
+        indexed_time = best_of(indexed, repeat=3)
+        naive_time = best_of(naive, repeat=1)
+        print(f"\n{len(stylesheet)} rules x {len(elements)} elements: "
+              f"indexed {indexed_time * 1000:.1f}ms, naive {naive_time * 1000:.1f}ms")
+
+        assert indexed_time * 10 < naive_time
+
+
+@pytest.mark.performance
+class TestCSSParserPerformance:
+    """Style sheet parse cost on framework-sized input"""
+
+    def test_tokenizer_against_regex(self):
+        """The tokenizer stays linear where the old regex backtracks"""
+        import re
+        from html_to_docx_converter import iter_css_rules
+
+        def regex_parse(css_text):
+            return re.findall(r'([^{]+)\{([^}]+)\}', css_text)
+
+        framework = "@media screen { .s { color: red } }\n/* comment */\n" + generate_framework_css(20000)
+        # A long run of text without braces, as left by an unterminated comment
+        # or a minified sheet cut short, makes the regex retry from every offset.
+        pathological = "a" * 20000
+
+        timings = {}
+        for name, css_text in (('framework', framework), ('no braces', pathological)):
+            tokenizer_time = best_of(lambda: list(iter_css_rules(css_text)))
+            regex_time = best_of(lambda: regex_parse(css_text), repeat=1)
+            timings[name] = (tokenizer_time, regex_time)
+            print(f"\n{name} ({len(css_text) // 1024} KB): tokenizer {tokenizer_time * 1000:.1f}ms, "
+                  f"regex {regex_time * 1000:.1f}ms")
+
+        assert timings['framework'][0] < 1.0
+        assert timings['no braces'][0] < timings['no braces'][1]
+
+
+@pytest.mark.performance
+class TestMixedContentPerformance:
+    """Run formatting cost on paragraphs with many inline fragments"""
+
+    def test_fragment_count_scales_linearly(self):
+        """Doubling the fragments in one paragraph roughly doubles its cost"""
+        from docx import Document
+        converter = HTMLToDOCXConverter()
+        timings = {}
+        for fragments in (1000, 2000, 4000):
+            html = ("<html><body><p style='color: #333333; font-size: 12px'>"
+                    + "text <b>bold</b> <span style='color: #ff0000'>red</span> " * (fragments // 3)
+                    + "</p></body></html>")
+            body = BeautifulSoup(html, 'lxml').body
+            timings[fragments] = best_of(lambda: converter._process_html_elements(body, Document(), Stylesheet()))
+            print(f"\n{fragments} fragments: {timings[fragments] * 1000:.1f}ms")
+
+        assert timings[4000] < timings[1000] * 4 * 2
+
+
+@pytest.mark.performance
+class TestRunFormattingPerformance:
+    """Per-run cost of character formatting"""
+
+    def test_cached_properties_against_setters(self):
+        """Attaching a cached rPr beats calling the python-docx setters per run"""
+        from docx import Document
+        from html_to_docx_converter import _set_run_properties, parse_declarations
+        converter = HTMLToDOCXConverter()
+        style = parse_declarations('font-size: 12px; font-weight: bold; font-style: italic; '
+                                   'color: #336699; text-decoration: underline')
+        runs = 20000
+
+        def setters():
+            paragraph = Document().add_paragraph()
+            for _ in range(runs):
+                _set_run_properties(paragraph.add_run('x'), style)
+
+        def cached():
+            paragraph = Document().add_paragraph()
+            for _ in range(runs):
+                converter._format_run(paragraph.add_run('x'), style)
+
+        setter_time = best_of(setters)
+        cached_time = best_of(cached)
+        print(f"\n{runs} runs: setters {setter_time / runs * 1e6:.1f} us/run, "
+              f"cached rPr {cached_time / runs * 1e6:.1f} us/run")
+
+        assert cached_time < setter_time
+
+
+def generate_cms_export(paragraphs=5000):
+    """Generate a CMS export where every paragraph and span carries inline styles"""
+    parts = ["<html><body>"]
+    for i in range(paragraphs):
+        parts.append(
+            "<p style='text-align: justify; line-height: 20px; font-size: 14px; color: #333333'>"
+            f"Body text {i} <span style='font-weight: bold; color: #1a1a1a'>lead-in</span> more "
+            "<em>emphasis</em> and <a href='#'>link</a>.</p>"
+        )
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+@pytest.mark.performance
+class TestNamedStylePerformance:
+    """Output size and save time with named styles instead of direct formatting"""
+
+    def test_named_styles_shrink_document(self):
+        """Registering recurring formatting makes document.xml smaller"""
+        import io
+        import zipfile
+        from docx import Document
+        html_path = write_temp_html(generate_cms_export())
+        try:
+            results = {}
+            for named in (False, True):
+                converter = HTMLToDOCXConverter(named_styles=named)
+                doc = Document()
+                converter._parse_html_to_doc(html_path, doc)
+                start = time.perf_counter()
+                if named:
+                    converter._register_named_styles(doc)
+                register_time = time.perf_counter() - start
+                save_time = best_of(lambda: doc.save(io.BytesIO()))
+                output = io.BytesIO()
+                doc.save(output)
+                document_xml = zipfile.ZipFile(output).getinfo('word/document.xml').file_size
+                results[named] = (document_xml, register_time, save_time)
+                print(f"\nnamed_styles={named}: document.xml {document_xml / 1024:.0f} KiB, "
+                      f"register {register_time * 1000:.0f}ms, save {save_time * 1000:.0f}ms")
+        finally:
+            html_path.unlink()
+
+        assert results[True][0] < results[False][0] * 0.9
+
+
+def generate_table(rows=20000, columns=5):
+    """Generate a page holding one large data table"""
+    header = "<tr>" + "".join(f"<th>Column {j}</th>" for j in range(columns)) + "</tr>"
+    body = "".join("<tr>" + "".join(f"<td>r{i}c{j}</td>" for j in range(columns)) + "</tr>" for i in range(rows))
+    return f"<html><body><table>{header}{body}</table></body></html>"
+
+
+@pytest.mark.performance
+class TestTablePerformance:
+    """Conversion cost of large tables"""
+
+    def test_large_table_converts_in_seconds(self):
+        """Tens of thousands of rows convert in seconds and scale linearly"""
+        from docx import Document
+        converter = HTMLToDOCXConverter()
+        timings = {}
+        for rows in (5000, 20000):
+            table = BeautifulSoup(generate_table(rows), 'lxml').table
+            timings[rows] = best_of(lambda: converter._process_table(table, Document(), Stylesheet(), EMPTY_DECLARATIONS), repeat=1)
+            print(f"\n{rows} rows x 5 columns: {timings[rows]:.2f}s ({rows / timings[rows]:.0f} rows/s)")
+
+        assert timings[20000] < 10
+        assert timings[20000] < timings[5000] * 4 * 2
+
+
+def generate_merged_table(rows=5000, group=5):
+    """Generate a report table: a spanning band per group and a rowspan label column"""
+    parts = ["<html><body><table><tr><th>Group</th><th>Item</th><th>Qty</th><th>Price</th></tr>"]
+    for start in range(0, rows, group):
+        parts.append(f"<tr><td colspan='4'>Section {start // group}</td></tr>")
+        parts.append(f"<tr><td rowspan='{group - 1}'>G{start}</td><td>i{start}</td><td>1</td><td>2</td></tr>")
+        parts.extend(f"<tr><td>i{start + k}</td><td>1</td><td>2</td></tr>" for k in range(1, group - 1))
+    parts.append("</table></body></html>")
+    return "".join(parts)
+
+
+@pytest.mark.performance
+class TestMergedTablePerformance:
+    """Layout cost of tables with colspan and rowspan"""
+
+    def test_merged_table_against_cell_merge(self):
+        """Grid layout with gridSpan/vMerge beats python-docx cell.merge() per row"""
+        from docx import Document
+        converter = HTMLToDOCXConverter()
+        table = BeautifulSoup(generate_merged_table(5000), 'lxml').table
+        grid_time = best_of(lambda: converter._process_table(table, Document(), Stylesheet(), EMPTY_DECLARATIONS),
+                            repeat=1)
+
+        def merge_rows(rows=250, group=5):
+            word_table = Document().add_table(rows=rows, cols=4)
+            for start in range(0, rows - group + 1, group):
+                word_table.cell(start, 0).merge(word_table.cell(start, 3))
+                word_table.cell(start + 1, 0).merge(word_table.cell(start + group - 1, 0))
+
+        merge_time = best_of(merge_rows, repeat=1)
+        print(f"\n5000 merged rows: grid layout {grid_time:.2f}s ({grid_time / 5000 * 1e6:.0f} us/row); "
+              f"cell.merge() on 250 rows {merge_time:.2f}s ({merge_time / 250 * 1e6:.0f} us/row)")
+
+        assert grid_time < 5
+        assert grid_time / 5000 < merge_time / 250
+
+
+def generate_heat_map(rows=10000, columns=10):
+    """Generate a heat-map table whose cells cycle through 256 background colors"""
+    parts = ["<html><body><table>"]
+    for i in range(rows):
+        parts.append("<tr>" + "".join(
+            f"<td style='background-color: #{(i * columns + j) % 256:02x}4080'>{i * j}</td>"
+            for j in range(columns)) + "</tr>")
+    parts.append("</table></body></html>")
+    return "".join(parts)
+
+
+@pytest.mark.performance
+class TestCellShadingPerformance:
+    """Cost of shading every cell of a large table"""
+
+    def test_heat_map_shading_overhead(self):
+        """Shading a heat map costs little more than the same table unshaded"""
+        import re
+        from docx import Document
+        converter = HTMLToDOCXConverter()
+        html = generate_heat_map()
+        shaded = BeautifulSoup(html, 'lxml').table
+        plain = BeautifulSoup(re.sub(r" style='[^']*'", "", html), 'lxml').table
+        shaded_time = best_of(lambda: converter._process_table(shaded, Document(), Stylesheet(), EMPTY_DECLARATIONS),
+                              repeat=1)
+        plain_time = best_of(lambda: converter._process_table(plain, Document(), Stylesheet(), EMPTY_DECLARATIONS),
+                             repeat=1)
+        print(f"\n100000 cells, 256 fills: shaded {shaded_time:.2f}s, plain {plain_time:.2f}s")
+
+        assert shaded_time < plain_time * 2
+
+
+@pytest.mark.performance
+class TestTemplatePerformance:
+    """Fixed per-file cost of creating the output document"""
+
+    def test_template_copy_against_document(self):
+        """Copying the cached template beats opening default.docx per conversion"""
+        from docx import Document
+        from docx.shared import Inches
+        from html_to_docx_converter import get_document_template
+
+        def open_default():
+            doc = Document()
+            for section in doc.sections:
+                section.top_margin = Inches(0.2)
+                section.bottom_margin = Inches(0.2)
+                section.left_margin = Inches(0.2)
+                section.right_margin = Inches(0.2)
+
+        template = get_document_template()
+        count = 50
+        document_time = best_of(lambda: [open_default() for _ in range(count)]) / count
+        copy_time = best_of(lambda: [template.new_document() for _ in range(count)]) / count
+        styles_time = best_of(lambda: [template.new_document(copy_styles=True) for _ in range(count)]) / count
+        print(f"\nDocument() + margins {document_time * 1000:.2f}ms, template copy {copy_time * 1000:.2f}ms, "
+              f"copy with styles {styles_time * 1000:.2f}ms")
+
+        assert copy_time * 10 < document_time
+
+
+@pytest.mark.performance
+class TestWriterPerformance:
+    """Throughput and peak memory of the python-docx and streaming writers"""
+
+    # Converts one file in a fresh interpreter and prints seconds and how far
+    # peak RSS (VmHWM) rose above the resident size before converting, in KiB.
+    # ru_maxrss is not used: it survives exec, so a child of a large pytest
+    # process would report its parent's peak.
+    RSS_SCRIPT = """
+import re, sys, time
+from html_to_docx_converter import HTMLToDOCXConverter
+
+def status(field):
+    with open('/proc/self/status') as status:
+        return int(re.search(field + r':\\s+(\\d+)', status.read()).group(1))
+
+converter = HTMLToDOCXConverter(streaming=True, writer=sys.argv[2])
+resident = status('VmRSS')
+start = time.perf_counter()
+assert converter.convert_html_to_docx(sys.argv[1]) is True
+print(time.perf_counter() - start, status('VmHWM') - resident)
+"""
+
+    def convert_in_subprocess(self, html, writer):
+        """Return (seconds, peak RSS growth in bytes) of one conversion in its own process"""
+        import subprocess
+        html_path = write_temp_html(html)
+        try:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+            output = subprocess.run([sys.executable, '-c', self.RSS_SCRIPT, str(html_path), writer], env=env,
+                                    cwd=html_path.parent, capture_output=True, text=True, check=True).stdout
+            elapsed, growth = output.split()[-2:]
+            return float(elapsed), int(growth) * 1024
+        finally:
+            for path in (html_path, html_path.with_suffix('.docx')):
+                if path.exists():
+                    path.unlink()
+
+    def test_stream_writer_against_python_docx(self):
+        """With the streaming parser, the stream writer is faster and its peak RSS barely grows with the input"""
+        if not sys.platform.startswith('linux'):
+            pytest.skip("RSS is read from /proc")
+        results = {}
+        for sections in (500, 2000):
+            html = generate_saved_page(sections).replace('<table>', '<!--').replace('</table>', '-->')
+            size = len(html.encode('utf-8')) / 2**20
+            for writer in ('docx', 'stream'):
+                elapsed, growth = self.convert_in_subprocess(html, writer)
+                results[writer, sections] = elapsed, growth
+                print(f"\n{size:.1f} MiB, {writer}: {elapsed:.2f}s ({size / elapsed:.2f} MiB/s) "
+                      f"peak RSS +{growth / 2**20:.1f} MiB", end='')
+        print()
+
+        docx_growth = results['docx', 2000][1] - results['docx', 500][1]
+        stream_growth = results['stream', 2000][1] - results['stream', 500][1]
+        assert stream_growth * 3 < docx_growth
+        assert results['stream', 2000][1] < results['docx', 2000][1]
+        # The stream writer builds w:p and w:r itself instead of through
+        # python-docx's proxies and by-name style lookups
+        assert results['stream', 2000][0] < results['docx', 2000][0] * 0.75
+
+
+@pytest.mark.performance
+class TestPackagingPerformance:
+    """Save time against package size for each compression setting"""
+
+    def test_compression_tradeoff(self):
+        """Store and low deflate levels save faster; higher levels give smaller files"""
+        import io
+        from html_to_docx_converter import PackageOptions, get_document_template, save_package
+
+        doc = get_document_template().new_document()
+        converter = HTMLToDOCXConverter()
+        converter._process_html_elements(BeautifulSoup(generate_cms_export(5000), 'lxml').body, doc, Stylesheet())
+        results = {}
+        for label, options in [('store', PackageOptions('store')), ('deflate 1', PackageOptions(compress_level=1)),
+                               ('deflate default', PackageOptions()), ('deflate 9', PackageOptions(compress_level=9))]:
+            save_time = best_of(lambda: save_package(doc, io.BytesIO(), options))
+            output = io.BytesIO()
+            save_package(doc, output, options)
+            results[label] = save_time, len(output.getvalue())
+            print(f"\n{label}: save {save_time * 1000:.0f}ms, {results[label][1] / 1024:.0f} KiB", end='')
+        print()
+
+        assert results['store'][0] < results['deflate 9'][0]
+        assert results['deflate 9'][1] < results['deflate 1'][1] < results['store'][1]
+
+
+@pytest.mark.performance
+class TestInMemoryPerformance:
+    """Per-document cost of the in-memory API against a temp file round trip"""
+
+    def test_in_memory_against_temp_files(self):
+        """Converting held HTML in memory skips writing, reading and deleting two files"""
+        html = "<html><body>" + "<p>Short paragraph of text</p>" * 10 + "</body></html>"
+        # Store mode, so the fixed cost of compressing the template parts does not mask file I/O
+        converter = HTMLToDOCXConverter(compression='store')
+        count = 200
+
+        def via_temp_files():
+            html_path = write_temp_html(html)
+            assert converter.convert_html_to_docx(str(html_path)) is True
+            docx_path = html_path.with_suffix('.docx')
+            docx_path.read_bytes()
+            docx_path.unlink()
+
+        file_time = best_of(lambda: [via_temp_files() for _ in range(count)]) / count
+        memory_time = best_of(lambda: [converter.convert_string(html).getvalue() for _ in range(count)]) / count
+        print(f"\ntemp files {file_time * 1000:.2f}ms, in memory {memory_time * 1000:.2f}ms per document")
+
+        # The saving is the disk round trips, small next to conversion on a fast temp dir
+        assert memory_time < file_time * 1.25
+
+
+@pytest.mark.performance
+class TestWriteCompletionPerformance:
+    """Delay between a download finishing and its conversion starting"""
+
+    def hand_over_latencies(self, download, count=10):
+        """Run download(directory, index) under a real observer; return sorted finish-to-hand-over delays"""
+        import tempfile
+        import threading
+        from unittest.mock import patch
+        from watchdog.observers import Observer
+        from html_to_docx_converter import DownloadFolderHandler
+
+        handed_over = {}
+        done = threading.Event()
+        converter = HTMLToDOCXConverter()
+
+        def convert(path):
+            handed_over[path] = time.monotonic()
+            if len(handed_over) == count:
+                done.set()
+
+        with tempfile.TemporaryDirectory() as tmp, patch.object(converter, 'convert_html_to_docx', convert):
+            handler = DownloadFolderHandler(converter)
+            observer = Observer()
+            observer.schedule(handler, tmp, recursive=False)
+            observer.start()
+            try:
+                finished = {}
+                for i in range(count):
+                    path = download(tmp, i)
+                    finished[path] = time.monotonic()
+                    time.sleep(0.05)
+                assert done.wait(5)
+            finally:
+                observer.stop()
+                observer.join()
+                handler.stop()
+
+        return sorted(handed_over[path] - finished[path] for path in finished)
+
+    def test_completion_latency(self):
+        """Files are handed over well within the old fixed one second wait"""
+        def download(directory, i):
+            path = os.path.join(directory, f'page{i}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(generate_saved_page(5))
+            return path
+
+        latencies = self.hand_over_latencies(download)
+        print(f"\nhand-over latency: median {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+              f"max {latencies[-1] * 1000:.1f}ms (was a fixed 1000ms sleep)")
+
+        assert latencies[-1] < 0.5
+
+    def test_renamed_download_latency(self):
+        """Downloads renamed from .crdownload are handed over without any stability wait"""
+        def download(directory, i):
+            partial = os.path.join(directory, f'page{i}.html.crdownload')
+            with open(partial, 'w', encoding='utf-8') as f:
+                f.write(generate_saved_page(5))
+            path = os.path.join(directory, f'page{i}.html')
+            os.rename(partial, path)
+            return path
+
+        latencies = self.hand_over_latencies(download)
+        print(f"\nrenamed download latency: median {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+              f"max {latencies[-1] * 1000:.1f}ms")
+
+        assert latencies[-1] < 0.5
+
+
+@pytest.mark.performance
+class TestConversionQueuePerformance:
+    """Head-of-line blocking behind a slow page, with and without a worker pool"""
+
+    def test_slow_page_does_not_stall_others(self):
+        """With two workers, small pages finish while a large page is still converting"""
+        from html_to_docx_converter import ConversionQueue
+
+        converter = HTMLToDOCXConverter(parser='lxml')
+        pages = [generate_saved_page(600)] + [generate_saved_page(2)] * 10
+        results = {}
+        for workers in (1, 2):
+            paths = [write_temp_html(html) for html in pages]
+            finished = {}
+
+            def convert(path):
+                assert converter.convert_html_to_docx(path) is True
+                finished[path] = time.monotonic()
+
+            conversions = ConversionQueue(convert, workers=workers)
+            start = time.monotonic()
+            for path in paths:
+                conversions.submit(str(path))
+            submitted = time.monotonic() - start
+            conversions.join()
+            conversions.stop()
+            for path in paths:
+                path.with_suffix('.docx').unlink()
+
+            large, small = finished[str(paths[0])] - start, max(finished[str(path)] for path in paths[1:]) - start
+            results[workers] = large, small
+            print(f"\n{workers} worker(s): submit {submitted / len(paths) * 1e6:.0f}us/job, "
+                  f"large page done {large:.2f}s, last small page done {small:.2f}s", end='')
+        print()
+
+        assert results[1][1] > results[1][0]
+        assert results[2][1] < results[2][0]
+
+
+@pytest.mark.performance
+class TestProcessPoolPerformance:
+    """Batch throughput of in-process conversion against worker process pools"""
+
+    def test_batch_scaling(self):
+        """Throughput scales with worker processes up to the number of cores"""
+        pages = [generate_saved_page(30)] * 40
+        cores = os.cpu_count() or 1
+
+        def batch():
+            return [write_temp_html(html) for html in pages]
+
+        def clean(paths):
+            for path in paths:
+                path.with_suffix('.docx').unlink()
+
+        converter = HTMLToDOCXConverter(parser='lxml')
+        paths = batch()
+        start = time.perf_counter()
+        for path in paths:
+            assert converter.convert_html_to_docx(str(path)) is True
+        rates = {0: len(pages) / (time.perf_counter() - start)}
+        clean(paths)
+
+        for workers in sorted({1, 2, 4, cores}):
+            with converter.process_pool(workers) as pool:
+                # Start and warm up every worker before timing
+                warm_up = batch()[:workers]
+                list(pool.map(warm_up))
+                clean(warm_up)
+                paths = batch()
+                start = time.perf_counter()
+                assert all(result.ok for result in pool.map(paths))
+                rates[workers] = len(pages) / (time.perf_counter() - start)
+            clean(paths)
+
+        print(f"\n{cores} core(s); files/s in process: {rates[0]:.1f}; " + ", ".join(
+            f"{workers} worker(s): {rate:.1f} ({rate / rates[1]:.1f}x)" for workers, rate in rates.items() if workers))
+
+        assert rates[1] > rates[0] * 0.7
+        if cores >= 4:
+            assert rates[4] > rates[1] * 2.5